@@ -1,4 +1,6 @@
-from . import resources_rc
 def classFactory(iface):
+    # resources_rc (Qt) se importa aquí para que el núcleo (nucleo/) pueda
+    # usarse sin QGIS, p. ej. con `python -m pk_tools.nucleo`
+    from . import resources_rc  # noqa: F401
     from .pk_tools import PKToolsPlugin
     return PKToolsPlugin(iface)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Algoritmo de Processing: Auditoría de calibración
+
+Revisa de una vez toda la capa de carreteras y señala los problemas de
+calibración M que Distancia PK sólo deja ver clic a clic: M que retrocede,
+saltos, huecos y solapes de M entre features consecutivas de una vía,
+tramos con un ratio M / longitud anómalo y segmentos de longitud nula.
+Trabaja sobre las rutas compiladas (arrays), sin crear un QgsPoint por vértice.
+"""
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (
+    QgsCoordinateReferenceSystem, QgsFeature, QgsFeatureSink, QgsField, QgsFields,
+    QgsGeometry, QgsLineString, QgsProcessing, QgsProcessingAlgorithm,
+    QgsProcessingException, QgsProcessingParameterDistance,
+    QgsProcessingParameterFeatureSink, QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterField, QgsProcessingParameterNumber, QgsWkbTypes
+)
+
+from ..nucleo.auditoria import TIPOS, AuditoriaCalibracion, auditar_red
+from ..tools.motor_pk import compilar_rutas, peticion_rutas
+
+EXPECTED_FIELD = "ID_ROAD"
+
+# Número de incidencias que se escriben de cada vez
+TAMANO_BLOQUE = 5000
+
+
+class AuditarCalibracion(QgsProcessingAlgorithm):
+    """Genera una capa de incidencias de calibración y un resumen por vía."""
+
+    RUTAS = "RUTAS"
+    CAMPO_VIA_RUTAS = "CAMPO_VIA_RUTAS"
+    TOLERANCIA_RATIO = "TOLERANCIA_RATIO"
+    LONGITUD_MIN = "LONGITUD_MIN"
+    DISTANCIA_CONEXION = "DISTANCIA_CONEXION"
+    ERRORES = "ERRORES"
+    RESUMEN = "RESUMEN"
+
+    def name(self):
+        return "auditoria_calibracion"
+
+    def displayName(self):
+        return "Auditoría de calibración"
+
+    def group(self):
+        return "Referenciación lineal"
+
+    def groupId(self):
+        return "referenciacion"
+
+    def shortHelpString(self):
+        return (
+            "Revisa la calibración M de todas las features de la capa de carreteras y "
+            "genera una capa de líneas con las incidencias (campo TIPO) y una tabla "
+            "resumen con el número de incidencias de cada tipo por vía.\n\n"
+            "M_NO_MONOTONA: la M retrocede dentro de una parte.\n"
+            "SALTO_M / HUECO_M: entre dos tramos consecutivos de la vía falta calibración; "
+            "en SALTO_M los tramos se tocan, en HUECO_M están separados.\n"
+            "SOLAPE_M: dos tramos consecutivos cubren el mismo rango de M.\n"
+            "DESCONEXION: la M es continua pero los tramos no se tocan.\n"
+            "RATIO_M: la M avanza por unidad de longitud más o menos de lo habitual en "
+            "la red (mediana) según la tolerancia indicada.\n"
+            "SEGMENTO_NULO: vértices repetidos (segmentos de longitud cero)."
+        )
+
+    def createInstance(self):
+        return AuditarCalibracion()
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.RUTAS, "Capa de carreteras calibrada (M)",
+            [QgsProcessing.TypeVectorLine]
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.CAMPO_VIA_RUTAS, "Campo de la vía en la capa de carreteras",
+            EXPECTED_FIELD, self.RUTAS
+        ))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.TOLERANCIA_RATIO, "Desviación admitida del ratio M / longitud (%)",
+            QgsProcessingParameterNumber.Double, 10.0, minValue=0.0
+        ))
+        self.addParameter(QgsProcessingParameterDistance(
+            self.LONGITUD_MIN, "Longitud mínima de tramo para evaluar el ratio", 50.0,
+            self.RUTAS, minValue=0.0
+        ))
+        self.addParameter(QgsProcessingParameterDistance(
+            self.DISTANCIA_CONEXION, "Distancia máxima entre extremos de tramos conectados", 1.0,
+            self.RUTAS, minValue=0.0
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.ERRORES, "Incidencias de calibración", QgsProcessing.TypeVectorLine
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.RESUMEN, "Resumen por vía", QgsProcessing.TypeVector
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        rutas_src = self.parameterAsSource(parameters, self.RUTAS, context)
+        if rutas_src is None:
+            raise QgsProcessingException("No se pudo abrir la capa de carreteras.")
+        if not QgsWkbTypes.hasM(rutas_src.wkbType()):
+            raise QgsProcessingException("La capa de carreteras no tiene valores M.")
+        campo = self.parameterAsString(parameters, self.CAMPO_VIA_RUTAS, context)
+        auditoria = AuditoriaCalibracion(
+            tolerancia_ratio=self.parameterAsDouble(parameters, self.TOLERANCIA_RATIO, context) / 100.0,
+            longitud_min=self.parameterAsDouble(parameters, self.LONGITUD_MIN, context),
+            distancia_conexion=self.parameterAsDouble(parameters, self.DISTANCIA_CONEXION, context),
+        )
+
+        campos_err = QgsFields()
+        campos_err.append(QgsField("VIA", QVariant.String))
+        campos_err.append(QgsField("FID_RUTA", QVariant.LongLong))
+        campos_err.append(QgsField("PARTE", QVariant.Int))
+        campos_err.append(QgsField("TIPO", QVariant.String))
+        campos_err.append(QgsField("M_INI", QVariant.Double))
+        campos_err.append(QgsField("M_FIN", QVariant.Double))
+        campos_err.append(QgsField("VALOR", QVariant.Double))
+        sink_err, dest_err = self.parameterAsSink(
+            parameters, self.ERRORES, context, campos_err,
+            QgsWkbTypes.LineStringM, rutas_src.sourceCrs()
+        )
+        campos_res = QgsFields()
+        campos_res.append(QgsField("VIA", QVariant.String))
+        campos_res.append(QgsField("FEATURES", QVariant.Int))
+        campos_res.append(QgsField("LONGITUD", QVariant.Double))
+        campos_res.append(QgsField("M_MIN", QVariant.Double))
+        campos_res.append(QgsField("M_MAX", QVariant.Double))
+        for tipo in TIPOS:
+            campos_res.append(QgsField(tipo, QVariant.Int))
+        campos_res.append(QgsField("TOTAL", QVariant.Int))
+        sink_res, dest_res = self.parameterAsSink(
+            parameters, self.RESUMEN, context, campos_res,
+            QgsWkbTypes.NoGeometry, QgsCoordinateReferenceSystem()
+        )
+        if sink_err is None or sink_res is None:
+            raise QgsProcessingException("No se pudieron crear las capas de salida.")
+        salida = {self.ERRORES: dest_err, self.RESUMEN: dest_res}
+
+        # 1) Compilar todas las carreteras en una pasada (sólo el campo de vía)
+        feedback.setProgressText("Compilando las carreteras…")
+        rutas, vias = compilar_rutas(rutas_src.getFeatures(peticion_rutas(campo, rutas_src.fields())),
+                                     campo, feedback=feedback)
+        if feedback.isCanceled():
+            return salida
+
+        # 2) Auditar sobre los arrays compilados
+        feedback.setProgressText("Auditando la calibración…")
+        resultado = auditar_red(rutas, vias, auditoria, feedback.isCanceled)
+        if resultado is None:
+            return salida
+        incidencias, resumen = resultado
+
+        # 3) Escribir incidencias y resumen
+        feedback.setProgressText(f"Escribiendo {len(incidencias)} incidencias…")
+        bloque = []
+        total = max(len(incidencias), 1)
+        for n, inc in enumerate(incidencias):
+            if feedback.isCanceled():
+                break
+            feat = QgsFeature(campos_err)
+            if len(inc.puntos) >= 2:
+                xs, ys, ms = zip(*inc.puntos)
+                feat.setGeometry(QgsGeometry(QgsLineString(xs, ys, [], ms)))
+            feat.setAttributes([inc.via, inc.fid, inc.parte, inc.tipo, inc.m_ini, inc.m_fin, inc.valor])
+            bloque.append(feat)
+            if len(bloque) >= TAMANO_BLOQUE:
+                sink_err.addFeatures(bloque, QgsFeatureSink.FastInsert)
+                bloque = []
+                feedback.setProgress(100.0 * n / total)
+        if bloque:
+            sink_err.addFeatures(bloque, QgsFeatureSink.FastInsert)
+
+        for via in sorted(resumen):
+            r = resumen[via]
+            feat = QgsFeature(campos_res)
+            cuentas = [r.incidencias[tipo] for tipo in TIPOS]
+            feat.setAttributes([r.via, r.features, r.longitud, r.m_min, r.m_max] + cuentas + [sum(cuentas)])
+            sink_res.addFeature(feat, QgsFeatureSink.FastInsert)
+
+        por_tipo = {tipo: sum(r.incidencias[tipo] for r in resumen.values()) for tipo in TIPOS}
+        feedback.pushInfo(", ".join(f"{tipo}: {n}" for tipo, n in por_tipo.items()))
+        return salida
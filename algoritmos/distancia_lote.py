@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Algoritmo de Processing: Distancia PK por lotes
+
+Para cada fila (carretera, PK inicial, PK final) de una tabla calcula las
+dos distancias que muestra la herramienta Distancia PK: la diferencia de
+PK según la calibración M y la distancia lineal real medida sobre la
+geometría de la carretera. Las filas de una misma carretera comparten la
+ruta compilada.
+"""
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (
+    QgsFeatureSink, QgsField, QgsFields, QgsProcessing,
+    QgsProcessingAlgorithm, QgsProcessingException,
+    QgsProcessingParameterFeatureSink, QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterField, QgsProcessingUtils, QgsWkbTypes
+)
+
+from ..nucleo.rutas import (
+    ESTADO_FUERA, ESTADO_HUECO, ESTADO_OK, ESTADO_PK_INVALIDO, ESTADO_SIN_VIA
+)
+from ..tools.motor_pk import M_POR_KM, compilar_rutas, distancia_lineal_m, peticion_rutas, pk_desde_valor
+
+EXPECTED_FIELD = "ID_ROAD"
+
+
+class DistanciaPKLote(QgsProcessingAlgorithm):
+    """Añade la distancia por PK y la distancia lineal a cada par de PKs de una tabla."""
+
+    RUTAS = "RUTAS"
+    CAMPO_VIA_RUTAS = "CAMPO_VIA_RUTAS"
+    TABLA = "TABLA"
+    CAMPO_VIA = "CAMPO_VIA"
+    CAMPO_PK_INI = "CAMPO_PK_INI"
+    CAMPO_PK_FIN = "CAMPO_PK_FIN"
+    OUTPUT = "OUTPUT"
+
+    def name(self):
+        return "distancia_pk_lote"
+
+    def displayName(self):
+        return "Distancia PK por lotes"
+
+    def group(self):
+        return "Referenciación lineal"
+
+    def groupId(self):
+        return "referenciacion"
+
+    def shortHelpString(self):
+        return (
+            "Para cada fila (carretera, PK inicial, PK final) añade DIST_PK (diferencia "
+            "de PK en km según la calibración M) y DIST_LINEAL (longitud real en km "
+            "medida sobre la geometría, sumando todas las features y partes de la vía "
+            "entre ambos PKs).\n\n"
+            "Comparar ambas columnas permite auditar tramos completos en los que la "
+            "calibración no coincide con la geometría. El campo ESTADO indica las filas "
+            "que no se han podido medir."
+        )
+
+    def createInstance(self):
+        return DistanciaPKLote()
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.RUTAS, "Capa de carreteras calibrada (M)",
+            [QgsProcessing.TypeVectorLine]
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.CAMPO_VIA_RUTAS, "Campo de la vía en la capa de carreteras",
+            EXPECTED_FIELD, self.RUTAS
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.TABLA, "Tabla de pares de PKs", [QgsProcessing.TypeVector]
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.CAMPO_VIA, "Campo de la vía en la tabla", EXPECTED_FIELD, self.TABLA
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.CAMPO_PK_INI, "Campo del PK inicial (km)", "PK_INI", self.TABLA
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.CAMPO_PK_FIN, "Campo del PK final (km)", "PK_FIN", self.TABLA
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, "Distancias entre PKs", QgsProcessing.TypeVector
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        rutas_src = self.parameterAsSource(parameters, self.RUTAS, context)
+        tabla = self.parameterAsSource(parameters, self.TABLA, context)
+        if rutas_src is None or tabla is None:
+            raise QgsProcessingException("No se pudieron abrir las capas de entrada.")
+        if not QgsWkbTypes.hasM(rutas_src.wkbType()):
+            raise QgsProcessingException("La capa de carreteras no tiene valores M.")
+        campo_rutas = self.parameterAsString(parameters, self.CAMPO_VIA_RUTAS, context)
+        campo_via = self.parameterAsString(parameters, self.CAMPO_VIA, context)
+        campo_ini = self.parameterAsString(parameters, self.CAMPO_PK_INI, context)
+        campo_fin = self.parameterAsString(parameters, self.CAMPO_PK_FIN, context)
+
+        nuevos = QgsFields()
+        nuevos.append(QgsField("DIST_PK", QVariant.Double))
+        nuevos.append(QgsField("DIST_LINEAL", QVariant.Double))
+        nuevos.append(QgsField("ESTADO", QVariant.String))
+        fields = QgsProcessingUtils.combineFields(tabla.fields(), nuevos)
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields,
+            tabla.wkbType(), tabla.sourceCrs()
+        )
+        if sink is None:
+            raise QgsProcessingException("No se pudo crear la capa de salida.")
+
+        # 1) Leer la tabla (conservando su geometría, si la tiene) y agrupar por vía
+        feedback.setProgressText("Leyendo la tabla de pares de PKs…")
+        grupos = {}      # via -> [(feature, pk_ini, pk_fin)]
+        invalidas = []
+        for f in tabla.getFeatures():
+            if feedback.isCanceled():
+                return {self.OUTPUT: dest_id}
+            via = f[campo_via]
+            pk_ini, pk_fin = pk_desde_valor(f[campo_ini]), pk_desde_valor(f[campo_fin])
+            if not via or pk_ini is None or pk_fin is None:
+                invalidas.append(f)
+            else:
+                grupos.setdefault(via, []).append((f, pk_ini, pk_fin))
+
+        # 2) Compilar una sola vez las carreteras que aparecen en la tabla
+        feedback.setProgressText("Compilando las carreteras de la tabla…")
+        req = peticion_rutas(campo_rutas, rutas_src.fields(), set(grupos))
+        rutas, tramos_vias = compilar_rutas(rutas_src.getFeatures(req), campo_rutas, set(grupos), feedback)
+
+        def escribir(feat, dist_pk, dist_lineal, estado):
+            feat.setAttributes(feat.attributes() + [dist_pk, dist_lineal, estado])
+            sink.addFeature(feat, QgsFeatureSink.FastInsert)
+
+        for f in invalidas:
+            escribir(f, None, None, ESTADO_PK_INVALIDO)
+
+        # 3) Medir cada par sobre la ruta compartida de su vía
+        feedback.setProgressText("Midiendo distancias…")
+        total = max(len(grupos), 1)
+        for n, (via, filas) in enumerate(grupos.items()):
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(100.0 * n / total)
+            tramos = tramos_vias.get(via)
+            for f, pk_ini, pk_fin in filas:
+                if tramos is None:
+                    escribir(f, None, None, ESTADO_SIN_VIA)
+                    continue
+                m_ini, m_fin = pk_ini * M_POR_KM, pk_fin * M_POR_KM
+                estado = ESTADO_OK
+                for m in (m_ini, m_fin):
+                    if not tramos.buscar(m):
+                        estado = ESTADO_HUECO if tramos.hueco_en(m) else ESTADO_FUERA
+                        break
+                if estado != ESTADO_OK:
+                    escribir(f, None, None, estado)
+                    continue
+                dist_pk = abs(pk_fin - pk_ini)                                      # km
+                dist_lineal = distancia_lineal_m(tramos, rutas.get, m_ini, m_fin)  # unidades de capa
+                escribir(f, dist_pk, dist_lineal / 1000.0, estado)                  # a km (si capa métrica)
+
+        return {self.OUTPUT: dest_id}
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Algoritmo de Processing: Identificar PK por lotes
+
+Asigna a cada punto de una capa la carretera más cercana, su PK interpolado
+por M y la distancia del punto al eje. Usa la misma proyección e
+interpolación que la herramienta Identificar PK, pero sin pasar por la
+barra de mensajes: las carreteras se compilan una sola vez y los puntos se
+procesan por bloques contra la rejilla de segmentos. Cada parte de un
+multipunto se identifica por separado y sale como un punto propio.
+"""
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (
+    QgsCoordinateTransform, QgsFeature, QgsFeatureSink, QgsField,
+    QgsFields, QgsGeometry, QgsProcessing, QgsProcessingAlgorithm,
+    QgsProcessingException, QgsProcessingParameterDistance,
+    QgsProcessingParameterFeatureSink, QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterField, QgsProcessingUtils, QgsWkbTypes
+)
+
+from ..nucleo.rejilla import RejillaSegmentos
+from ..tools.motor_pk import compilar_feature, formato_pk, peticion_rutas
+from ..tools.transformaciones_pk import transformar_xy
+
+EXPECTED_FIELD = "ID_ROAD"
+
+# Número de puntos que se leen y escriben de cada vez
+TAMANO_BLOQUE = 5000
+
+
+class IdentificarPKLote(QgsProcessingAlgorithm):
+    """Añade carretera, PK y distancia al eje a cada punto de una capa."""
+
+    RUTAS = "RUTAS"
+    CAMPO_VIA_RUTAS = "CAMPO_VIA_RUTAS"
+    PUNTOS = "PUNTOS"
+    DISTANCIA_MAX = "DISTANCIA_MAX"
+    OUTPUT = "OUTPUT"
+
+    def name(self):
+        return "identificar_pk_lote"
+
+    def displayName(self):
+        return "Identificar PK por lotes"
+
+    def group(self):
+        return "Referenciación lineal"
+
+    def groupId(self):
+        return "referenciacion"
+
+    def shortHelpString(self):
+        return (
+            "Busca para cada punto la carretera calibrada más cercana y añade los campos "
+            "ID_ROAD, PK (km), PK_STR (formato km+000) y DIST_EJE (distancia del punto "
+            "a la carretera, en unidades de la capa de carreteras).\n\n"
+            "Los puntos a más de la distancia máxima de cualquier carretera quedan con "
+            "esos campos vacíos. Una distancia máxima de 0 no limita la búsqueda.\n\n"
+            "La salida es una capa de puntos simples: cada parte de un multipunto se "
+            "identifica por separado y se escribe como un punto con los atributos de "
+            "su feature."
+        )
+
+    def createInstance(self):
+        return IdentificarPKLote()
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.RUTAS, "Capa de carreteras calibrada (M)",
+            [QgsProcessing.TypeVectorLine]
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.CAMPO_VIA_RUTAS, "Campo de la vía en la capa de carreteras",
+            EXPECTED_FIELD, self.RUTAS
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.PUNTOS, "Capa de puntos", [QgsProcessing.TypeVectorPoint]
+        ))
+        self.addParameter(QgsProcessingParameterDistance(
+            self.DISTANCIA_MAX, "Distancia máxima de búsqueda", 50.0, self.RUTAS, minValue=0.0
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, "Puntos con PK", QgsProcessing.TypeVectorPoint
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        rutas_src = self.parameterAsSource(parameters, self.RUTAS, context)
+        puntos = self.parameterAsSource(parameters, self.PUNTOS, context)
+        if rutas_src is None or puntos is None:
+            raise QgsProcessingException("No se pudieron abrir las capas de entrada.")
+        if not QgsWkbTypes.hasM(rutas_src.wkbType()):
+            raise QgsProcessingException("La capa de carreteras no tiene valores M.")
+        campo = self.parameterAsString(parameters, self.CAMPO_VIA_RUTAS, context)
+        dist_max = self.parameterAsDouble(parameters, self.DISTANCIA_MAX, context)
+
+        nuevos = QgsFields()
+        nuevos.append(QgsField("ID_ROAD", QVariant.String))
+        nuevos.append(QgsField("PK", QVariant.Double))
+        nuevos.append(QgsField("PK_STR", QVariant.String))
+        nuevos.append(QgsField("DIST_EJE", QVariant.Double))
+        fields = QgsProcessingUtils.combineFields(puntos.fields(), nuevos)
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields,
+            QgsWkbTypes.singleType(puntos.wkbType()), puntos.sourceCrs()
+        )
+        if sink is None:
+            raise QgsProcessingException("No se pudo crear la capa de salida.")
+
+        # 1) Compilar todas las carreteras y la rejilla de segmentos (el único
+        #    índice que usa la búsqueda) en una pasada
+        feedback.setProgressText("Compilando la capa de carreteras…")
+        req = peticion_rutas(campo, rutas_src.fields())
+        rutas = {}
+        for f in rutas_src.getFeatures(req):
+            if feedback.isCanceled():
+                return {self.OUTPUT: dest_id}
+            ruta = compilar_feature(f, campo)
+            rutas[ruta.fid] = ruta
+        segmentos = RejillaSegmentos(rutas.values())
+
+        # 2) Una única transformación puntos -> carreteras para todo el proceso
+        xf = None
+        if puntos.sourceCrs() != rutas_src.sourceCrs():
+            xf = QgsCoordinateTransform(puntos.sourceCrs(), rutas_src.sourceCrs(),
+                                        context.transformContext())
+
+        # 3) Procesar los puntos por bloques (una transformación en bloque por cada uno)
+        feedback.setProgressText("Identificando PKs…")
+        total = max(puntos.featureCount(), 1)
+        bloque = []
+        for n, f in enumerate(puntos.getFeatures()):
+            if feedback.isCanceled():
+                break
+            bloque.append(f)
+            if len(bloque) >= TAMANO_BLOQUE:
+                sink.addFeatures(self._identificar(bloque, xf, segmentos, rutas, dist_max),
+                                 QgsFeatureSink.FastInsert)
+                bloque = []
+                feedback.setProgress(100.0 * n / total)
+        if bloque:
+            sink.addFeatures(self._identificar(bloque, xf, segmentos, rutas, dist_max),
+                             QgsFeatureSink.FastInsert)
+
+        return {self.OUTPUT: dest_id}
+
+    @staticmethod
+    def _identificar(feats, xf, segmentos, rutas, dist_max):
+        """
+        Devuelve las features de salida con los campos de PK rellenos (o
+        vacíos). Los multipuntos se separan en una feature por parte.
+        """
+        # Un punto por feature de salida y transformación de todos a la vez
+        salida, con_punto, xs, ys = [], [], [], []
+        for feat in feats:
+            geom = feat.geometry()
+            if geom is None or geom.isEmpty():
+                salida.append(feat)
+                continue
+            partes = [feat]
+            if geom.isMultipart():
+                partes = []
+                for parte in geom.constParts():
+                    f = QgsFeature(feat)
+                    f.setGeometry(QgsGeometry(parte.clone()))
+                    partes.append(f)
+            for f in partes:
+                pt = f.geometry().asPoint()
+                con_punto.append(len(salida))
+                xs.append(pt.x())
+                ys.append(pt.y())
+                salida.append(f)
+        xs, ys = transformar_xy(xf, xs, ys)
+
+        extras = [[None, None, None, None] for _ in salida]
+        for i, x, y in zip(con_punto, xs, ys):
+            best = segmentos.mas_cercano(x, y, rutas.get, dist_max)
+            if best is not None:
+                extras[i] = [best.ruta.via, best.pk, formato_pk(best.pk), best.separacion]
+        for feat, extra in zip(salida, extras):
+            feat.setAttributes(feat.attributes() + extra)
+        return salida
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Algoritmo de Processing: Localizar PK por lotes
+
+Geocodifica una tabla de (carretera, PK) sobre una capa calibrada con M y
+genera una capa de puntos con el estado de cada fila y la feature de la
+carretera sobre la que se ha situado. Usa la misma interpolación que la
+herramienta Localizar PK. La tabla se lee por bloques, que se sitúan
+agrupados por vía y se escriben en el orden de entrada.
+"""
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (
+    QgsFeature, QgsFeatureRequest, QgsFeatureSink, QgsField, QgsFields,
+    QgsGeometry, QgsPointXY, QgsProcessing, QgsProcessingAlgorithm,
+    QgsProcessingException, QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterFeatureSource, QgsProcessingParameterField,
+    QgsWkbTypes
+)
+
+from ..nucleo.rutas import (
+    ESTADO_FUERA, ESTADO_HUECO, ESTADO_OK, ESTADO_PK_INVALIDO, ESTADO_SIN_VIA, ESTADO_SOLAPE
+)
+from ..tools.motor_pk import M_POR_KM, compilar_rutas, peticion_rutas, pk_desde_valor
+
+EXPECTED_FIELD = "ID_ROAD"
+
+# Número de filas que se leen y escriben de cada vez
+TAMANO_BLOQUE = 5000
+
+
+class LocalizarPKLote(QgsProcessingAlgorithm):
+    """Sitúa en el mapa todas las filas (carretera, PK) de una tabla."""
+
+    RUTAS = "RUTAS"
+    CAMPO_VIA_RUTAS = "CAMPO_VIA_RUTAS"
+    TABLA = "TABLA"
+    CAMPO_VIA = "CAMPO_VIA"
+    CAMPO_PK = "CAMPO_PK"
+    OUTPUT = "OUTPUT"
+
+    def name(self):
+        return "localizar_pk_lote"
+
+    def displayName(self):
+        return "Localizar PK por lotes"
+
+    def group(self):
+        return "Referenciación lineal"
+
+    def groupId(self):
+        return "referenciacion"
+
+    def shortHelpString(self):
+        return (
+            "Sitúa cada fila (carretera, PK) de una tabla sobre la capa de carreteras "
+            "calibrada con valores M y devuelve una capa de puntos.\n\n"
+            "El PK puede ser numérico en km (12.345) o texto (12+345). "
+            "El campo ESTADO indica si el punto se ha situado (OK), si el PK aparece "
+            "en varios tramos (SOLAPE), si cae en un hueco de calibración (HUECO), "
+            "si queda fuera de la vía (FUERA_DE_RANGO), si la vía no existe "
+            "(VIA_NO_ENCONTRADA) o si el PK no es válido (PK_INVALIDO). "
+            "FID_RUTA es la feature de la capa de carreteras utilizada. "
+            "Las filas de salida conservan el orden de la tabla."
+        )
+
+    def createInstance(self):
+        return LocalizarPKLote()
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.RUTAS, "Capa de carreteras calibrada (M)",
+            [QgsProcessing.TypeVectorLine]
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.CAMPO_VIA_RUTAS, "Campo de la vía en la capa de carreteras",
+            EXPECTED_FIELD, self.RUTAS
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.TABLA, "Tabla de PKs", [QgsProcessing.TypeVector]
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.CAMPO_VIA, "Campo de la vía en la tabla", EXPECTED_FIELD, self.TABLA
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.CAMPO_PK, "Campo del PK (km) en la tabla", "PK", self.TABLA
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, "PKs localizados", QgsProcessing.TypeVectorPoint
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        rutas_src = self.parameterAsSource(parameters, self.RUTAS, context)
+        tabla = self.parameterAsSource(parameters, self.TABLA, context)
+        if rutas_src is None or tabla is None:
+            raise QgsProcessingException("No se pudieron abrir las capas de entrada.")
+        if not QgsWkbTypes.hasM(rutas_src.wkbType()):
+            raise QgsProcessingException("La capa de carreteras no tiene valores M.")
+        campo_rutas = self.parameterAsString(parameters, self.CAMPO_VIA_RUTAS, context)
+        campo_via = self.parameterAsString(parameters, self.CAMPO_VIA, context)
+        campo_pk = self.parameterAsString(parameters, self.CAMPO_PK, context)
+
+        fields = QgsFields(tabla.fields())
+        fields.append(QgsField("ESTADO", QVariant.String))
+        fields.append(QgsField("FID_RUTA", QVariant.LongLong))
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields,
+            QgsWkbTypes.Point, rutas_src.sourceCrs()
+        )
+        if sink is None:
+            raise QgsProcessingException("No se pudo crear la capa de salida.")
+
+        # 1) Vías presentes en la tabla (sólo su campo, sin geometría)
+        feedback.setProgressText("Leyendo las vías de la tabla…")
+        req = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        req.setSubsetOfAttributes([campo_via], tabla.fields())
+        vias = set()
+        for f in tabla.getFeatures(req):
+            if feedback.isCanceled():
+                return {self.OUTPUT: dest_id}
+            if f[campo_via]:
+                vias.add(f[campo_via])
+
+        # 2) Compilar sólo las rutas de esas vías
+        feedback.setProgressText("Compilando las carreteras de la tabla…")
+        req = peticion_rutas(campo_rutas, rutas_src.fields(), vias)
+        rutas, tramos_vias = compilar_rutas(rutas_src.getFeatures(req), campo_rutas, vias, feedback)
+
+        # 3) Leer la tabla por bloques y escribir cada bloque en el orden de entrada
+        feedback.setProgressText("Situando PKs…")
+        req = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        total = max(tabla.featureCount(), 1)
+        bloque = []   # [(via, m o None, atributos)]
+        for n, f in enumerate(tabla.getFeatures(req)):
+            if feedback.isCanceled():
+                break
+            pk = pk_desde_valor(f[campo_pk])
+            bloque.append((f[campo_via], None if pk is None else pk * M_POR_KM, f.attributes()))
+            if len(bloque) >= TAMANO_BLOQUE:
+                sink.addFeatures(self._situar(bloque, fields, rutas, tramos_vias),
+                                 QgsFeatureSink.FastInsert)
+                bloque = []
+                feedback.setProgress(100.0 * n / total)
+        if bloque:
+            sink.addFeatures(self._situar(bloque, fields, rutas, tramos_vias),
+                             QgsFeatureSink.FastInsert)
+
+        return {self.OUTPUT: dest_id}
+
+    @staticmethod
+    def _situar(bloque, fields, rutas, tramos_vias):
+        """
+        Features de salida de un bloque de filas, en el mismo orden. Dentro del
+        bloque las filas se agrupan por vía y se ordenan por M para situarlas
+        en una pasada por tramo.
+        """
+        resultados = [(ESTADO_PK_INVALIDO, None, None)] * len(bloque)   # (estado, fid, punto)
+        grupos = {}   # via -> [índice de fila]
+        for i, (via, m, _) in enumerate(bloque):
+            if via and m is not None:
+                if via in tramos_vias:
+                    grupos.setdefault(via, []).append(i)
+                else:
+                    resultados[i] = (ESTADO_SIN_VIA, None, None)
+
+        for via, indices in grupos.items():
+            tramos = tramos_vias[via]
+            indices.sort(key=lambda i: bloque[i][1])
+            por_tramo = {}   # (fid, parte) -> [índice de fila]
+            for i in indices:
+                m = bloque[i][1]
+                candidatos = tramos.buscar(m)
+                if candidatos:
+                    por_tramo.setdefault(candidatos[0], []).append(i)
+                else:
+                    resultados[i] = (ESTADO_HUECO if tramos.hueco_en(m) else ESTADO_FUERA, None, None)
+
+            for (fid, parte), filas in por_tramo.items():
+                puntos = rutas[fid].puntos_en_m([bloque[i][1] for i in filas], parte)
+                for i, punto in zip(filas, puntos):
+                    if punto is None:
+                        resultados[i] = (ESTADO_FUERA, None, None)
+                    else:
+                        estado = ESTADO_SOLAPE if tramos.solapado_en(bloque[i][1]) else ESTADO_OK
+                        resultados[i] = (estado, fid, punto)
+
+        feats = []
+        for (_, _, attrs), (estado, fid, punto) in zip(bloque, resultados):
+            feat = QgsFeature(fields)
+            if punto is not None:
+                feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(punto[0], punto[1])))
+            feat.setAttributes(list(attrs) + [estado, fid])
+            feats.append(feat)
+        return feats
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Proveedor de Processing de PK Tools
+
+Agrupa los algoritmos por lotes que reutilizan el motor de referenciación
+lineal de las herramientas de mapa.
+"""
+from qgis.PyQt.QtGui import QIcon
+from qgis.core import QgsProcessingProvider
+
+from .auditoria_calibracion import AuditarCalibracion
+from .distancia_lote import DistanciaPKLote
+from .identificar_lote import IdentificarPKLote
+from .localizar_lote import LocalizarPKLote
+from .segmentacion_dinamica import SegmentacionDinamica
+
+
+class ProveedorPK(QgsProcessingProvider):
+    """Proveedor 'PK Tools' de la caja de herramientas de Processing."""
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(LocalizarPKLote())
+        self.addAlgorithm(IdentificarPKLote())
+        self.addAlgorithm(DistanciaPKLote())
+        self.addAlgorithm(SegmentacionDinamica())
+        self.addAlgorithm(AuditarCalibracion())
+
+    def id(self):
+        return "pk_tools"
+
+    def name(self):
+        return "PK Tools"
+
+    def icon(self):
+        return QIcon(":/plugins/pk_tools/icons/identificar.png")
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Algoritmo de Processing: Segmentación dinámica
+
+Convierte una tabla de eventos lineales (carretera, PK inicial, PK final),
+como firmes, limitaciones de velocidad u obras, en una capa de líneas
+recortando la carretera calibrada entre ambos PKs. El recorte atraviesa
+vértices, partes y features de la misma vía y conserva los valores M.
+"""
+import math
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (
+    QgsFeature, QgsFeatureRequest, QgsFeatureSink, QgsField, QgsFields, QgsGeometry,
+    QgsLineString, QgsMultiLineString, QgsProcessing, QgsProcessingAlgorithm,
+    QgsProcessingException, QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterFeatureSource, QgsProcessingParameterField,
+    QgsProcessingUtils, QgsWkbTypes
+)
+
+from ..nucleo.rutas import ESTADO_FUERA, ESTADO_OK, ESTADO_PK_INVALIDO, ESTADO_SIN_VIA
+from ..tools.motor_pk import M_POR_KM, compilar_rutas, peticion_rutas, pk_desde_valor, segmentacion_dinamica
+
+EXPECTED_FIELD = "ID_ROAD"
+
+# El evento se ha recortado, pero la calibración de la vía tiene huecos en su rango
+ESTADO_PARCIAL = "PARCIAL"
+
+# Número de eventos que se escriben de cada vez
+TAMANO_BLOQUE = 5000
+
+
+def geometria_desde_partes(partes):
+    """QgsGeometry MultiLineStringM a partir de polilíneas [(x, y, m), ...]."""
+    multi = QgsMultiLineString()
+    for puntos in partes:
+        if len(puntos) < 2:
+            continue
+        xs, ys, ms = zip(*puntos)
+        multi.addGeometry(QgsLineString(xs, ys, [], ms))
+    return QgsGeometry(multi)
+
+
+class SegmentacionDinamica(QgsProcessingAlgorithm):
+    """Genera líneas a partir de eventos (carretera, PK inicial, PK final)."""
+
+    RUTAS = "RUTAS"
+    CAMPO_VIA_RUTAS = "CAMPO_VIA_RUTAS"
+    TABLA = "TABLA"
+    CAMPO_VIA = "CAMPO_VIA"
+    CAMPO_PK_INI = "CAMPO_PK_INI"
+    CAMPO_PK_FIN = "CAMPO_PK_FIN"
+    OUTPUT = "OUTPUT"
+
+    def name(self):
+        return "segmentacion_dinamica"
+
+    def displayName(self):
+        return "Segmentación dinámica"
+
+    def group(self):
+        return "Referenciación lineal"
+
+    def groupId(self):
+        return "referenciacion"
+
+    def shortHelpString(self):
+        return (
+            "Recorta la carretera calibrada entre el PK inicial y el PK final de cada "
+            "evento de la tabla y genera una capa de líneas (MultiLineStringM) con los "
+            "atributos del evento, su longitud real en km (LONGITUD) y un campo ESTADO.\n\n"
+            "Si la vía está dividida en varias features o partes, el evento las recorre "
+            "todas. ESTADO = PARCIAL indica que la calibración tiene huecos dentro del "
+            "rango del evento."
+        )
+
+    def createInstance(self):
+        return SegmentacionDinamica()
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.RUTAS, "Capa de carreteras calibrada (M)",
+            [QgsProcessing.TypeVectorLine]
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.CAMPO_VIA_RUTAS, "Campo de la vía en la capa de carreteras",
+            EXPECTED_FIELD, self.RUTAS
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.TABLA, "Tabla de eventos", [QgsProcessing.TypeVector]
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.CAMPO_VIA, "Campo de la vía en la tabla", EXPECTED_FIELD, self.TABLA
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.CAMPO_PK_INI, "Campo del PK inicial (km)", "PK_INI", self.TABLA
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.CAMPO_PK_FIN, "Campo del PK final (km)", "PK_FIN", self.TABLA
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, "Eventos segmentados", QgsProcessing.TypeVectorLine
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        rutas_src = self.parameterAsSource(parameters, self.RUTAS, context)
+        tabla = self.parameterAsSource(parameters, self.TABLA, context)
+        if rutas_src is None or tabla is None:
+            raise QgsProcessingException("No se pudieron abrir las capas de entrada.")
+        if not QgsWkbTypes.hasM(rutas_src.wkbType()):
+            raise QgsProcessingException("La capa de carreteras no tiene valores M.")
+        campo_rutas = self.parameterAsString(parameters, self.CAMPO_VIA_RUTAS, context)
+        campo_via = self.parameterAsString(parameters, self.CAMPO_VIA, context)
+        campo_ini = self.parameterAsString(parameters, self.CAMPO_PK_INI, context)
+        campo_fin = self.parameterAsString(parameters, self.CAMPO_PK_FIN, context)
+
+        nuevos = QgsFields()
+        nuevos.append(QgsField("LONGITUD", QVariant.Double))
+        nuevos.append(QgsField("ESTADO", QVariant.String))
+        fields = QgsProcessingUtils.combineFields(tabla.fields(), nuevos)
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields,
+            QgsWkbTypes.MultiLineStringM, rutas_src.sourceCrs()
+        )
+        if sink is None:
+            raise QgsProcessingException("No se pudo crear la capa de salida.")
+
+        # 1) Leer los eventos sin geometría y agruparlos por vía
+        feedback.setProgressText("Leyendo la tabla de eventos…")
+        req = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        grupos = {}      # via -> [(atributos, m_ini, m_fin)]
+        invalidos = []
+        for f in tabla.getFeatures(req):
+            if feedback.isCanceled():
+                return {self.OUTPUT: dest_id}
+            via = f[campo_via]
+            pk_ini, pk_fin = pk_desde_valor(f[campo_ini]), pk_desde_valor(f[campo_fin])
+            if not via or pk_ini is None or pk_fin is None:
+                invalidos.append(f.attributes())
+            else:
+                grupos.setdefault(via, []).append((f.attributes(), pk_ini * M_POR_KM, pk_fin * M_POR_KM))
+
+        # 2) Compilar una sola vez las carreteras con eventos
+        feedback.setProgressText("Compilando las carreteras de la tabla…")
+        req = peticion_rutas(campo_rutas, rutas_src.fields(), set(grupos))
+        rutas, tramos_vias = compilar_rutas(rutas_src.getFeatures(req), campo_rutas, set(grupos), feedback)
+
+        bloque = []
+
+        def escribir(attrs, estado, partes=None):
+            feat = QgsFeature(fields)
+            longitud = None
+            if partes:
+                feat.setGeometry(geometria_desde_partes(partes))
+                longitud = sum(
+                    math.hypot(b[0] - a[0], b[1] - a[1])
+                    for p in partes for a, b in zip(p, p[1:])
+                ) / 1000.0  # a km (si capa métrica)
+            feat.setAttributes(list(attrs) + [longitud, estado])
+            bloque.append(feat)
+            if len(bloque) >= TAMANO_BLOQUE:
+                sink.addFeatures(bloque, QgsFeatureSink.FastInsert)
+                bloque.clear()
+
+        for attrs in invalidos:
+            escribir(attrs, ESTADO_PK_INVALIDO)
+
+        # 3) Segmentar todos los eventos de cada vía a la vez
+        feedback.setProgressText("Segmentando eventos…")
+        total = max(len(grupos), 1)
+        for n, (via, eventos) in enumerate(grupos.items()):
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(100.0 * n / total)
+            tramos = tramos_vias.get(via)
+            if tramos is None:
+                for attrs, _, _ in eventos:
+                    escribir(attrs, ESTADO_SIN_VIA)
+                continue
+            resultados = segmentacion_dinamica(tramos, rutas.get, [(a, b) for _, a, b in eventos])
+            for (attrs, _, _), (partes, completo) in zip(eventos, resultados):
+                if not partes:
+                    escribir(attrs, ESTADO_FUERA)
+                else:
+                    escribir(attrs, ESTADO_OK if completo else ESTADO_PARCIAL, partes)
+
+        if bloque:
+            sink.addFeatures(bloque, QgsFeatureSink.FastInsert)
+        return {self.OUTPUT: dest_id}
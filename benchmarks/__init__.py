@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Banco de pruebas de rendimiento de PK Tools (no forma parte del complemento)."""
@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+"""
+Banco de pruebas de rendimiento de PK Tools
+
+Genera una red sintética, mide la construcción de índices y las consultas
+individuales y por lotes del núcleo (identificar, localizar, distancia,
+segmentación dinámica y auditoría de calibración) y guarda los tiempos en JSON para comparar
+versiones. Como línea base mide también el cálculo por clic anterior al
+núcleo (recorrer los vértices de la feature en cada consulta), con las
+mismas consultas. Si PyQGIS está disponible, mide también QgsSpatialIndex.
+
+    python -m benchmarks.bench_pk --vias 500 --salida actual.json
+    python -m benchmarks.bench_pk --vias 500 --comparar anterior.json
+
+Se ejecuta desde la carpeta del complemento, o desde cualquier carpeta como
+`python ruta/al/complemento/benchmarks/bench_pk.py`. No necesita QGIS.
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+# El núcleo se importa como paquete de primer nivel desde la carpeta del
+# complemento, sea cual sea la carpeta de trabajo y la forma de ejecutarlo
+_CARPETA_COMPLEMENTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _CARPETA_COMPLEMENTO not in sys.path:
+    sys.path.insert(0, _CARPETA_COMPLEMENTO)
+
+from nucleo.auditoria import auditar_red  # noqa: E402
+from nucleo.gpkg import RedGpkg  # noqa: E402
+from nucleo.rejilla import RejillaCajas, RejillaSegmentos, ruta_mas_cercana  # noqa: E402
+from nucleo.rutas import (  # noqa: E402
+    RutaCompilada, distancia_lineal_m, localizar_m, segmentacion_dinamica, tramos_por_via
+)
+
+from benchmarks.red_sintetica import escribir_gpkg, generar_red  # noqa: E402
+
+FORMATO = 1
+
+
+# ============================================================
+# MEDICIÓN
+# ============================================================
+def _estadisticas(tiempos, n=None):
+    """Resumen de una lista de tiempos individuales (s), o de un total si n se indica."""
+    if n is not None:
+        total = tiempos
+        return {"n": n, "total_s": total, "media_us": 1e6 * total / max(n, 1)}
+    tiempos = sorted(tiempos)
+    total = sum(tiempos)
+    return {
+        "n": len(tiempos),
+        "total_s": total,
+        "media_us": 1e6 * total / max(len(tiempos), 1),
+        "p50_us": 1e6 * tiempos[len(tiempos) // 2],
+        "p95_us": 1e6 * tiempos[int(len(tiempos) * 0.95)],
+        "max_us": 1e6 * tiempos[-1],
+    }
+
+
+def _cronometrar(funcion):
+    t0 = time.perf_counter()
+    resultado = funcion()
+    return resultado, time.perf_counter() - t0
+
+
+def _por_consulta(funcion, argumentos):
+    tiempos = []
+    reloj = time.perf_counter
+    for args in argumentos:
+        t0 = reloj()
+        funcion(*args)
+        tiempos.append(reloj() - t0)
+    return _estadisticas(tiempos)
+
+
+def _compilar(red):
+    """Rutas compiladas por fid y TramosVia por vía."""
+    rutas, intervalos = {}, []
+    for f in red:
+        ruta = RutaCompilada(f.fid, f.via, f.partes)
+        rutas[f.fid] = ruta
+        intervalos.extend((f.via, a, b, f.fid, p) for p, a, b in ruta.rangos_m())
+    return rutas, tramos_por_via(intervalos)
+
+
+# Las consultas se generan siempre en el mismo orden con la misma semilla,
+# de modo que el núcleo y la línea base miden exactamente las mismas
+def _puntos_consulta(rnd, rutas, consultas):
+    """Puntos a pocos metros de un vértice aleatorio."""
+    lista = list(rutas.values())
+    puntos = []
+    for _ in range(consultas):
+        r = rnd.choice(lista)
+        i = rnd.randrange(len(r.xs))
+        puntos.append((r.xs[i] + rnd.uniform(-15, 15), r.ys[i] + rnd.uniform(-15, 15)))
+    return puntos
+
+
+def _pks_consulta(rnd, vias, consultas):
+    """Pares (TramosVia, m) con m aleatorio dentro del rango de la vía."""
+    nombres = list(vias)
+    pks = []
+    for _ in range(consultas):
+        tramos = vias[rnd.choice(nombres)]
+        pks.append((tramos, rnd.uniform(tramos.m_min, tramos.m_max)))
+    return pks
+
+
+# ============================================================
+# BANCO DEL NÚCLEO
+# ============================================================
+def medir_nucleo(red, consultas, semilla):
+    rnd = random.Random(semilla)
+    res = {}
+
+    # 1) Índices: compilar rutas, tramos M por vía y rejilla espacial
+    (rutas, vias), t = _cronometrar(lambda: _compilar(red))
+    res["indice.compilar_rutas"] = _estadisticas(t, len(red))
+    rejilla, t = _cronometrar(lambda: RejillaCajas((fid, r.caja()) for fid, r in rutas.items()))
+    res["indice.rejilla"] = _estadisticas(t, len(rutas))
+    segmentos, t = _cronometrar(lambda: RejillaSegmentos(rutas.values()))
+    res["indice.rejilla_segmentos"] = _estadisticas(t, sum(len(r.xs) for r in rutas.values()))
+
+    # 2) Identificar: puntos a pocos metros de un vértice aleatorio
+    puntos = _puntos_consulta(rnd, rutas, consultas)
+    res["identificar.individual"] = _por_consulta(
+        lambda x, y: ruta_mas_cercana(rejilla, rutas.get, x, y, 50.0), puntos
+    )
+    res["identificar.segmentos"] = _por_consulta(
+        lambda x, y: segmentos.mas_cercano(x, y, rutas.get, 50.0), puntos
+    )
+    lejos = [(x + 1e7, y + 1e7) for x, y in puntos[:max(consultas // 10, 1)]]
+    res["identificar.sin_carretera"] = _por_consulta(
+        lambda x, y: ruta_mas_cercana(rejilla, rutas.get, x, y, 50.0), lejos
+    )
+    res["identificar.segmentos_sin_carretera"] = _por_consulta(
+        lambda x, y: segmentos.mas_cercano(x, y, rutas.get, 50.0), lejos
+    )
+
+    # 3) Localizar: PK aleatorio dentro del rango de una vía
+    pks = _pks_consulta(rnd, vias, consultas)
+    res["localizar.individual"] = _por_consulta(
+        lambda tramos, m: localizar_m(tramos, rutas.get, m), pks
+    )
+
+    # 4) Localizar por lotes: PKs ordenados agrupados por (feature, parte)
+    def localizar_lote():
+        por_tramo = {}
+        for tramos, m in sorted(pks, key=lambda p: p[1]):
+            cand = tramos.buscar(m)
+            if cand:
+                por_tramo.setdefault(cand[0], []).append(m)
+        for (fid, parte), ms in por_tramo.items():
+            rutas[fid].puntos_en_m(ms, parte)
+
+    _, t = _cronometrar(localizar_lote)
+    res["localizar.lote"] = _estadisticas(t, len(pks))
+
+    # 5) Distancia lineal entre dos PKs de la misma vía
+    nombres = list(vias)
+    pares = []
+    for _ in range(consultas):
+        tramos = vias[rnd.choice(nombres)]
+        pares.append((tramos, rnd.uniform(tramos.m_min, tramos.m_max),
+                      rnd.uniform(tramos.m_min, tramos.m_max)))
+    res["distancia.individual"] = _por_consulta(
+        lambda tramos, a, b: distancia_lineal_m(tramos, rutas.get, a, b), pares
+    )
+
+    # 6) Segmentación dinámica: todos los eventos de cada vía a la vez
+    eventos = {}
+    for tramos, a, b in pares:
+        eventos.setdefault(tramos.via, []).append((a, b))
+
+    def segmentar():
+        for via, evs in eventos.items():
+            segmentacion_dinamica(vias[via], rutas.get, evs)
+
+    _, t = _cronometrar(segmentar)
+    res["segmentacion.lote"] = _estadisticas(t, len(pares))
+
+    # 7) Auditoría de calibración de toda la red (por vértice)
+    _, t = _cronometrar(lambda: auditar_red(rutas, vias))
+    res["auditoria.red"] = _estadisticas(t, sum(len(r.xs) for r in rutas.values()))
+    return res
+
+
+# ============================================================
+# LÍNEA BASE: RECORRIDO DE VÉRTICES EN CADA CLIC
+# ============================================================
+# Réplica en Python puro del cálculo que hacían las herramientas antes del
+# núcleo: sin arrays compilados, cada consulta recorre la lista de vértices
+# (x, y, m) de la feature. No incluye el coste de leer la feature del
+# proveedor (layer.getFeature), así que es una cota inferior del original.
+def _vertices(f):
+    """Vértices (x, y, m) de todas las partes, como geom.vertices()."""
+    return [v for xs, ys, ms in f.partes for v in zip(xs, ys, ms)]
+
+
+def _punto_mas_cercano(verts, x, y):
+    """(distancia, punto) más cercano sobre la polilínea (geom.nearestPoint)."""
+    best = (math.inf, None)
+    for (x0, y0, _), (x1, y1, _) in zip(verts, verts[1:]):
+        dx, dy = x1 - x0, y1 - y0
+        l2 = dx * dx + dy * dy
+        t = 0.0 if l2 == 0 else max(0.0, min(1.0, ((x - x0) * dx + (y - y0) * dy) / l2))
+        px, py = x0 + t * dx, y0 + t * dy
+        d = math.hypot(x - px, y - py)
+        if d < best[0]:
+            best = (d, (px, py))
+    return best
+
+
+def _distancia_sobre_linea(verts, px, py):
+    """Distancia desde el inicio hasta el punto más cercano (geom.lineLocatePoint)."""
+    best_d, best_a, acum = math.inf, 0.0, 0.0
+    for (x0, y0, _), (x1, y1, _) in zip(verts, verts[1:]):
+        dx, dy = x1 - x0, y1 - y0
+        lon = math.hypot(dx, dy)
+        t = 0.0 if lon == 0 else max(0.0, min(1.0, ((px - x0) * dx + (py - y0) * dy) / (lon * lon)))
+        d = math.hypot(px - (x0 + t * dx), py - (y0 + t * dy))
+        if d < best_d:
+            best_d, best_a = d, acum + t * lon
+        acum += lon
+    return best_a
+
+
+def identificar_por_vertices(rejilla, features, x, y, radio=50.0):
+    """PK (m) en (x, y) como lo calculaba Identificar PK en cada clic, o None."""
+    best = (math.inf, None, None)
+    for _, fid in rejilla.cercanas(x, y, radio)[:5]:
+        verts = _vertices(features[fid])
+        d, punto = _punto_mas_cercano(verts, x, y)
+        if d < best[0]:
+            best = (d, verts, punto)
+    _, verts, punto = best
+    if verts is None or len(verts) < 2:
+        return None
+    dist_clic = _distancia_sobre_linea(verts, *punto)
+    cum = [0.0]
+    for (x0, y0, _), (x1, y1, _) in zip(verts, verts[1:]):
+        cum.append(cum[-1] + math.hypot(x1 - x0, y1 - y0))
+    idx = next((i for i in range(len(cum) - 1) if cum[i] <= dist_clic <= cum[i + 1]), len(cum) - 2)
+    lon = cum[idx + 1] - cum[idx]
+    t = (dist_clic - cum[idx]) / lon if lon > 0 else 0.0
+    return verts[idx][2] + t * (verts[idx + 1][2] - verts[idx][2])
+
+
+def localizar_por_vertices(red, via, m):
+    """
+    Punto (x, y) de `m` en `via` como lo calculaba Localizar PK: recorre las
+    features de la capa hasta la vía y busca el segmento vértice a vértice.
+    El original sólo miraba la primera feature de la vía; aquí se sigue con
+    las siguientes para que todas las consultas tengan respuesta.
+    """
+    for f in red:
+        if f.via != via:
+            continue
+        verts = _vertices(f)
+        ms = [v[2] for v in verts]
+        idx = next((i for i in range(len(ms) - 1) if ms[i] <= m <= ms[i + 1]), None)
+        if idx is None:
+            continue
+        (x0, y0, m0), (x1, y1, m1) = verts[idx], verts[idx + 1]
+        t = (m - m0) / (m1 - m0) if m1 != m0 else 0.0
+        return x0 + t * (x1 - x0), y0 + t * (y1 - y0)
+    return None
+
+
+def medir_linea_base(red, consultas, semilla):
+    """Identificar y localizar con el recorrido de vértices por clic, con las consultas del núcleo."""
+    rnd = random.Random(semilla)
+    rutas, vias = _compilar(red)
+    rejilla = RejillaCajas((fid, r.caja()) for fid, r in rutas.items())
+    features = {f.fid: f for f in red}
+    puntos = _puntos_consulta(rnd, rutas, consultas)
+    pks = _pks_consulta(rnd, vias, consultas)
+    return {
+        "base.identificar_vertices": _por_consulta(
+            lambda x, y: identificar_por_vertices(rejilla, features, x, y), puntos
+        ),
+        "base.localizar_vertices": _por_consulta(
+            lambda tramos, m: localizar_por_vertices(red, tramos.via, m), pks
+        ),
+    }
+
+
+def medir_gpkg(red):
+    """Lectura y compilación de la red desde un GeoPackage (ruta de la línea de comandos)."""
+    res = {}
+    with tempfile.TemporaryDirectory() as carpeta:
+        path = os.path.join(carpeta, "red.gpkg")
+        escribir_gpkg(path, red)
+        red_gpkg = RedGpkg(path)
+        try:
+            _, t = _cronometrar(red_gpkg.cargar_todo)
+        finally:
+            red_gpkg.cerrar()
+        res["gpkg.cargar_todo"] = _estadisticas(t, len(red))
+    return res
+
+
+def medir_qgis(red, consultas, semilla):
+    """QgsSpatialIndex (índice de las herramientas de mapa), si PyQGIS está disponible."""
+    try:
+        from qgis.core import QgsPointXY, QgsRectangle, QgsSpatialIndex
+    except ImportError:
+        return {}
+    rnd = random.Random(semilla)
+    cajas = []
+    for f in red:
+        xs = [x for p in f.partes for x in p[0]]
+        ys = [y for p in f.partes for y in p[1]]
+        cajas.append((f.fid, QgsRectangle(min(xs), min(ys), max(xs), max(ys))))
+
+    def construir():
+        indice = QgsSpatialIndex()
+        for fid, rect in cajas:
+            indice.addFeature(fid, rect)
+        return indice
+
+    indice, t = _cronometrar(construir)
+    res = {"qgis.indice_espacial": _estadisticas(t, len(cajas))}
+    puntos = [(QgsPointXY(rect.center()),) for _, rect in rnd.sample(cajas, min(consultas, len(cajas)))]
+    res["qgis.nearest_neighbor"] = _por_consulta(lambda p: indice.nearestNeighbor(p, 5), puntos)
+    return res
+
+
+# ============================================================
+# RESULTADOS
+# ============================================================
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(actual, anterior):
+    """Imprime la media de cada prueba frente a un JSON anterior (ratio > 1 = más lento)."""
+    print(f"{'prueba':32} {'anterior (us)':>14} {'actual (us)':>14} {'ratio':>7}")
+    for nombre, datos in actual["resultados"].items():
+        previo = anterior.get("resultados", {}).get(nombre)
+        if previo is None:
+            print(f"{nombre:32} {'-':>14} {datos['media_us']:14.1f} {'-':>7}")
+            continue
+        ratio = datos["media_us"] / previo["media_us"] if previo["media_us"] else float("inf")
+        print(f"{nombre:32} {previo['media_us']:14.1f} {datos['media_us']:14.1f} {ratio:7.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banco de pruebas de rendimiento de PK Tools")
+    parser.add_argument("--vias", type=int, default=100)
+    parser.add_argument("--features-por-via", type=int, default=10)
+    parser.add_argument("--vertices-por-feature", type=int, default=50)
+    parser.add_argument("--prob-hueco", type=float, default=0.05)
+    parser.add_argument("--prob-no-monotona", type=float, default=0.02)
+    parser.add_argument("--consultas", type=int, default=2000)
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--sin-gpkg", action="store_true", help="No medir la lectura desde GeoPackage")
+    parser.add_argument("--sin-base", action="store_true",
+                        help="No medir la línea base (recorrido de vértices por clic)")
+    parser.add_argument("--salida", help="Fichero JSON de resultados (por defecto, salida estándar)")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior con el que comparar")
+    args = parser.parse_args(argv)
+
+    parametros = {k: v for k, v in vars(args).items() if k not in ("salida", "comparar")}
+    red = generar_red(
+        args.vias, args.features_por_via, args.vertices_por_feature,
+        prob_hueco=args.prob_hueco, prob_no_monotona=args.prob_no_monotona, semilla=args.semilla
+    )
+    resultados = medir_nucleo(red, args.consultas, args.semilla)
+    if not args.sin_base:
+        resultados.update(medir_linea_base(red, args.consultas, args.semilla))
+    if not args.sin_gpkg:
+        resultados.update(medir_gpkg(red))
+    resultados.update(medir_qgis(red, args.consultas, args.semilla))
+
+    informe = {
+        "formato": FORMATO,
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "parametros": parametros,
+        "resultados": resultados,
+    }
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    elif not args.comparar:
+        print(texto)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(informe, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Generador de redes de carreteras sintéticas calibradas con M
+
+Crea vías como recorridos aleatorios divididos en features consecutivas,
+con calibración continua en metros y, opcionalmente, huecos de calibración
+y tramos con M no monótona. La red se puede usar directamente (lista de
+features) o escribirse en un GeoPackage que QGIS y la línea de comandos
+pueden abrir.
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import math
+import os
+import random
+import sqlite3
+import struct
+from collections import namedtuple
+
+# Feature sintética: partes = [(xs, ys, ms), ...]
+FeatureSintetica = namedtuple("FeatureSintetica", "fid via partes")
+
+SRS_ID = 25830  # ETRS89 / UTM 30N, métrico como las capas de la DGT
+
+
+def generar_red(vias=100, features_por_via=10, vertices_por_feature=50,
+                paso=20.0, prob_hueco=0.0, prob_no_monotona=0.0,
+                extension=500000.0, semilla=1):
+    """
+    Devuelve una lista de FeatureSintetica.
+      vias                 -> número de carreteras
+      features_por_via     -> features en que se divide cada carretera
+      vertices_por_feature -> vértices de cada feature
+      paso                 -> distancia media entre vértices (m)
+      prob_hueco           -> probabilidad de un salto de M entre dos features seguidas
+      prob_no_monotona     -> probabilidad de que una feature tenga un retroceso de M
+      extension            -> lado del cuadrado en el que se reparten las vías (m)
+    """
+    rnd = random.Random(semilla)
+    red = []
+    fid = 1
+    for v in range(vias):
+        via = f"V-{v + 1}"
+        x, y = rnd.uniform(0, extension), rnd.uniform(0, extension)
+        rumbo = rnd.uniform(0, 2 * math.pi)
+        m = 0.0
+        for _ in range(features_por_via):
+            if red and red[-1].via == via and rnd.random() < prob_hueco:
+                m += rnd.uniform(100.0, 2000.0)
+            xs, ys, ms = [x], [y], [m]
+            retroceso = rnd.random() < prob_no_monotona
+            for i in range(1, vertices_por_feature):
+                rumbo += rnd.gauss(0.0, 0.15)
+                d = paso * rnd.uniform(0.5, 1.5)
+                x += d * math.cos(rumbo)
+                y += d * math.sin(rumbo)
+                # Un retroceso de M en mitad de la feature simula un error de calibración
+                m += -d if retroceso and i == vertices_por_feature // 2 else d
+                xs.append(x)
+                ys.append(y)
+                ms.append(m)
+            red.append(FeatureSintetica(fid, via, [(xs, ys, ms)]))
+            fid += 1
+    return red
+
+
+# ============================================================
+# ESCRITURA EN GEOPACKAGE
+# ============================================================
+def _wkb_linea_m(xs, ys, ms):
+    wkb = struct.pack("<BII", 1, 2002, len(xs))  # LineString M (ISO)
+    return wkb + b"".join(struct.pack("<ddd", x, y, m) for x, y, m in zip(xs, ys, ms))
+
+
+def _blob_gpkg(partes):
+    if len(partes) == 1:
+        wkb = _wkb_linea_m(*partes[0])
+    else:
+        wkb = struct.pack("<BII", 1, 2005, len(partes)) + b"".join(_wkb_linea_m(*p) for p in partes)
+    return b"GP\x00\x00" + struct.pack("<i", SRS_ID) + wkb  # sin caja en la cabecera
+
+
+def escribir_gpkg(path, red, tabla="carreteras", campo="ID_ROAD"):
+    """Escribe la red en un GeoPackage mínimo con una capa MultiLineString M."""
+    if os.path.exists(path):
+        os.remove(path)
+    con = sqlite3.connect(path)
+    try:
+        con.executescript(f"""
+            PRAGMA application_id = 1196444487;
+            PRAGMA user_version = 10200;
+            CREATE TABLE gpkg_spatial_ref_sys (
+                srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+                organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT
+            );
+            CREATE TABLE gpkg_contents (
+                table_name TEXT PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT,
+                description TEXT DEFAULT '', last_change DATETIME DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+                min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER
+            );
+            CREATE TABLE gpkg_geometry_columns (
+                table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+                srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+                PRIMARY KEY (table_name, column_name)
+            );
+            CREATE TABLE "{tabla}" (fid INTEGER PRIMARY KEY AUTOINCREMENT, geom BLOB, "{campo}" TEXT);
+        """)
+        con.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", [
+            ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+            ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+            ("ETRS89 / UTM zone 30N", SRS_ID, "EPSG", SRS_ID, "undefined", None),
+        ])
+        con.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) "
+                    "VALUES (?, 'features', ?, ?)", (tabla, tabla, SRS_ID))
+        con.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', 'MULTILINESTRING', ?, 0, 1)",
+                    (tabla, SRS_ID))
+        con.executemany(f'INSERT INTO "{tabla}" VALUES (?, ?, ?)',
+                        ((f.fid, _blob_gpkg(f.partes), f.via) for f in red))
+        con.execute(f'CREATE INDEX "idx_{tabla}_{campo}" ON "{tabla}" ("{campo}")')
+        con.commit()
+    finally:
+        con.close()
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+Núcleo de PK Tools sin dependencias de QGIS ni de Qt
+
+Contiene la interpolación de PKs sobre rutas calibradas (rutas), un índice
+espacial en rejilla (rejilla), el índice de nombres de vía por prefijo
+(nombres), las cadenas de features de una vía (cadenas), la auditoría de
+calibración (auditoria), la lectura de GeoPackage (gpkg) y la línea de
+comandos (cli).
+Las herramientas de mapa y los algoritmos de Processing usan la misma
+lógica a través de tools/motor_pk.py.
+"""
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""Permite ejecutar la línea de comandos con `python -m pk_tools.nucleo`."""
+import sys
+
+from .cli import main
+
+sys.exit(main())
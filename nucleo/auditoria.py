@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Auditoría de la calibración M de una red de carreteras (sin QGIS)
+
+Recorre las rutas compiladas (arrays de x, y, m y longitud acumulada) y los
+tramos M de cada vía y detecta:
+  - corridas de M que retroceden dentro de una parte (M no monótona),
+  - saltos, huecos y solapes de M entre tramos consecutivos de una vía,
+    y tramos con M continua pero geometría separada,
+  - corridas cuya relación M / longitud se aparta de la mediana de la red,
+  - segmentos de longitud nula (vértices repetidos).
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import math
+from collections import namedtuple
+
+from .rutas import TOLERANCIA_M
+
+# Tipos de incidencia
+TIPO_NO_MONOTONA = "M_NO_MONOTONA"      # la M retrocede dentro de una parte
+TIPO_SALTO = "SALTO_M"                  # tramos conectados con un salto de M
+TIPO_HUECO = "HUECO_M"                  # tramos separados con un hueco de M entre ellos
+TIPO_SOLAPE = "SOLAPE_M"                # tramos consecutivos con M solapada
+TIPO_DESCONEXION = "DESCONEXION"        # M continua pero geometría separada
+TIPO_RATIO = "RATIO_M"                  # M por unidad de longitud anómala
+TIPO_SEGMENTO_NULO = "SEGMENTO_NULO"    # segmentos de longitud cero
+
+TIPOS = (TIPO_NO_MONOTONA, TIPO_SALTO, TIPO_HUECO, TIPO_SOLAPE,
+         TIPO_DESCONEXION, TIPO_RATIO, TIPO_SEGMENTO_NULO)
+
+# Incidencia de calibración:
+#   via, fid, parte -> feature y parte afectadas (la del tramo siguiente en saltos y huecos)
+#   tipo            -> uno de TIPOS
+#   m_ini, m_fin    -> rango de M afectado
+#   valor           -> magnitud: M retrocedida, diferencia de M, ratio o nº de segmentos
+#   puntos          -> polilínea [(x, y, m), ...] para dibujar la incidencia
+Incidencia = namedtuple("Incidencia", "via fid parte tipo m_ini m_fin valor puntos")
+
+# Resumen por vía: longitud total, rango de M y número de incidencias de cada tipo
+ResumenVia = namedtuple("ResumenVia", "via features longitud m_min m_max incidencias")
+
+
+class AuditoriaCalibracion:
+    """
+    Parámetros de la auditoría:
+      tolerancia_m       -> diferencia de M despreciable (unidades de calibración)
+      tolerancia_ratio   -> desviación relativa admitida del ratio M / longitud (0.1 = 10 %)
+      longitud_min       -> longitud mínima de una corrida para evaluar su ratio
+      distancia_conexion -> separación máxima entre extremos para considerar dos tramos conectados
+    """
+
+    def __init__(self, tolerancia_m=TOLERANCIA_M, tolerancia_ratio=0.1,
+                 longitud_min=50.0, distancia_conexion=1.0):
+        self.tolerancia_m = tolerancia_m
+        self.tolerancia_ratio = tolerancia_ratio
+        self.longitud_min = longitud_min
+        self.distancia_conexion = distancia_conexion
+
+    # ---------- Ratio M / longitud ----------
+    def ratio_referencia(self, rutas):
+        """Mediana del ratio M / longitud de las corridas de la red (None si no hay ninguna)."""
+        ratios = []
+        for ruta in rutas:
+            cum = ruta.cum
+            for i0, i1, m_min, m_max, _, _ in ruta.corridas:
+                longitud = cum[i1] - cum[i0]
+                if longitud >= self.longitud_min:
+                    ratios.append((m_max - m_min) / longitud)
+        if not ratios:
+            return None
+        ratios.sort()
+        return ratios[len(ratios) // 2]
+
+    # ---------- Incidencias de una feature ----------
+    def auditar_ruta(self, ruta, ratio_ref=None):
+        """Lista de Incidencia internas de una ruta compilada."""
+        res = []
+        xs, ys, ms, cum, lim = ruta.xs, ruta.ys, ruta.ms, ruta.cum, ruta.limites
+
+        def puntos(i0, i1):
+            return [(xs[i], ys[i], ms[i]) for i in range(i0, i1 + 1)]
+
+        # 1) Segmentos de longitud nula, agrupando los consecutivos
+        for k in range(len(lim) - 1):
+            i, fin = lim[k], lim[k + 1] - 1
+            while i < fin:
+                if cum[i + 1] - cum[i] > 0.0:
+                    i += 1
+                    continue
+                j = i + 1
+                while j < fin and cum[j + 1] - cum[j] <= 0.0:
+                    j += 1
+                res.append(Incidencia(ruta.via, ruta.fid, k, TIPO_SEGMENTO_NULO,
+                                      ms[i], ms[j], float(j - i), puntos(i, j)))
+                i = j
+
+        # 2) Corridas que retroceden respecto al sentido dominante de su parte
+        por_parte = {}
+        for corrida in ruta.corridas:
+            por_parte.setdefault(corrida[5], []).append(corrida)
+        for k, corridas in por_parte.items():
+            if len(corridas) < 2:
+                continue
+            crece = sum(cum[c[1]] - cum[c[0]] for c in corridas if c[4])
+            decrece = sum(cum[c[1]] - cum[c[0]] for c in corridas if not c[4])
+            dominante = crece >= decrece
+            for i0, i1, m_min, m_max, creciente, _ in corridas:
+                if creciente != dominante and m_max - m_min > self.tolerancia_m:
+                    res.append(Incidencia(ruta.via, ruta.fid, k, TIPO_NO_MONOTONA,
+                                          ms[i0], ms[i1], m_max - m_min, puntos(i0, i1)))
+
+        # 3) Ratio M / longitud de cada corrida frente a la referencia de la red
+        if ratio_ref:
+            for i0, i1, m_min, m_max, _, k in ruta.corridas:
+                longitud = cum[i1] - cum[i0]
+                if longitud < self.longitud_min:
+                    continue
+                ratio = (m_max - m_min) / longitud
+                if abs(ratio / ratio_ref - 1.0) > self.tolerancia_ratio:
+                    res.append(Incidencia(ruta.via, ruta.fid, k, TIPO_RATIO,
+                                          ms[i0], ms[i1], ratio, puntos(i0, i1)))
+        return res
+
+    # ---------- Incidencias entre tramos de una vía ----------
+    def auditar_via(self, tramos, ruta_de):
+        """
+        Lista de Incidencia entre tramos consecutivos (por M) de una vía.
+        Compara el final de la calibración acumulada hasta cada tramo con el
+        inicio del siguiente, en M y en posición.
+        """
+        res = []
+        tol = self.tolerancia_m
+        j_fin = 0  # tramo que alcanza el mayor M final hasta ahora
+        for j in range(1, len(tramos)):
+            if tramos.m_fin[j - 1] >= tramos.m_fin[j_fin]:
+                j_fin = j - 1
+            m_prev, m_sig = tramos.m_fin[j_fin], tramos.m_ini[j]
+            dm = m_sig - m_prev
+            (fid_a, parte_a), (fid_b, parte_b) = tramos.claves[j_fin], tramos.claves[j]
+            a = ruta_de(fid_a).punto_en_m(m_prev, parte_a)
+            b = ruta_de(fid_b).punto_en_m(m_sig, parte_b)
+            separacion = math.hypot(b[0] - a[0], b[1] - a[1]) if a and b else float('inf')
+            conectados = separacion <= self.distancia_conexion
+            if dm > tol:
+                tipo = TIPO_SALTO if conectados else TIPO_HUECO
+            elif dm < -tol:
+                tipo = TIPO_SOLAPE
+            elif not conectados:
+                tipo = TIPO_DESCONEXION
+            else:
+                continue
+            if tipo == TIPO_SOLAPE:
+                m_ini, m_fin = m_sig, min(m_prev, tramos.m_fin[j])
+            else:
+                m_ini, m_fin = m_prev, m_sig
+            puntos = [(p[0], p[1], m) for p, m in ((a, m_prev), (b, m_sig)) if p]
+            res.append(Incidencia(tramos.via, fid_b, parte_b, tipo, m_ini, m_fin, dm, puntos))
+        return res
+
+
+def auditar_red(rutas, vias, auditoria=None, cancelado=None):
+    """
+    Audita toda la red. `rutas`: dict fid -> RutaCompilada; `vias`: dict
+    ID_ROAD -> TramosVia. Devuelve (lista de Incidencia, dict ID_ROAD -> ResumenVia),
+    o None si `cancelado()` se hace verdadero.
+    """
+    auditoria = auditoria or AuditoriaCalibracion()
+    ratio_ref = auditoria.ratio_referencia(rutas.values())
+    incidencias = []
+    for n, ruta in enumerate(rutas.values()):
+        if cancelado and n % 1000 == 0 and cancelado():
+            return None
+        if ruta.es_valida():
+            incidencias.extend(auditoria.auditar_ruta(ruta, ratio_ref))
+    for via, tramos in vias.items():
+        if cancelado and cancelado():
+            return None
+        incidencias.extend(auditoria.auditar_via(tramos, rutas.get))
+    return incidencias, resumen_por_via(rutas, vias, incidencias)
+
+
+def resumen_por_via(rutas, vias, incidencias):
+    """dict ID_ROAD -> ResumenVia con la longitud, el rango de M y las incidencias de cada tipo."""
+    features, longitudes = {}, {}
+    for ruta in rutas.values():
+        if ruta.via:
+            features[ruta.via] = features.get(ruta.via, 0) + 1
+            longitudes[ruta.via] = longitudes.get(ruta.via, 0.0) + ruta.longitud
+    cuentas = {}
+    for inc in incidencias:
+        por_tipo = cuentas.setdefault(inc.via, dict.fromkeys(TIPOS, 0))
+        por_tipo[inc.tipo] += 1
+    resumen = {}
+    for via in features:
+        tramos = vias.get(via)
+        resumen[via] = ResumenVia(
+            via, features[via], longitudes[via],
+            tramos.m_min if tramos else None, tramos.m_max if tramos else None,
+            cuentas.get(via, dict.fromkeys(TIPOS, 0))
+        )
+    return resumen
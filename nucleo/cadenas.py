@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Cadenas de features de una vía (sin QGIS)
+
+Una carretera suele estar dividida en varias features. La CadenaVia reúne
+las de una vía ordenadas por M, con una rejilla de segmentos propia, para
+proyectar un punto sobre cualquiera de ellas y medir la distancia lineal
+sumando la porción de cada feature entre dos PKs.
+
+Para medir, cada valor M se asigna a un solo tramo: si dos features cubren
+el mismo rango (calzadas separadas, calibración solapada), cuenta la
+primera por M y la otra sólo a partir de donde termina aquella, de modo
+que la longitud no se suma dos veces.
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+
+from .rejilla import RejillaSegmentos
+from .rutas import M_POR_KM, pk_distance
+
+
+class CadenaVia:
+    """Features de una vía ordenadas por M y su rejilla de segmentos."""
+
+    def __init__(self, tramos, ruta_de):
+        """tramos: TramosVia de la vía; ruta_de(fid) -> RutaCompilada."""
+        self.tramos = tramos
+        self.ruta_de = ruta_de
+        # Cada feature una vez, en el orden de su primer tramo por M
+        self.fids = list(dict.fromkeys(fid for fid, _ in tramos.claves))
+        self._rejilla = RejillaSegmentos(ruta_de(fid) for fid in self.fids)
+
+        # Cadena sin solapes: [m_ini, m_fin] de cada tramo recortado a lo que
+        # no cubre ya un tramo anterior (m_ini creciente y m_fin creciente)
+        self.m_ini, self.m_fin, self.claves = array('d'), array('d'), []
+        alcanzado = float('-inf')
+        for a, b, clave in zip(tramos.m_ini, tramos.m_fin, tramos.claves):
+            if b <= alcanzado:
+                continue
+            self.m_ini.append(max(a, alcanzado))
+            self.m_fin.append(b)
+            self.claves.append(clave)
+            alcanzado = b
+
+    @property
+    def via(self):
+        return self.tramos.via
+
+    def mas_cercano(self, x, y, radio=0.0):
+        """ResultadoPK de la feature de la vía más cercana a (x, y), o None."""
+        return self._rejilla.mas_cercano(x, y, self.ruta_de, radio)
+
+    def distancia_lineal_m(self, m_a, m_b):
+        """Longitud (unidades de capa) a lo largo de la cadena entre dos valores M."""
+        lo, hi = min(m_a, m_b), max(m_a, m_b)
+        total = 0.0
+        for k in range(bisect_left(self.m_fin, lo), bisect_right(self.m_ini, hi)):
+            fid, parte = self.claves[k]
+            ruta = self.ruta_de(fid)
+            p1 = ruta.punto_en_m(max(lo, self.m_ini[k]), parte)
+            p2 = ruta.punto_en_m(min(hi, self.m_fin[k]), parte)
+            if p1 is not None and p2 is not None:
+                total += abs(p2[2] - p1[2])
+        return total
+
+    def distancia(self, res1, res2):
+        """
+        (diferencia de PK en km, distancia lineal en unidades de la capa) entre
+        dos ResultadoPK de la vía. Si están en features distintas, la distancia
+        lineal suma el recorrido de la cadena entre ambos PKs; si además alguno
+        no tiene PK (sin calibración), no hay distancia posible: (nan, nan).
+        """
+        if res1.ruta.fid == res2.ruta.fid:
+            return pk_distance(res1, res2)
+        if math.isnan(res1.pk) or math.isnan(res2.pk):
+            return float('nan'), float('nan')
+        lineal = self.distancia_lineal_m(res1.pk * M_POR_KM, res2.pk * M_POR_KM)
+        return abs(res2.pk - res1.pk), lineal
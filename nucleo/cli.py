@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Línea de comandos de PK Tools
+
+    python -m pk_tools.nucleo locate   RUTAS.gpkg ENTRADA.csv [-o SALIDA.csv]
+    python -m pk_tools.nucleo identify RUTAS.gpkg ENTRADA.csv [-o SALIDA.csv]
+    python -m pk_tools.nucleo distance RUTAS.gpkg ENTRADA.csv [-o SALIDA.csv]
+
+El complemento no se instala como paquete de Python, así que no hay una
+orden `pk-tools`: se ejecuta con `python -m pk_tools.nucleo` desde la
+carpeta que contiene el complemento (o `python -m nucleo` desde la propia
+carpeta del complemento) y sólo necesita la biblioteca estándar de Python.
+Lee el CSV fila a fila y escribe cada resultado en cuanto lo calcula, de
+modo que el consumo de memoria no depende del tamaño de la entrada.
+Las coordenadas del CSV deben estar en el CRS de la capa de carreteras.
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import argparse
+import csv
+import sys
+
+from .gpkg import ErrorGpkg, RedGpkg
+from .rejilla import RejillaSegmentos
+from .rutas import (
+    ESTADO_FUERA, ESTADO_HUECO, ESTADO_OK, ESTADO_PK_INVALIDO, ESTADO_SIN_VIA,
+    M_POR_KM, distancia_lineal_m, formato_pk, localizar_m, pk_desde_valor
+)
+
+EXPECTED_FIELD = "ID_ROAD"
+
+
+def _numero(valor):
+    """Número en coma flotante de una celda CSV (admite coma decimal), o None."""
+    try:
+        return float(str(valor).strip().replace(",", "."))
+    except (TypeError, ValueError):
+        return None
+
+
+def _texto(valor, decimales=3):
+    return "" if valor is None else f"{valor:.{decimales}f}"
+
+
+# ============================================================
+# COMANDOS
+# ============================================================
+def localizar(red, filas, args):
+    """Añade X, Y, ESTADO y FID_RUTA a cada fila (carretera, PK)."""
+    for fila in filas:
+        via, pk = fila.get(args.col_via), pk_desde_valor(fila.get(args.col_pk))
+        x = y = fid = None
+        if not via or pk is None:
+            estado = ESTADO_PK_INVALIDO
+        else:
+            tramos = red.tramos_via(via)
+            if tramos is None:
+                estado = ESTADO_SIN_VIA
+            else:
+                estado, fid, punto = localizar_m(tramos, red.ruta, pk * M_POR_KM)
+                if punto is not None:
+                    x, y = punto[0], punto[1]
+        fila.update(X=_texto(x), Y=_texto(y), ESTADO=estado, FID_RUTA="" if fid is None else fid)
+        yield fila
+
+
+def identificar(red, filas, args):
+    """Añade ID_ROAD, PK, PK_STR y DIST_EJE a cada fila (x, y)."""
+    rutas = red.cargar_todo()
+    rejilla = RejillaSegmentos(rutas.values())
+    for fila in filas:
+        x, y = _numero(fila.get(args.col_x)), _numero(fila.get(args.col_y))
+        best = None
+        if x is not None and y is not None:
+            best = rejilla.mas_cercano(x, y, rutas.get, args.distancia_max)
+        if best is None:
+            fila.update(ID_ROAD="", PK="", PK_STR="", DIST_EJE="")
+        else:
+            fila.update(ID_ROAD=best.ruta.via, PK=_texto(best.pk, 6),
+                        PK_STR=formato_pk(best.pk), DIST_EJE=_texto(best.separacion))
+        yield fila
+
+
+def medir(red, filas, args):
+    """Añade DIST_PK, DIST_LINEAL (km) y ESTADO a cada fila (carretera, PK inicial, PK final)."""
+    for fila in filas:
+        via = fila.get(args.col_via)
+        pk_ini = pk_desde_valor(fila.get(args.col_pk_ini))
+        pk_fin = pk_desde_valor(fila.get(args.col_pk_fin))
+        dist_pk = dist_lineal = None
+        tramos = None
+        if not via or pk_ini is None or pk_fin is None:
+            estado = ESTADO_PK_INVALIDO
+        else:
+            tramos = red.tramos_via(via)
+            estado = ESTADO_SIN_VIA if tramos is None else ESTADO_OK
+        if estado == ESTADO_OK:
+            m_ini, m_fin = pk_ini * M_POR_KM, pk_fin * M_POR_KM
+            for m in (m_ini, m_fin):
+                if not tramos.buscar(m):
+                    estado = ESTADO_HUECO if tramos.hueco_en(m) else ESTADO_FUERA
+                    break
+            else:
+                dist_pk = abs(pk_fin - pk_ini)                                             # km
+                dist_lineal = distancia_lineal_m(tramos, red.ruta, m_ini, m_fin) / 1000.0  # a km (si capa métrica)
+        fila.update(DIST_PK=_texto(dist_pk), DIST_LINEAL=_texto(dist_lineal), ESTADO=estado)
+        yield fila
+
+
+COMANDOS = {
+    "locate": (localizar, ["X", "Y", "ESTADO", "FID_RUTA"]),
+    "identify": (identificar, ["ID_ROAD", "PK", "PK_STR", "DIST_EJE"]),
+    "distance": (medir, ["DIST_PK", "DIST_LINEAL", "ESTADO"]),
+}
+
+
+# ============================================================
+# ARGUMENTOS
+# ============================================================
+def crear_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m pk_tools.nucleo",
+        description="Referenciación lineal por PK sobre carreteras calibradas con M (GeoPackage + CSV)."
+    )
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    def comando(nombre, ayuda):
+        p = sub.add_parser(nombre, help=ayuda)
+        p.add_argument("rutas", help="GeoPackage con la capa de carreteras calibrada (M)")
+        p.add_argument("entrada", help="CSV de entrada ('-' para la entrada estándar)")
+        p.add_argument("-o", "--salida", default="-", help="CSV de salida (por defecto, la salida estándar)")
+        p.add_argument("--capa", help="Nombre de la capa de carreteras dentro del GeoPackage")
+        p.add_argument("--campo-via", default=EXPECTED_FIELD, help="Campo de la vía en la capa de carreteras")
+        p.add_argument("--delimitador", default=",", help="Separador de columnas del CSV")
+        return p
+
+    p = comando("locate", "Sitúa cada fila (carretera, PK)")
+    p.add_argument("--col-via", default=EXPECTED_FIELD)
+    p.add_argument("--col-pk", default="PK")
+
+    p = comando("identify", "Obtiene la carretera y el PK de cada fila (x, y)")
+    p.add_argument("--col-x", default="X")
+    p.add_argument("--col-y", default="Y")
+    p.add_argument("--distancia-max", type=float, default=50.0,
+                   help="Distancia máxima al eje en unidades de la capa (0 = sin límite)")
+
+    p = comando("distance", "Mide la distancia entre el PK inicial y el final de cada fila")
+    p.add_argument("--col-via", default=EXPECTED_FIELD)
+    p.add_argument("--col-pk-ini", default="PK_INI")
+    p.add_argument("--col-pk-fin", default="PK_FIN")
+    return parser
+
+
+def _abrir(path, modo):
+    if path == "-":
+        return sys.stdin if modo == "r" else sys.stdout
+    return open(path, modo, newline="", encoding="utf-8")
+
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
+    funcion, nuevas = COMANDOS[args.comando]
+    red = entrada = salida = None
+    try:
+        red = RedGpkg(args.rutas, args.campo_via, args.capa)
+        entrada = _abrir(args.entrada, "r")
+        salida = _abrir(args.salida, "w")
+        lector = csv.DictReader(entrada, delimiter=args.delimitador)
+        columnas = list(lector.fieldnames or [])
+        columnas += [c for c in nuevas if c not in columnas]
+        escritor = csv.DictWriter(salida, columnas, delimiter=args.delimitador, extrasaction="ignore")
+        escritor.writeheader()
+        for fila in funcion(red, lector, args):
+            escritor.writerow(fila)
+    except (ErrorGpkg, OSError, csv.Error) as e:
+        print(f"pk-tools: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if red is not None:
+            red.cerrar()
+        if entrada not in (None, sys.stdin):
+            entrada.close()
+        if salida not in (None, sys.stdout):
+            salida.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Lectura de carreteras calibradas desde un GeoPackage sin QGIS ni GDAL
+
+Un GeoPackage es un fichero SQLite: las geometrías se guardan como WKB con
+una cabecera propia. Este módulo decodifica directamente las líneas con M
+(LineString/MultiLineString M o ZM) en RutaCompilada, y compila cada vía
+sólo cuando se consulta por primera vez.
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import sqlite3
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+from .rutas import RutaCompilada, tramos_por_via
+
+# Tamaño en bytes de la caja envolvente según el indicador de la cabecera GPKG
+_BYTES_CAJA = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+# Tipos WKB base
+_WKB_LINESTRING = 2
+_WKB_MULTILINESTRING = 5
+
+_NATIVO_LE = sys.byteorder == "little"
+
+
+class ErrorGpkg(Exception):
+    """El fichero no es un GeoPackage válido o no contiene la capa pedida."""
+
+
+# ============================================================
+# DECODIFICACIÓN DE GEOMETRÍAS
+# ============================================================
+def _tipo_wkb(tipo):
+    """Devuelve (tipo base, tiene Z, tiene M) para códigos ISO y EWKB."""
+    z = bool(tipo & 0x80000000)
+    m = bool(tipo & 0x40000000)
+    tipo &= 0x0FFFFFFF
+    dim, base = divmod(tipo, 1000)
+    return base, z or dim in (1, 3), m or dim in (2, 3)
+
+
+def _linea_wkb(wkb, pos):
+    """Decodifica un LineString WKB en `pos`; devuelve ((xs, ys, ms), pos siguiente)."""
+    le = wkb[pos] == 1
+    fmt = "<" if le else ">"
+    base, z, m = _tipo_wkb(struct.unpack_from(fmt + "I", wkb, pos + 1)[0])
+    if base != _WKB_LINESTRING:
+        raise ErrorGpkg(f"Tipo WKB no soportado dentro de la multilínea: {base}")
+    n = struct.unpack_from(fmt + "I", wkb, pos + 5)[0]
+    dim = 2 + z + m
+    pos += 9
+    coords = array('d')
+    coords.frombytes(wkb[pos:pos + 8 * dim * n])
+    if le != _NATIVO_LE:
+        coords.byteswap()
+    xs, ys = coords[0::dim], coords[1::dim]
+    ms = coords[dim - 1::dim] if m else array('d', [float('nan')]) * n
+    return (xs, ys, ms), pos + 8 * dim * n
+
+
+def partes_gpkg(blob):
+    """Lista de partes (xs, ys, ms) de una geometría lineal GPKG, o [] si no es lineal."""
+    if not blob or blob[:2] != b"GP":
+        return []
+    flags = blob[3]
+    if flags & 0x10:  # geometría vacía
+        return []
+    pos = 8 + _BYTES_CAJA.get((flags >> 1) & 0x07, 0)
+    wkb = memoryview(blob)
+    fmt = "<" if wkb[pos] == 1 else ">"
+    base, _, _ = _tipo_wkb(struct.unpack_from(fmt + "I", wkb, pos + 1)[0])
+    if base == _WKB_LINESTRING:
+        return [_linea_wkb(wkb, pos)[0]]
+    if base == _WKB_MULTILINESTRING:
+        n = struct.unpack_from(fmt + "I", wkb, pos + 5)[0]
+        pos += 9
+        partes = []
+        for _ in range(n):
+            parte, pos = _linea_wkb(wkb, pos)
+            partes.append(parte)
+        return partes
+    return []
+
+
+# ============================================================
+# RED DE CARRETERAS
+# ============================================================
+def _citar(nombre):
+    return '"' + nombre.replace('"', '""') + '"'
+
+
+class RedGpkg:
+    """
+    Capa de carreteras de un GeoPackage. Las rutas y los tramos de cada vía
+    se compilan la primera vez que se piden y quedan en memoria.
+    """
+
+    def __init__(self, path, campo="ID_ROAD", capa=None):
+        self.campo = campo
+        if not Path(path).is_file():
+            raise ErrorGpkg(f"No existe el fichero {path}.")
+        # URI con la ruta escapada (admite '?', '#', '%' y unidades de Windows)
+        uri = Path(path).resolve().as_uri() + "?mode=ro"
+        try:
+            self.con = sqlite3.connect(uri, uri=True)
+        except sqlite3.Error as e:
+            raise ErrorGpkg(f"No se pudo abrir {path}: {e}")
+        try:
+            self._abrir_capa(campo, capa)
+        except sqlite3.Error:
+            self.con.close()
+            raise ErrorGpkg(f"{path} no es un GeoPackage.")
+        except ErrorGpkg:
+            self.con.close()
+            raise
+        self.rutas = {}   # fid -> RutaCompilada
+        self._vias = {}   # ID_ROAD -> TramosVia (o None si la vía no existe)
+
+    def _abrir_capa(self, campo, capa):
+        filas = self.con.execute(
+            "SELECT table_name, column_name FROM gpkg_geometry_columns"
+        ).fetchall()
+        if capa is not None:
+            filas = [f for f in filas if f[0] == capa]
+        if len(filas) != 1:
+            disponibles = ", ".join(f[0] for f in filas) or "ninguna"
+            raise ErrorGpkg(f"Indique la capa de carreteras (--capa). Capas: {disponibles}")
+        self.tabla, self.columna_geom = filas[0]
+        columnas = self.con.execute(f"PRAGMA table_info({_citar(self.tabla)})").fetchall()
+        if campo not in [c[1] for c in columnas]:
+            raise ErrorGpkg(f"La capa {self.tabla} no tiene el campo {campo}.")
+        self.columna_fid = next((c[1] for c in columnas if c[5] == 1), "rowid")
+        self._sql = (
+            f"SELECT {_citar(self.columna_fid)}, {_citar(campo)}, {_citar(self.columna_geom)} "
+            f"FROM {_citar(self.tabla)}"
+        )
+
+    def cerrar(self):
+        self.con.close()
+
+    def _compilar(self, filas):
+        intervalos = []
+        for fid, via, blob in filas:
+            ruta = RutaCompilada(fid, via, partes_gpkg(blob))
+            self.rutas[fid] = ruta
+            if via:
+                intervalos.extend((via, a, b, fid, parte) for parte, a, b in ruta.rangos_m())
+        return tramos_por_via(intervalos)
+
+    def tramos_via(self, via):
+        """TramosVia de una vía (compilando sólo sus features), o None si no existe."""
+        if via not in self._vias:
+            filas = self.con.execute(self._sql + f" WHERE {_citar(self.campo)} = ?", (via,))
+            self._vias[via] = self._compilar(filas).get(via)
+        return self._vias[via]
+
+    def ruta(self, fid):
+        return self.rutas[fid]
+
+    def cargar_todo(self):
+        """Compila todas las features de la capa (necesario para buscar por posición)."""
+        self._vias = self._compilar(self.con.execute(self._sql))
+        return self.rutas
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Índice de nombres de vía por prefijo (sin QGIS)
+
+Normaliza los nombres (sin mayúsculas, tildes ni signos de puntuación) y
+los guarda ordenados por su forma normalizada, de modo que todos los que
+empiezan por un prefijo ocupan un rango contiguo que se localiza por
+bisección: "a6" encuentra "A-6" y "A-62", y "n ii" encuentra "N-II".
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import unicodedata
+from bisect import bisect_left
+
+# Mayor que cualquier carácter de una clave normalizada: cierra el rango de un prefijo
+_FIN_PREFIJO = "\U0010ffff"
+
+
+def normalizar_nombre(texto):
+    """Clave de búsqueda de un nombre: minúsculas, sin tildes y sólo letras y dígitos."""
+    descompuesto = unicodedata.normalize("NFKD", str(texto))
+    return "".join(c for c in descompuesto if c.isalnum()).casefold()
+
+
+class IndiceNombres:
+    """Nombres de vía ordenados por su clave normalizada, para buscar por prefijo."""
+
+    def __init__(self, nombres):
+        pares = sorted((normalizar_nombre(n), str(n)) for n in set(nombres) if n)
+        self.claves = [clave for clave, _ in pares]
+        self.nombres = [nombre for _, nombre in pares]
+
+    def __len__(self):
+        return len(self.nombres)
+
+    def rango(self, texto, dentro=None):
+        """
+        (inicio, fin) de los nombres cuya clave empieza por la de `texto`.
+        `dentro` acota la búsqueda al rango de un prefijo anterior más corto,
+        como ocurre al seguir escribiendo.
+        """
+        prefijo = normalizar_nombre(texto)
+        lo, hi = dentro if dentro is not None else (0, len(self.claves))
+        if not prefijo:
+            return lo, hi
+        inicio = bisect_left(self.claves, prefijo, lo, hi)
+        return inicio, bisect_left(self.claves, prefijo + _FIN_PREFIJO, inicio, hi)
+
+    def buscar(self, texto, limite=None):
+        """Lista de nombres que empiezan por `texto` (como mucho `limite`)."""
+        inicio, fin = self.rango(texto)
+        if limite is not None:
+            fin = min(fin, inicio + limite)
+        return self.nombres[inicio:fin]
+
+    def resolver(self, texto):
+        """
+        Nombre exacto de la vía escrita como `texto` ("a6" -> "A-6"), o None
+        si no hay ninguna o hay varias con la misma clave.
+        """
+        inicio, fin = self.rango(texto)
+        clave = normalizar_nombre(texto)
+        exactos = [self.nombres[k] for k in range(inicio, fin) if self.claves[k] == clave]
+        if texto in exactos:
+            return texto
+        return exactos[0] if len(exactos) == 1 else None
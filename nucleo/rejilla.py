@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Índices espaciales en rejilla sobre las rutas compiladas (sin QGIS)
+
+RejillaCajas sustituye a QgsSpatialIndex fuera de QGIS: reparte las cajas
+de las rutas en celdas regulares y devuelve las rutas cuya caja está a
+menos de un radio de un punto, ordenadas por distancia a la caja.
+
+RejillaSegmentos indexa cada segmento de cada ruta. Una consulta sólo mide
+los pocos segmentos de las celdas próximas al punto, por larga que sea la
+feature a la que pertenecen, y obtiene a la vez el punto proyectado, la
+distancia a lo largo de la ruta y el segmento.
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import math
+from array import array
+
+from .rutas import pk_at_point
+
+# Una caja que ocupa más celdas que este número se guarda aparte y se
+# comprueba siempre, para no llenar la rejilla con rutas muy largas
+MAX_CELDAS_POR_CAJA = 256
+
+# Anillos de celdas que recorre RejillaSegmentos antes de pasar a las cajas
+ANILLOS_MAX = 12
+
+
+def distancia2_caja(caja, x, y):
+    """Distancia al cuadrado de (x, y) a la caja (xmin, ymin, xmax, ymax)."""
+    dx = max(caja[0] - x, 0.0, x - caja[2])
+    dy = max(caja[1] - y, 0.0, y - caja[3])
+    return dx * dx + dy * dy
+
+
+class RejillaCajas:
+    """Rejilla regular de cajas (fid -> (xmin, ymin, xmax, ymax))."""
+
+    def __init__(self, cajas, celda=None):
+        cajas = dict(cajas)
+        self.cajas = {}
+        self.celdas = {}
+        self.grandes = []
+        if celda is None and cajas:
+            # Tamaño de celda: lado medio de las cajas, acotado por la extensión total
+            lados = sorted(max(c[2] - c[0], c[3] - c[1]) for c in cajas.values())
+            celda = lados[len(lados) // 2]
+            xmin = min(c[0] for c in cajas.values())
+            ymin = min(c[1] for c in cajas.values())
+            xmax = max(c[2] for c in cajas.values())
+            ymax = max(c[3] for c in cajas.values())
+            celda = max(celda, max(xmax - xmin, ymax - ymin) / 4096.0)
+        self.celda = celda or 1.0
+        for fid, caja in cajas.items():
+            self.agregar(fid, caja)
+
+    def agregar(self, fid, caja):
+        """Añade la caja de una ruta."""
+        self.cajas[fid] = caja
+        i0, j0, i1, j1 = self._rango(caja[0], caja[1], caja[2], caja[3])
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > MAX_CELDAS_POR_CAJA:
+            self.grandes.append(fid)
+            return
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                self.celdas.setdefault((i, j), []).append(fid)
+
+    def quitar(self, fid):
+        """Elimina la caja de una ruta."""
+        caja = self.cajas.pop(fid, None)
+        if caja is None:
+            return
+        if fid in self.grandes:
+            self.grandes.remove(fid)
+            return
+        i0, j0, i1, j1 = self._rango(caja[0], caja[1], caja[2], caja[3])
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                fids = self.celdas.get((i, j))
+                if fids is not None and fid in fids:
+                    fids.remove(fid)
+                    if not fids:
+                        del self.celdas[(i, j)]
+
+    def _rango(self, xmin, ymin, xmax, ymax):
+        c = self.celda
+        return (math.floor(xmin / c), math.floor(ymin / c),
+                math.floor(xmax / c), math.floor(ymax / c))
+
+    def cercanas(self, x, y, radio):
+        """Lista de (distancia² a la caja, fid) con distancia <= radio, de menor a mayor."""
+        i0, j0, i1, j1 = self._rango(x - radio, y - radio, x + radio, y + radio)
+        vistos = set(self.grandes)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.celdas):
+            for fids in self.celdas.values():
+                vistos.update(fids)
+        else:
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    vistos.update(self.celdas.get((i, j), ()))
+        r2 = radio * radio
+        res = []
+        for fid in vistos:
+            d2 = distancia2_caja(self.cajas[fid], x, y)
+            if d2 <= r2:
+                res.append((d2, fid))
+        res.sort()
+        return res
+
+
+def ruta_mas_cercana(rejilla, ruta_de, x, y, dist_max=0.0):
+    """
+    ResultadoPK de la ruta más cercana a (x, y) dentro de `dist_max` (0 = sin
+    límite), o None. Proyecta las candidatas de la más cercana a la más lejana
+    y se detiene cuando ninguna caja restante puede mejorar el resultado.
+    """
+    radio = dist_max if dist_max > 0 else rejilla.celda
+    while True:
+        candidatas = rejilla.cercanas(x, y, radio)
+        best = None
+        for d2, fid in candidatas:
+            if best is not None and d2 >= best.separacion * best.separacion:
+                break
+            ruta = ruta_de(fid)
+            if ruta is None or not ruta.es_valida():
+                continue
+            res = pk_at_point(ruta, x, y)
+            if res and (best is None or res.separacion < best.separacion):
+                best = res
+        if dist_max > 0:
+            return best if best is not None and best.separacion <= dist_max else None
+        if best is not None and best.separacion <= radio:
+            return best
+        if best is None and len(candidatas) == len(rejilla.cajas):
+            return None
+        # Sin límite: ampliar el radio hasta cubrir la mejor separación encontrada
+        radio = best.separacion if best is not None else radio * 4
+
+
+# ============================================================
+# REJILLA DE SEGMENTOS
+# ============================================================
+class RejillaSegmentos:
+    """
+    Rejilla regular de segmentos. Cada celda guarda un array compacto con
+    pares (fid, índice de segmento) de los segmentos cuya caja la toca.
+    Lleva además una RejillaCajas de las rutas para los puntos alejados de
+    toda carretera, donde recorrer anillos de celdas vacías no compensa.
+    """
+
+    def __init__(self, rutas, celda=None):
+        """rutas: iterable de RutaCompilada."""
+        rutas = [r for r in rutas if r.es_valida()]
+        self.celdas = {}        # (i, j) -> array('q') [fid, seg, fid, seg, ...]
+        self._celdas_de = {}    # fid -> celdas en las que aparece
+        self.limites = None     # (i_min, j_min, i_max, j_max) de las celdas ocupadas
+        self.cajas = RejillaCajas((r.fid, r.caja()) for r in rutas)
+        if celda is None:
+            celda = self._celda_automatica(rutas)
+        self.celda = celda or 1.0
+        for ruta in rutas:
+            self._agregar_segmentos(ruta)
+
+    @staticmethod
+    def _celda_automatica(rutas):
+        """Cuatro veces la longitud mediana de segmento, acotada por la extensión total."""
+        longitudes = []
+        for ruta in rutas:
+            cum = ruta.cum
+            longitudes.extend(cum[i + 1] - cum[i] for i in ruta.segmentos())
+        if not longitudes:
+            return 1.0
+        longitudes.sort()
+        cajas = [r.caja() for r in rutas]
+        extension = max(
+            max(c[2] for c in cajas) - min(c[0] for c in cajas),
+            max(c[3] for c in cajas) - min(c[1] for c in cajas)
+        )
+        return max(4.0 * longitudes[len(longitudes) // 2], extension / 16384.0, 1e-9)
+
+    def agregar(self, ruta):
+        """Añade una ruta (su caja y sus segmentos); quitar(fid) antes si ya estaba."""
+        if ruta.es_valida():
+            self.cajas.agregar(ruta.fid, ruta.caja())
+            self._agregar_segmentos(ruta)
+
+    def quitar(self, fid):
+        """Elimina una ruta (su caja y sus segmentos) tocando sólo sus celdas."""
+        self.cajas.quitar(fid)
+        for clave in self._celdas_de.pop(fid, ()):
+            celda = self.celdas[clave]
+            resto = array('q')
+            for n in range(0, len(celda), 2):
+                if celda[n] != fid:
+                    resto.append(celda[n])
+                    resto.append(celda[n + 1])
+            if resto:
+                self.celdas[clave] = resto
+            else:
+                del self.celdas[clave]
+
+    def _agregar_segmentos(self, ruta):
+        c = self.celda
+        celdas = self.celdas
+        floor = math.floor
+        cis = [floor(x / c) for x in ruta.xs]
+        cjs = [floor(y / c) for y in ruta.ys]
+        fid = ruta.fid
+        tocadas = set()
+        for i in ruta.segmentos():
+            a, b, p, q = cis[i], cis[i + 1], cjs[i], cjs[i + 1]
+            if a == b and p == q:
+                claves = ((a, p),)   # caso habitual: el segmento cabe en una celda
+            else:
+                i0, i1 = (a, b) if a < b else (b, a)
+                j0, j1 = (p, q) if p < q else (q, p)
+                claves = [(ci, cj) for ci in range(i0, i1 + 1) for cj in range(j0, j1 + 1)]
+            for clave in claves:
+                celda = celdas.get(clave)
+                if celda is None:
+                    celda = celdas[clave] = array('q')
+                celda.append(fid)
+                celda.append(i)
+                tocadas.add(clave)
+        if not tocadas:
+            return
+        self._celdas_de[fid] = tocadas
+        i_min = min(k[0] for k in tocadas)
+        j_min = min(k[1] for k in tocadas)
+        i_max = max(k[0] for k in tocadas)
+        j_max = max(k[1] for k in tocadas)
+        if self.limites is not None:
+            a, b, p, q = self.limites
+            i_min, j_min, i_max, j_max = min(a, i_min), min(b, j_min), max(p, i_max), max(q, j_max)
+        self.limites = (i_min, j_min, i_max, j_max)
+
+    def _anillo(self, ci, cj, k):
+        """Celdas a distancia de Chebyshev k de (ci, cj)."""
+        if k == 0:
+            yield ci, cj
+            return
+        for di in range(-k, k + 1):
+            yield ci + di, cj - k
+            yield ci + di, cj + k
+        for dj in range(-k + 1, k):
+            yield ci - k, cj + dj
+            yield ci + k, cj + dj
+
+    @staticmethod
+    def _medir_celda(celda, x, y, ruta_de, best):
+        """Compara los segmentos de una celda con el mejor (d², fid, seg) hasta ahora."""
+        best_d2, best_fid, best_seg = best
+        for n in range(0, len(celda), 2):
+            fid, i = celda[n], celda[n + 1]
+            ruta = ruta_de(fid)
+            xs, ys = ruta.xs, ruta.ys
+            x0, y0 = xs[i], ys[i]
+            dx, dy = xs[i + 1] - x0, ys[i + 1] - y0
+            l2 = dx * dx + dy * dy
+            t = ((x - x0) * dx + (y - y0) * dy) / l2 if l2 > 0 else 0.0
+            t = 0.0 if t < 0.0 else 1.0 if t > 1.0 else t
+            ex, ey = x - (x0 + t * dx), y - (y0 + t * dy)
+            d2 = ex * ex + ey * ey
+            if d2 < best_d2:
+                best_d2, best_fid, best_seg = d2, fid, i
+        return best_d2, best_fid, best_seg
+
+    def mas_cercano(self, x, y, ruta_de, radio=0.0):
+        """
+        ResultadoPK del segmento más cercano a (x, y) a menos de `radio`
+        (0 = sin límite), o None. Recorre anillos de celdas alrededor del
+        punto y se detiene cuando ningún anillo restante puede acercarse más.
+        Si hacen falta más de ANILLOS_MAX anillos (punto lejos de toda
+        carretera), resuelve la consulta con las cajas de las rutas.
+        """
+        if self.limites is None:
+            return None
+        c = self.celda
+        ci, cj = math.floor(x / c), math.floor(y / c)
+        i_min, j_min, i_max, j_max = self.limites
+        # Hueco entre el punto y el borde de su celda: cota inferior de la
+        # distancia a cualquier celda del anillo k, que es (k - 1) * c + hueco
+        hueco = min(x - ci * c, (ci + 1) * c - x, y - cj * c, (cj + 1) * c - y)
+        k = max(0, i_min - ci, ci - i_max, j_min - cj, cj - j_max)
+        k_max = max(ci - i_min, i_max - ci, cj - j_min, j_max - cj)
+
+        best = (radio * radio if radio > 0 else float('inf'), None, -1)
+        while k <= k_max:
+            cota = (k - 1) * c + hueco if k > 0 else 0.0
+            if cota * cota > best[0]:
+                break
+            if k > ANILLOS_MAX:
+                return ruta_mas_cercana(self.cajas, ruta_de, x, y, radio)
+            for clave in self._anillo(ci, cj, k):
+                celda = self.celdas.get(clave)
+                if celda is not None:
+                    best = self._medir_celda(celda, x, y, ruta_de, best)
+            k += 1
+        if best[1] is None:
+            return None
+        return pk_at_point(ruta_de(best[1]), x, y, (best[2],))
@@ -0,0 +1,615 @@
+# -*- coding: utf-8 -*-
+"""
+Rutas calibradas de PK Tools (sin dependencias de QGIS)
+
+Compila cada feature de la capa de carreteras una sola vez en arrays
+compactos (x, y, m y longitud acumulada) e interpola sobre ellos el PK de
+un punto, el punto de un PK y las distancias entre PKs. Sólo usa la
+biblioteca estándar, de modo que la misma lógica sirve a las herramientas
+de mapa, a los algoritmos de Processing y a la línea de comandos.
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+##CONFIGURACION
+# AJUSTAR METROS O KILÓMETROS
+# 1000 si la capa está calibrada en metros, 1 si está calibrada en KM
+M_POR_KM = 1000.0
+
+# Diferencia de M (unidades de calibración) por debajo de la cual dos tramos
+# consecutivos se consideran contiguos al detectar huecos y solapes
+TOLERANCIA_M = 0.001
+
+# Valores del campo ESTADO de los procesos por lotes
+ESTADO_OK = "OK"
+ESTADO_SOLAPE = "SOLAPE"              # situado, pero el PK aparece en varios tramos
+ESTADO_HUECO = "HUECO"                # el PK cae en un hueco de la calibración
+ESTADO_FUERA = "FUERA_DE_RANGO"
+ESTADO_SIN_VIA = "VIA_NO_ENCONTRADA"
+ESTADO_PK_INVALIDO = "PK_INVALIDO"
+
+
+# Resultado de proyectar un punto sobre una ruta:
+#   ruta       -> RutaCompilada sobre la que se ha proyectado
+#   pk         -> PK interpolado (km)
+#   distancia  -> distancia a lo largo de la ruta hasta la proyección (unidades de capa)
+#   x, y       -> punto proyectado (CRS de la capa)
+#   separacion -> distancia entre el punto original y su proyección
+ResultadoPK = namedtuple("ResultadoPK", "ruta pk distancia x y separacion")
+
+
+
+# ============================================================
+# RUTA COMPILADA
+# ============================================================
+class RutaCompilada:
+    """Geometría lineal de una feature compilada en arrays de coordenadas, M y longitud acumulada."""
+
+    __slots__ = ("fid", "via", "xs", "ys", "ms", "cum", "limites", "corridas")
+
+    def __init__(self, fid, via, partes):
+        """
+        partes: iterable de tuplas (xs, ys, ms), una por cada parte de la geometría.
+        Las partes se concatenan; la longitud acumulada no suma el salto entre partes.
+        """
+        self.fid = fid
+        self.via = via
+        self.xs = array('d')
+        self.ys = array('d')
+        self.ms = array('d')
+        self.cum = array('d')
+        self.limites = array('l')  # índice del primer vértice de cada parte + total
+
+        total = 0.0
+        for pxs, pys, pms in partes:
+            # Las partes degeneradas se conservan para mantener la numeración
+            # de partes; simplemente no aportan segmentos
+            self.limites.append(len(self.xs))
+            self.xs.extend(pxs)
+            self.ys.extend(pys)
+            self.ms.extend(pms)
+            self.cum.append(total)
+            for i in range(1, len(pxs)):
+                total += math.hypot(pxs[i] - pxs[i - 1], pys[i] - pys[i - 1])
+                self.cum.append(total)
+        self.limites.append(len(self.xs))
+        self.corridas = self._calcular_corridas()
+
+    @classmethod
+    def desde_arrays(cls, fid, via, limites, xs, ys, ms, cum):
+        """Reconstruye una ruta ya compilada (p. ej. leída de la caché en disco)."""
+        ruta = cls.__new__(cls)
+        ruta.fid = fid
+        ruta.via = via
+        ruta.limites = limites
+        ruta.xs, ruta.ys, ruta.ms, ruta.cum = xs, ys, ms, cum
+        ruta.corridas = ruta._calcular_corridas()
+        return ruta
+
+    def _calcular_corridas(self):
+        """
+        Divide cada parte en corridas de M monótona para poder buscar por
+        bisección aunque la calibración suba y baje. Cada corrida es una tupla
+        (i0, i1, m_min, m_max, creciente, parte) con los vértices i0..i1.
+        Los valores M nulos (NaN) cortan la corrida.
+        """
+        corridas = []
+        ms, lim = self.ms, self.limites
+
+        def cerrar(i0, i1, sentido, k):
+            if i1 > i0:
+                a, b = ms[i0], ms[i1]
+                corridas.append((i0, i1, min(a, b), max(a, b), sentido >= 0, k))
+
+        for k in range(len(lim) - 1):
+            a, b = lim[k], lim[k + 1]
+            i0, sentido = a, 0
+            for i in range(a + 1, b):
+                m0, m1 = ms[i - 1], ms[i]
+                if math.isnan(m0) or math.isnan(m1):
+                    cerrar(i0, i - 1, sentido, k)
+                    i0, sentido = i, 0
+                    continue
+                d = (m1 > m0) - (m1 < m0)
+                if d and sentido and d != sentido:
+                    cerrar(i0, i - 1, sentido, k)
+                    i0 = i - 1
+                if d:
+                    sentido = d
+            cerrar(i0, b - 1, sentido, k)
+        return corridas
+
+    # ---------- Propiedades ----------
+    @property
+    def longitud(self):
+        """Longitud total de la ruta (unidades de capa)."""
+        return self.cum[-1] if self.cum else 0.0
+
+    def es_valida(self):
+        """Una ruta es válida si tiene al menos un segmento."""
+        return len(self.xs) >= 2
+
+    @property
+    def num_partes(self):
+        return len(self.limites) - 1
+
+    def caja(self):
+        """Rectángulo envolvente (xmin, ymin, xmax, ymax), o None si la ruta no tiene vértices."""
+        if not self.xs:
+            return None
+        return min(self.xs), min(self.ys), max(self.xs), max(self.ys)
+
+    def rangos_m(self):
+        """Lista de (parte, m mínimo, m máximo) de cada parte con valores M."""
+        rangos = {}
+        for _, _, m_min, m_max, _, parte in self.corridas:
+            if parte in rangos:
+                a, b = rangos[parte]
+                rangos[parte] = (min(a, m_min), max(b, m_max))
+            else:
+                rangos[parte] = (m_min, m_max)
+        return [(parte, a, b) for parte, (a, b) in sorted(rangos.items())]
+
+    def segmentos(self, parte=None):
+        """
+        Itera los índices i de los segmentos (i, i+1), sin cruzar entre partes.
+        Si se indica `parte`, sólo los de esa parte.
+        """
+        lim = self.limites
+        partes = range(len(lim) - 1) if parte is None else (parte,)
+        for k in partes:
+            yield from range(lim[k], lim[k + 1] - 1)
+
+    # ---------- Consultas ----------
+    def proyectar(self, x, y, segmentos=None):
+        """
+        Proyecta (x, y) sobre el segmento más cercano (de todos, o sólo de los
+        índices de `segmentos`).
+        Devuelve (dist², px, py, distancia a lo largo, índice de segmento).
+        """
+        xs, ys, cum = self.xs, self.ys, self.cum
+        best = (float('inf'), None, None, 0.0, -1)
+        for i in (self.segmentos() if segmentos is None else segmentos):
+            x0, y0 = xs[i], ys[i]
+            dx, dy = xs[i + 1] - x0, ys[i + 1] - y0
+            l2 = dx * dx + dy * dy
+            t = ((x - x0) * dx + (y - y0) * dy) / l2 if l2 > 0 else 0.0
+            t = 0.0 if t < 0.0 else 1.0 if t > 1.0 else t
+            px, py = x0 + t * dx, y0 + t * dy
+            d2 = (x - px) ** 2 + (y - py) ** 2
+            if d2 < best[0]:
+                best = (d2, px, py, cum[i] + t * (cum[i + 1] - cum[i]), i)
+        return best
+
+    def es_segmento(self, i):
+        """True si (i, i+1) es un segmento real y no el salto entre dos partes."""
+        lim = self.limites
+        k = bisect_right(lim, i) - 1
+        return 0 <= k < len(lim) - 1 and i < lim[k + 1] - 1
+
+    def segmento_en_distancia(self, dist, parte=None):
+        """
+        Índice del segmento que contiene la distancia dada (bisección sobre la
+        longitud acumulada), opcionalmente restringido a una parte. Devuelve
+        None si la ruta (o la parte) no tiene ningún segmento.
+        """
+        if parte is not None:
+            a, b = self.limites[parte], self.limites[parte + 1]
+            if b - a < 2:
+                return None
+            i = bisect_right(self.cum, dist, a, b) - 1
+            return max(a, min(i, b - 2))
+        n = len(self.cum)
+        if n < 2:
+            return None
+        i = bisect_right(self.cum, dist) - 1
+        i = max(0, min(i, n - 2))
+        # En las uniones entre partes la longitud acumulada se repite:
+        # retroceder hasta un segmento real (o avanzar, si las primeras
+        # partes son de un solo vértice)
+        while i > 0 and not self.es_segmento(i):
+            i -= 1
+        while i < n - 1 and not self.es_segmento(i):
+            i += 1
+        return i if i < n - 1 else None
+
+    def m_en_distancia(self, dist, seg=None):
+        """Valor M interpolado a una distancia dada a lo largo de la ruta (NaN sin segmentos)."""
+        if seg is None:
+            seg = self.segmento_en_distancia(dist)
+            if seg is None:
+                return math.nan
+        cum, ms = self.cum, self.ms
+        start = cum[seg]
+        seg_len = cum[seg + 1] - start
+        t = (dist - start) / seg_len if seg_len > 0 else 0.0
+        return ms[seg] + t * (ms[seg + 1] - ms[seg])
+
+    def _interpolar_distancia(self, dist, seg):
+        """(x, y, m) a una distancia dada dentro del segmento `seg`."""
+        cum = self.cum
+        seg_len = cum[seg + 1] - cum[seg]
+        t = (dist - cum[seg]) / seg_len if seg_len > 0 else 0.0
+        t = 0.0 if t < 0.0 else 1.0 if t > 1.0 else t
+        xs, ys, ms = self.xs, self.ys, self.ms
+        return (xs[seg] + t * (xs[seg + 1] - xs[seg]),
+                ys[seg] + t * (ys[seg + 1] - ys[seg]),
+                ms[seg] + t * (ms[seg + 1] - ms[seg]))
+
+    def subcadena(self, d1, d2, parte):
+        """
+        Vértices (x, y, m) de la parte `parte` entre las distancias d1 y d2,
+        en el sentido de d1 a d2 (que puede ser contrario al de digitalización).
+        Lista vacía si la parte no tiene ningún segmento.
+        """
+        invertir = d2 < d1
+        if invertir:
+            d1, d2 = d2, d1
+        i = self.segmento_en_distancia(d1, parte)
+        j = self.segmento_en_distancia(d2, parte)
+        if i is None or j is None:
+            return []
+        xs, ys, ms = self.xs, self.ys, self.ms
+        puntos = [self._interpolar_distancia(d1, i)]
+        for k in range(i + 1, j + 1):
+            v = (xs[k], ys[k], ms[k])
+            if v[:2] != puntos[-1][:2]:
+                puntos.append(v)
+        fin = self._interpolar_distancia(d2, j)
+        if fin[:2] != puntos[-1][:2] or len(puntos) == 1:
+            puntos.append(fin)
+        if invertir:
+            puntos.reverse()
+        return puntos
+
+    def punto_en_m(self, m, parte=None):
+        """
+        Punto (x, y, distancia a lo largo) donde la calibración vale m,
+        o None si m queda fuera del rango de la ruta (o de la parte indicada).
+        """
+        xs, ys, ms, cum = self.xs, self.ys, self.ms, self.cum
+        for corrida in self.corridas:
+            if parte is not None and corrida[5] != parte:
+                continue
+            if not corrida[2] <= m <= corrida[3]:
+                continue
+            i = self._segmento_en_corrida(corrida, m)
+            m1, m2 = ms[i], ms[i + 1]
+            t = (m - m1) / (m2 - m1) if m2 != m1 else 0.0
+            return (xs[i] + t * (xs[i + 1] - xs[i]),
+                    ys[i] + t * (ys[i + 1] - ys[i]),
+                    cum[i] + t * (cum[i + 1] - cum[i]))
+        return None
+
+    def puntos_en_m(self, ms_ordenados, parte=None):
+        """
+        Versión por lotes de punto_en_m: recibe valores M en orden creciente y
+        devuelve una lista alineada de (x, y, distancia) o None. Cada corrida
+        monótona se recorre una sola vez para todos los valores que contiene.
+        """
+        xs, ys, ms, cum = self.xs, self.ys, self.ms, self.cum
+        res = [None] * len(ms_ordenados)
+        for i0, i1, lo, hi, creciente, k in self.corridas:
+            if parte is not None and k != parte:
+                continue
+            a, b = bisect_left(ms_ordenados, lo), bisect_right(ms_ordenados, hi)
+            j = i0 if creciente else i1 - 1
+            for n in range(a, b):
+                if res[n] is not None:
+                    continue
+                m = ms_ordenados[n]
+                if creciente:
+                    while j < i1 - 1 and ms[j + 1] < m:
+                        j += 1
+                else:
+                    while j > i0 and ms[j] < m:
+                        j -= 1
+                m1, m2 = ms[j], ms[j + 1]
+                t = (m - m1) / (m2 - m1) if m2 != m1 else 0.0
+                res[n] = (xs[j] + t * (xs[j + 1] - xs[j]),
+                          ys[j] + t * (ys[j + 1] - ys[j]),
+                          cum[j] + t * (cum[j + 1] - cum[j]))
+        return res
+
+    def _segmento_en_corrida(self, corrida, m):
+        """Segmento de una corrida monótona que contiene m (bisección sobre M)."""
+        i0, i1, _, _, creciente, _ = corrida
+        ms = self.ms
+        if creciente:
+            j = bisect_left(ms, m, i0, i1 + 1)
+        else:
+            # Primer vértice con M <= m en una corrida decreciente
+            lo, hi = i0, i1 + 1
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if ms[mid] > m:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            j = lo
+        return max(i0, min(j - 1, i1 - 1))
+
+
+# ============================================================
+# API DE REFERENCIACIÓN LINEAL
+# ============================================================
+def pk_at_point(ruta, x, y, segmentos=None):
+    """
+    Proyecta (x, y) (CRS de la capa) sobre la ruta y devuelve un ResultadoPK.
+    `segmentos` limita la proyección a esos índices de segmento.
+    """
+    d2, px, py, dist, seg = ruta.proyectar(x, y, segmentos)
+    if seg < 0:
+        return None
+    pk = ruta.m_en_distancia(dist, seg) / M_POR_KM
+    return ResultadoPK(ruta, pk, dist, px, py, math.sqrt(d2))
+
+
+def point_at_pk(ruta, pk_km, parte=None):
+    """Devuelve (x, y) en el CRS de la capa para el PK dado (km), o None si está fuera de rango."""
+    res = ruta.punto_en_m(pk_km * M_POR_KM, parte)
+    if res is None:
+        return None
+    return res[0], res[1]
+
+
+def formato_pk(pk_total):
+    """Convierte un valor decimal de PK (km) en formato km+000 ("—" si no hay PK)."""
+    if pk_total is None or math.isnan(pk_total):
+        return "—"
+    # Se redondea a metros enteros antes de separar km y m: así 999.5 m pasa
+    # al km siguiente (1+000) y no queda como "0+1000"
+    metros = int(round(abs(pk_total) * 1000))
+    km, m = divmod(metros, 1000)
+    signo = "-" if pk_total < 0 and metros else ""
+    return f"{signo}{km}+{m:03d}"
+
+
+def pk_desde_valor(valor):
+    """
+    Convierte un PK de una tabla en km: admite números (12.345) y textos
+    "12+345", "12.345" o "12,345". Devuelve None si no se puede interpretar.
+    """
+    if valor is None:
+        return None
+    if isinstance(valor, (int, float)):
+        return None if math.isnan(valor) else float(valor)
+    texto = str(valor).strip().replace(" ", "")
+    try:
+        if "+" in texto:
+            km, m = texto.split("+", 1)
+            return int(km) + float(m.replace(",", ".")) / 1000.0
+        return float(texto.replace(",", "."))
+    except ValueError:
+        return None
+
+
+def distancia_lineal_m(tramos, ruta_de, m_a, m_b):
+    """
+    Longitud real (unidades de capa) de una vía entre dos valores M, sumando
+    la porción de cada tramo (feature y parte) comprendida entre ambos.
+    `ruta_de(fid)` devuelve la RutaCompilada de cada feature.
+    """
+    lo, hi = min(m_a, m_b), max(m_a, m_b)
+    total = 0.0
+    for (fid, parte), a, b in tramos.intervalos_entre(lo, hi):
+        ruta = ruta_de(fid)
+        p1 = ruta.punto_en_m(max(lo, a), parte)
+        p2 = ruta.punto_en_m(min(hi, b), parte)
+        if p1 is not None and p2 is not None:
+            total += abs(p2[2] - p1[2])
+    return total
+
+
+def segmentacion_dinamica(tramos, ruta_de, eventos, tolerancia=TOLERANCIA_M):
+    """
+    Extrae la geometría de una vía entre pares de valores M (segmentación dinámica).
+
+    eventos: lista de (m_desde, m_hasta) de la misma vía.
+    Devuelve una lista alineada con `eventos` de tuplas (partes, completo):
+      partes   -> lista de polilíneas [(x, y, m), ...] en el sentido m_desde -> m_hasta,
+                  una por cada feature o parte de la vía que atraviesa el evento
+      completo -> False si la calibración de la vía no cubre todo el rango
+    Los eventos se procesan ordenados por M y los puntos de corte de cada
+    tramo se sitúan en una sola pasada por sus vértices.
+    """
+    # 1) Tramos (feature, parte) que corta cada evento y valores M a situar en ellos
+    orden = sorted(range(len(eventos)), key=lambda n: min(eventos[n]))
+    cortes = {}     # (fid, parte) -> set de valores M
+    piezas = {}     # n -> [((fid, parte), m1, m2)]
+    cubierto = {}   # n -> True si no hay huecos
+    for n in orden:
+        lo, hi = sorted(eventos[n])
+        lista, alcanzado = [], lo
+        completo = True
+        for clave, a, b in tramos.intervalos_entre(lo, hi):
+            m1, m2 = max(lo, a), min(hi, b)
+            if m1 - alcanzado > tolerancia:
+                completo = False
+            alcanzado = max(alcanzado, m2)
+            if m2 > m1:
+                lista.append((clave, m1, m2))
+                cortes.setdefault(clave, set()).update((m1, m2))
+        piezas[n] = lista
+        cubierto[n] = completo and hi - alcanzado <= tolerancia
+
+    # 2) Distancia a lo largo de cada corte, en una pasada por tramo
+    distancias = {}  # (fid, parte, m) -> distancia
+    for (fid, parte), valores in cortes.items():
+        valores = sorted(valores)
+        for m, punto in zip(valores, ruta_de(fid).puntos_en_m(valores, parte)):
+            if punto is not None:
+                distancias[(fid, parte, m)] = punto[2]
+
+    # 3) Subcadenas de cada evento
+    resultado = [None] * len(eventos)
+    for n in orden:
+        partes = []
+        for (fid, parte), m1, m2 in piezas[n]:
+            d1 = distancias.get((fid, parte, m1))
+            d2 = distancias.get((fid, parte, m2))
+            if d1 is not None and d2 is not None and d1 != d2:
+                sub = ruta_de(fid).subcadena(d1, d2, parte)
+                if sub:
+                    partes.append(sub)
+        if eventos[n][0] > eventos[n][1]:
+            partes = [list(reversed(p)) for p in reversed(partes)]
+        resultado[n] = (partes, cubierto[n] and bool(partes))
+    return resultado
+
+
+def pk_distance(res1, res2):
+    """
+    Distancias entre dos ResultadoPK de la misma ruta:
+    (diferencia de PK en km, distancia lineal en unidades de la capa).
+    """
+    return abs(res2.pk - res1.pk), abs(res2.distancia - res1.distancia)
+
+
+# ============================================================
+# INTERVALOS M POR VÍA
+# ============================================================
+class TramosVia:
+    """
+    Intervalos M de todas las features y partes de una vía, ordenados por
+    M inicial para localizar por bisección el tramo que contiene un PK.
+    """
+
+    __slots__ = ("via", "m_ini", "m_fin", "claves", "_fin_max")
+
+    def __init__(self, via, intervalos):
+        """intervalos: iterable de (m_min, m_max, fid, parte)."""
+        self.via = via
+        ordenados = sorted(intervalos, key=lambda it: (it[0], it[1]))
+        self.m_ini = array('d', (it[0] for it in ordenados))
+        self.m_fin = array('d', (it[1] for it in ordenados))
+        self.claves = [(it[2], it[3]) for it in ordenados]  # (fid, parte)
+
+        # Máximo acumulado de m_fin: permite cortar la búsqueda hacia atrás
+        # aunque haya intervalos solapados
+        self._fin_max = array('d')
+        tope = float('-inf')
+        for m in self.m_fin:
+            tope = max(tope, m)
+            self._fin_max.append(tope)
+
+    def __len__(self):
+        return len(self.claves)
+
+    @property
+    def m_min(self):
+        return self.m_ini[0] if self.m_ini else None
+
+    @property
+    def m_max(self):
+        return self._fin_max[-1] if self._fin_max else None
+
+    def buscar(self, m):
+        """Lista de (fid, parte) cuyos intervalos contienen m, en orden de M inicial."""
+        encontrados = []
+        j = bisect_right(self.m_ini, m) - 1
+        while j >= 0 and self._fin_max[j] >= m:
+            if self.m_fin[j] >= m:
+                encontrados.append(self.claves[j])
+            j -= 1
+        encontrados.reverse()
+        return encontrados
+
+    def intervalos_entre(self, m_desde, m_hasta):
+        """Lista de ((fid, parte), m_min, m_max) de los tramos que cortan [m_desde, m_hasta]."""
+        # _fin_max es creciente: se salta por bisección lo que acaba antes de m_desde
+        j = bisect_left(self._fin_max, m_desde)
+        fin = bisect_right(self.m_ini, m_hasta)
+        return [(self.claves[k], self.m_ini[k], self.m_fin[k])
+                for k in range(j, fin) if self.m_fin[k] >= m_desde]
+
+    def solapado_en(self, m, tolerancia=TOLERANCIA_M):
+        """True si m cae en el interior de más de un tramo (no basta con compartir extremo)."""
+        j = bisect_right(self.m_ini, m) - 1
+        interiores = 0
+        while j >= 0 and self._fin_max[j] >= m:
+            if self.m_ini[j] + tolerancia < m < self.m_fin[j] - tolerancia:
+                interiores += 1
+            j -= 1
+        return interiores > 1
+
+    def huecos(self, tolerancia=TOLERANCIA_M):
+        """Lista de (m_desde, m_hasta) sin calibración entre tramos consecutivos."""
+        huecos = []
+        for j in range(1, len(self.m_ini)):
+            fin_prev = self._fin_max[j - 1]
+            if self.m_ini[j] - fin_prev > tolerancia:
+                huecos.append((fin_prev, self.m_ini[j]))
+        return huecos
+
+    def solapes(self, tolerancia=TOLERANCIA_M):
+        """Lista de (m_desde, m_hasta) cubiertos por más de un tramo."""
+        solapes = []
+        for j in range(1, len(self.m_ini)):
+            fin_prev = self._fin_max[j - 1]
+            if fin_prev - self.m_ini[j] > tolerancia:
+                solapes.append((self.m_ini[j], min(fin_prev, self.m_fin[j])))
+        return solapes
+
+    def hueco_en(self, m):
+        """(m_desde, m_hasta) del hueco que contiene m, o None si m no cae en un hueco."""
+        j = bisect_right(self.m_ini, m)
+        if 0 < j < len(self.m_ini) and self._fin_max[j - 1] < m:
+            return self._fin_max[j - 1], self.m_ini[j]
+        return None
+
+
+def tramos_por_via(intervalos):
+    """Agrupa (via, m_min, m_max, fid, parte) en un dict ID_ROAD -> TramosVia."""
+    por_via = {}
+    for via, m_min, m_max, fid, parte in intervalos:
+        por_via.setdefault(via, []).append((m_min, m_max, fid, parte))
+    return {via: TramosVia(via, ints) for via, ints in por_via.items()}
+
+
+def actualizar_tramos(por_via, quitados, intervalos):
+    """
+    Aplica cambios de features a un dict ID_ROAD -> TramosVia reconstruyendo
+    sólo las vías afectadas.
+      quitados:   iterable de (via, fid) cuyos tramos se eliminan
+      intervalos: iterable de (via, m_min, m_max, fid, parte) que se añaden
+    """
+    fuera, nuevos = {}, {}
+    for via, fid in quitados:
+        fuera.setdefault(via, set()).add(fid)
+    for via, m_min, m_max, fid, parte in intervalos:
+        nuevos.setdefault(via, []).append((m_min, m_max, fid, parte))
+    for via in set(fuera) | set(nuevos):
+        fids = fuera.get(via, ())
+        previos = por_via.get(via)
+        ints = [] if previos is None else [
+            (a, b, fid, parte)
+            for a, b, (fid, parte) in zip(previos.m_ini, previos.m_fin, previos.claves)
+            if fid not in fids
+        ]
+        ints.extend(nuevos.get(via, ()))
+        if ints:
+            por_via[via] = TramosVia(via, ints)
+        else:
+            por_via.pop(via, None)
+
+
+def localizar_m(tramos, ruta_de, m):
+    """
+    Sitúa un valor M sobre los tramos de una vía.
+    Devuelve (estado, fid, (x, y, dist)); fid y el punto son None si no se sitúa.
+    """
+    candidatos = tramos.buscar(m)
+    if not candidatos:
+        return (ESTADO_HUECO if tramos.hueco_en(m) else ESTADO_FUERA), None, None
+    fid, parte = candidatos[0]
+    punto = ruta_de(fid).punto_en_m(m, parte)
+    if punto is None:
+        return ESTADO_FUERA, None, None
+    return (ESTADO_SOLAPE if tramos.solapado_en(m) else ESTADO_OK), fid, punto
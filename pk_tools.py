@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QAction
+from qgis.core import QgsApplication
 
 from . import resources_rc
 from .tools.identificar_pk import IdentificarPK
 from .tools.localizar_pk import LocalizarPK
 from .tools.distancia_pk import DistanciaPK
+from .algoritmos.proveedor_pk import ProveedorPK
 
 
 class PKToolsPlugin:
@@ -16,9 +18,16 @@ class PKToolsPlugin:
         self.distancia = DistanciaPK(iface)
 
         self.actions = []  # guardamos las acciones para poder limpiarlas en unload
+        self.provider = None  # proveedor de Processing (algoritmos por lotes)
+
+    def initProcessing(self):
+        """Registrar los algoritmos por lotes en la caja de herramientas de Processing."""
+        self.provider = ProveedorPK()
+        QgsApplication.processingRegistry().addProvider(self.provider)
 
     def initGui(self):
         """Crear los botones de la barra de herramientas."""
+        self.initProcessing()
 
         # Identificar PK (checkable)
         act_id = QAction(
@@ -66,3 +75,6 @@ class PKToolsPlugin:
         for act in self.actions:
             self.iface.removeToolBarIcon(act)
         self.actions = []
+        if self.provider:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas del núcleo de PK Tools (nucleo/), que no necesita QGIS.
+
+    python -m pytest -q tests
+
+Como el banco de pruebas, importan `nucleo` y `benchmarks` como paquetes de
+primer nivel desde la carpeta del complemento.
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import os
+import sys
+
+_CARPETA_COMPLEMENTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _CARPETA_COMPLEMENTO not in sys.path:
+    sys.path.insert(0, _CARPETA_COMPLEMENTO)
+
+import pytest  # noqa: E402
+
+from benchmarks.red_sintetica import generar_red  # noqa: E402
+from nucleo.rutas import RutaCompilada, tramos_por_via  # noqa: E402
+
+
+def compilar(red):
+    """(dict fid -> RutaCompilada, dict ID_ROAD -> TramosVia) de una lista de features."""
+    rutas, intervalos = {}, []
+    for f in red:
+        ruta = RutaCompilada(f.fid, f.via, f.partes)
+        rutas[f.fid] = ruta
+        intervalos.extend((f.via, a, b, f.fid, p) for p, a, b in ruta.rangos_m())
+    return rutas, tramos_por_via(intervalos)
+
+
+@pytest.fixture(scope="session")
+def red():
+    """Red sintética pequeña con huecos de calibración y tramos de M no monótona."""
+    return generar_red(vias=20, features_por_via=6, vertices_por_feature=30,
+                       prob_hueco=0.3, prob_no_monotona=0.2, extension=20000.0, semilla=7)
+
+
+@pytest.fixture(scope="session")
+def red_compilada(red):
+    return compilar(red)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Pruebas de nucleo/auditoria.py: incidencias de calibración por feature y por vía."""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import pytest
+
+from nucleo.auditoria import (
+    TIPO_DESCONEXION, TIPO_HUECO, TIPO_NO_MONOTONA, TIPO_RATIO, TIPO_SALTO, TIPO_SEGMENTO_NULO,
+    TIPO_SOLAPE, TIPOS, AuditoriaCalibracion, auditar_red
+)
+from nucleo.rutas import RutaCompilada, tramos_por_via
+
+from conftest import compilar
+
+
+def _ruta(fid, via, xs, ys, ms):
+    return RutaCompilada(fid, via, [(xs, ys, ms)])
+
+
+def _red(*rutas):
+    """(rutas, vias) como los devuelve compilar() a partir de RutaCompilada ya creadas."""
+    por_fid = {r.fid: r for r in rutas}
+    intervalos = [(r.via, a, b, r.fid, p) for r in rutas for p, a, b in r.rangos_m()]
+    return por_fid, tramos_por_via(intervalos)
+
+
+# ============================================================
+# INCIDENCIAS DE UNA FEATURE
+# ============================================================
+def test_ruta_correcta_sin_incidencias():
+    ruta = _ruta(1, "A", [0, 100, 200], [0, 0, 0], [0, 100, 200])
+    assert AuditoriaCalibracion().auditar_ruta(ruta, 1.0) == []
+
+
+def test_m_no_monotona():
+    ruta = _ruta(1, "A", [0, 100, 200, 210, 300], [0] * 5, [0, 100, 200, 190, 290])
+    (inc,) = AuditoriaCalibracion().auditar_ruta(ruta)
+    assert inc.tipo == TIPO_NO_MONOTONA
+    assert (inc.fid, inc.parte) == (1, 0)
+    assert (inc.m_ini, inc.m_fin, inc.valor) == (200, 190, 10)
+    assert inc.puntos == [(200, 0, 200), (210, 0, 190)]
+
+
+def test_m_decreciente_no_es_incidencia():
+    # Una feature calibrada al revés es monótona: no hay retroceso
+    ruta = _ruta(1, "A", [0, 100, 200], [0, 0, 0], [200, 100, 0])
+    assert AuditoriaCalibracion().auditar_ruta(ruta) == []
+
+
+def test_retroceso_dentro_de_la_tolerancia():
+    ruta = _ruta(1, "A", [0, 100, 200, 300], [0] * 4, [0, 100, 99.9995, 200])
+    assert AuditoriaCalibracion(tolerancia_m=0.001).auditar_ruta(ruta) == []
+
+
+def test_segmentos_nulos_consecutivos_se_agrupan():
+    ruta = _ruta(1, "A", [0, 10, 10, 10, 20, 20], [0, 0, 0, 0, 0, 0], [0, 10, 10, 10, 20, 20])
+    nulos = [inc for inc in AuditoriaCalibracion().auditar_ruta(ruta) if inc.tipo == TIPO_SEGMENTO_NULO]
+    assert [(inc.m_ini, inc.m_fin, inc.valor) for inc in nulos] == [(10, 10, 2.0), (20, 20, 1.0)]
+
+
+def test_ratio_m_longitud():
+    auditoria = AuditoriaCalibracion(tolerancia_ratio=0.1, longitud_min=50)
+    normales = [_ruta(fid, "A", [0, 100], [fid, fid], [0, 100]) for fid in range(1, 6)]
+    anomala = _ruta(9, "B", [0, 100], [50, 50], [0, 150])
+    corta = _ruta(10, "C", [0, 10], [60, 60], [0, 30])     # más corta que longitud_min
+    referencia = auditoria.ratio_referencia(normales + [anomala, corta])
+    assert referencia == pytest.approx(1.0)
+    (inc,) = auditoria.auditar_ruta(anomala, referencia)
+    assert (inc.tipo, inc.valor) == (TIPO_RATIO, pytest.approx(1.5))
+    assert auditoria.auditar_ruta(corta, referencia) == []
+    assert auditoria.auditar_ruta(normales[0], referencia) == []
+    assert auditoria.ratio_referencia([corta]) is None
+
+
+# ============================================================
+# INCIDENCIAS ENTRE TRAMOS DE UNA VÍA
+# ============================================================
+@pytest.mark.parametrize("inicio_xy, m_ini, tipo, valor", [
+    ((100, 0), 100, None, None),                  # continua
+    ((100, 0), 130, TIPO_SALTO, 30),              # conectada con salto de M
+    ((150, 0), 130, TIPO_HUECO, 30),              # separada con hueco de M
+    ((100, 0), 80, TIPO_SOLAPE, -20),             # M solapada
+    ((150, 0), 100, TIPO_DESCONEXION, 0),         # M continua, geometría separada
+])
+def test_auditar_via(inicio_xy, m_ini, tipo, valor):
+    a = _ruta(1, "A", [0, 100], [0, 0], [0, 100])
+    x0, y0 = inicio_xy
+    b = _ruta(2, "A", [x0, x0 + 100], [y0, y0], [m_ini, m_ini + 100])
+    rutas, vias = _red(a, b)
+    incidencias = AuditoriaCalibracion().auditar_via(vias["A"], rutas.get)
+    if tipo is None:
+        assert incidencias == []
+        return
+    (inc,) = incidencias
+    assert (inc.tipo, inc.fid, inc.valor) == (tipo, 2, pytest.approx(valor))
+    if tipo == TIPO_SOLAPE:
+        assert (inc.m_ini, inc.m_fin) == (80, 100)
+    else:
+        assert (inc.m_ini, inc.m_fin) == (100, m_ini)
+
+
+def test_auditar_via_compara_con_el_mayor_m_alcanzado():
+    # La feature 1 cubre 0-300; la 2 (100-200) queda dentro y la 3 empieza en 300
+    largo = _ruta(1, "A", [0, 300], [0, 0], [0, 300])
+    dentro = _ruta(2, "A", [100, 200], [0, 0], [100, 200])
+    siguiente = _ruta(3, "A", [300, 400], [0, 0], [300, 400])
+    rutas, vias = _red(largo, dentro, siguiente)
+    incidencias = AuditoriaCalibracion().auditar_via(vias["A"], rutas.get)
+    # Sólo el solape de la 2; la 3 continúa donde acaba la 1, no la 2
+    assert [(inc.tipo, inc.fid) for inc in incidencias] == [(TIPO_SOLAPE, 2)]
+
+
+def test_auditar_via_multiparte():
+    ruta = RutaCompilada(1, "A", [([0, 100], [0, 0], [0, 100]), ([100, 200], [0, 0], [150, 250])])
+    rutas, vias = _red(ruta)
+    (inc,) = AuditoriaCalibracion().auditar_via(vias["A"], rutas.get)
+    assert (inc.tipo, inc.fid, inc.parte, inc.valor) == (TIPO_SALTO, 1, 1, 50)
+
+
+# ============================================================
+# RED COMPLETA
+# ============================================================
+def test_auditar_red_sintetica(red):
+    rutas, vias = compilar(red)
+    incidencias, resumen = auditar_red(rutas, vias)
+
+    # Cada feature con un retroceso de M tiene su incidencia de M no monótona
+    retrocesos = {f.fid for f in red
+                  if any(b < a for a, b in zip(f.partes[0][2], f.partes[0][2][1:]))}
+    assert retrocesos
+    assert {inc.fid for inc in incidencias if inc.tipo == TIPO_NO_MONOTONA} == retrocesos
+
+    # Los huecos del generador están entre features conectadas: son saltos de M
+    for via, tramos in vias.items():
+        saltos = [inc for inc in incidencias if inc.via == via and inc.tipo == TIPO_SALTO]
+        assert [(inc.m_ini, inc.m_fin) for inc in saltos] == tramos.huecos()
+        assert resumen[via].incidencias[TIPO_SALTO] == len(saltos)
+    assert not [inc for inc in incidencias if inc.tipo in (TIPO_HUECO, TIPO_DESCONEXION)]
+
+    # Resumen por vía
+    assert set(resumen) == set(vias)
+    for via, r in resumen.items():
+        features = [f for f in red if f.via == via]
+        assert r.features == len(features)
+        assert r.longitud == pytest.approx(sum(rutas[f.fid].longitud for f in features))
+        assert (r.m_min, r.m_max) == (vias[via].m_min, vias[via].m_max)
+        assert set(r.incidencias) == set(TIPOS)
+    assert sum(sum(r.incidencias.values()) for r in resumen.values()) == len(incidencias)
+
+
+def test_auditar_red_cancelada(red_compilada):
+    rutas, vias = red_compilada
+    assert auditar_red(rutas, vias, cancelado=lambda: True) is None
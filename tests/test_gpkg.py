@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Pruebas de nucleo/gpkg.py: decodificación de WKB de GeoPackage y lectura de la red."""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import math
+import sqlite3
+import struct
+
+import pytest
+
+from benchmarks.red_sintetica import FeatureSintetica, escribir_gpkg
+from nucleo.gpkg import ErrorGpkg, RedGpkg, partes_gpkg
+
+from conftest import compilar
+
+
+def _wkb_linea(coords, tipo, orden="<"):
+    """LineString WKB con `coords` (tuplas de 2, 3 o 4 valores) y el código de tipo dado."""
+    cabecera = struct.pack(orden + "BII", 1 if orden == "<" else 0, tipo, len(coords))
+    return cabecera + b"".join(struct.pack(orden + "d" * len(c), *c) for c in coords)
+
+
+def _blob(wkb, caja=0, vacia=False, srs=25830):
+    """Cabecera GPKG con el indicador de caja dado (0 = sin caja) delante de `wkb`."""
+    flags = 0x01 | (caja << 1) | (0x10 if vacia else 0)
+    bytes_caja = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}[caja]
+    return b"GP\x00" + bytes([flags]) + struct.pack("<i", srs) + b"\x00" * bytes_caja + wkb
+
+
+def _igual(parte, xs, ys, ms):
+    pxs, pys, pms = parte
+    assert list(pxs) == xs and list(pys) == ys
+    if ms is None:
+        assert all(math.isnan(m) for m in pms) and len(pms) == len(xs)
+    else:
+        assert list(pms) == ms
+
+
+# ============================================================
+# DECODIFICACIÓN
+# ============================================================
+@pytest.mark.parametrize("orden", ["<", ">"])
+def test_linea_m_iso(orden):
+    blob = _blob(_wkb_linea([(0, 1, 10), (2, 3, 20)], 2002, orden))
+    (parte,) = partes_gpkg(blob)
+    _igual(parte, [0, 2], [1, 3], [10, 20])
+
+
+@pytest.mark.parametrize("orden", ["<", ">"])
+def test_linea_zm_iso(orden):
+    blob = _blob(_wkb_linea([(0, 1, 99, 10), (2, 3, 98, 20)], 3002, orden))
+    (parte,) = partes_gpkg(blob)
+    _igual(parte, [0, 2], [1, 3], [10, 20])
+
+
+def test_linea_m_ewkb():
+    blob = _blob(_wkb_linea([(0, 1, 10), (2, 3, 20)], 0x40000000 | 2))
+    _igual(partes_gpkg(blob)[0], [0, 2], [1, 3], [10, 20])
+
+
+def test_linea_zm_ewkb():
+    blob = _blob(_wkb_linea([(0, 1, 5, 10), (2, 3, 6, 20)], 0xC0000000 | 2))
+    _igual(partes_gpkg(blob)[0], [0, 2], [1, 3], [10, 20])
+
+
+def test_linea_sin_m_da_nan():
+    blob = _blob(_wkb_linea([(0, 1), (2, 3), (4, 5)], 2))
+    _igual(partes_gpkg(blob)[0], [0, 2, 4], [1, 3, 5], None)
+
+
+def test_linea_z_sin_m():
+    blob = _blob(_wkb_linea([(0, 1, 7), (2, 3, 8)], 1002))
+    _igual(partes_gpkg(blob)[0], [0, 2], [1, 3], None)
+
+
+@pytest.mark.parametrize("caja", [1, 2, 3, 4])
+def test_cabecera_con_caja(caja):
+    blob = _blob(_wkb_linea([(0, 1, 10), (2, 3, 20)], 2002), caja=caja)
+    _igual(partes_gpkg(blob)[0], [0, 2], [1, 3], [10, 20])
+
+
+@pytest.mark.parametrize("orden", ["<", ">"])
+def test_multilinea_con_partes_de_distinto_orden_de_bytes(orden):
+    otro = ">" if orden == "<" else "<"
+    wkb = (struct.pack(orden + "BII", 1 if orden == "<" else 0, 2005, 2)
+           + _wkb_linea([(0, 0, 0), (1, 0, 1)], 2002, orden)
+           + _wkb_linea([(5, 5, 10), (6, 5, 11), (7, 5, 12)], 2002, otro))
+    partes = partes_gpkg(_blob(wkb))
+    assert len(partes) == 2
+    _igual(partes[0], [0, 1], [0, 0], [0, 1])
+    _igual(partes[1], [5, 6, 7], [5, 5, 5], [10, 11, 12])
+
+
+def test_multilinea_vacia_y_geometria_vacia():
+    assert partes_gpkg(_blob(struct.pack("<BII", 1, 2005, 0))) == []
+    assert partes_gpkg(_blob(b"", vacia=True)) == []
+
+
+@pytest.mark.parametrize("blob", [None, b"", b"XX\x00\x01" + b"\x00" * 20])
+def test_blob_no_gpkg(blob):
+    assert partes_gpkg(blob) == []
+
+
+def test_geometria_no_lineal():
+    punto = struct.pack("<BIddd", 1, 2001, 1.0, 2.0, 3.0)
+    assert partes_gpkg(_blob(punto)) == []
+
+
+def test_multilinea_con_parte_no_lineal():
+    wkb = struct.pack("<BII", 1, 2005, 1) + struct.pack("<BIddd", 1, 2001, 1.0, 2.0, 3.0)
+    with pytest.raises(ErrorGpkg):
+        partes_gpkg(_blob(wkb))
+
+
+# ============================================================
+# RED DE CARRETERAS
+# ============================================================
+def test_red_gpkg_coincide_con_la_red_en_memoria(tmp_path, red, red_compilada):
+    rutas, vias = red_compilada
+    path = tmp_path / "red.gpkg"
+    escribir_gpkg(str(path), red)
+    red_gpkg = RedGpkg(str(path))
+    try:
+        via = red[0].via
+        tramos = red_gpkg.tramos_via(via)
+        assert tramos.claves == vias[via].claves
+        # Sólo se han compilado las features de esa vía
+        assert set(red_gpkg.rutas) == {f.fid for f in red if f.via == via}
+        assert red_gpkg.tramos_via("NO-EXISTE") is None
+
+        cargadas = red_gpkg.cargar_todo()
+        assert set(cargadas) == set(rutas)
+        for fid, ruta in rutas.items():
+            assert list(cargadas[fid].xs) == list(ruta.xs)
+            assert list(cargadas[fid].ms) == list(ruta.ms)
+            assert list(cargadas[fid].cum) == pytest.approx(list(ruta.cum))
+    finally:
+        red_gpkg.cerrar()
+
+
+def test_red_gpkg_multiparte(tmp_path):
+    red = [FeatureSintetica(1, "A", [([0, 100], [0, 0], [0, 100]), ([100, 100], [50, 150], [200, 300])])]
+    path = tmp_path / "multi.gpkg"
+    escribir_gpkg(str(path), red)
+    red_gpkg = RedGpkg(str(path))
+    try:
+        tramos = red_gpkg.tramos_via("A")
+        assert tramos.claves == [(1, 0), (1, 1)]
+        assert tramos.huecos() == [(100, 200)]
+        assert list(red_gpkg.ruta(1).cum) == list(compilar(red)[0][1].cum)
+    finally:
+        red_gpkg.cerrar()
+
+
+def test_red_gpkg_errores(tmp_path, red):
+    with pytest.raises(ErrorGpkg):
+        RedGpkg(str(tmp_path / "no_existe.gpkg"))
+    texto = tmp_path / "texto.gpkg"
+    texto.write_text("esto no es un GeoPackage")
+    with pytest.raises(ErrorGpkg):
+        RedGpkg(str(texto))
+    path = tmp_path / "a?b#c%d.gpkg"
+    escribir_gpkg(str(path), red[:3])
+    with pytest.raises(ErrorGpkg):
+        RedGpkg(str(path), campo="OTRO")
+    with pytest.raises(ErrorGpkg):
+        RedGpkg(str(path), capa="otra_capa")
+    red_gpkg = RedGpkg(str(path))
+    red_gpkg.cerrar()
+
+
+def test_red_gpkg_es_de_solo_lectura(tmp_path, red):
+    path = tmp_path / "red.gpkg"
+    escribir_gpkg(str(path), red[:3])
+    red_gpkg = RedGpkg(str(path))
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            red_gpkg.con.execute("DELETE FROM carreteras")
+    finally:
+        red_gpkg.cerrar()
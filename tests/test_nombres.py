@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Pruebas de nucleo/nombres.py: normalización y búsqueda de vías por prefijo."""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import random
+
+import pytest
+
+from nucleo.nombres import IndiceNombres, normalizar_nombre
+
+NOMBRES = ["A-6", "A-62", "AP-6", "N-II", "N-VI", "M-30", "M-40", "CV-35", "Ávila-1", "a6", None, ""]
+
+
+@pytest.mark.parametrize("texto, clave", [
+    ("A-6", "a6"),
+    ("n ii", "nii"),
+    ("Ávila", "avila"),
+    ("  CV.35 ", "cv35"),
+    ("ÑANDÚ", "nandu"),     # la tilde de la Ñ también se descompone
+    (123, "123"),
+    ("", ""),
+])
+def test_normalizar_nombre(texto, clave):
+    assert normalizar_nombre(texto) == clave
+
+
+def test_indice_ignora_vacios_y_duplicados():
+    indice = IndiceNombres(NOMBRES + ["A-6"])
+    assert len(indice) == 10
+    assert indice.claves == sorted(indice.claves)
+
+
+@pytest.mark.parametrize("texto, esperado", [
+    ("a6", ["A-6", "a6", "A-62"]),
+    ("A-6", ["A-6", "a6", "A-62"]),
+    ("a62", ["A-62"]),
+    ("ap", ["AP-6"]),
+    ("n-", ["N-II", "N-VI"]),       # la puntuación no cuenta: equivale a "n"
+    ("m", ["M-30", "M-40"]),
+    ("avila", ["Ávila-1"]),
+    ("x", []),
+    ("zzzz", []),
+])
+def test_buscar_por_prefijo(texto, esperado):
+    assert sorted(IndiceNombres(NOMBRES).buscar(texto)) == sorted(esperado)
+
+
+def test_buscar_con_limite_y_texto_vacio():
+    indice = IndiceNombres(NOMBRES)
+    assert indice.buscar("", limite=3) == indice.nombres[:3]
+    assert indice.buscar("") == indice.nombres
+    assert len(indice.buscar("a", limite=2)) == 2
+
+
+def test_rango_dentro_de_un_prefijo_anterior():
+    indice = IndiceNombres(NOMBRES)
+    previo = indice.rango("a")
+    # Seguir escribiendo acota la búsqueda al rango anterior y da lo mismo
+    for texto in ("a6", "a62", "ap", "av", "ax"):
+        assert indice.rango(texto, previo) == indice.rango(texto)
+
+
+def test_rango_coincide_con_fuerza_bruta():
+    rnd = random.Random(9)
+    letras = "ANMCVPÁ-I "
+    nombres = {"".join(rnd.choice(letras) for _ in range(rnd.randint(1, 6))) for _ in range(500)}
+    indice = IndiceNombres(nombres)
+    for _ in range(300):
+        texto = "".join(rnd.choice(letras) for _ in range(rnd.randint(0, 3)))
+        prefijo = normalizar_nombre(texto)
+        esperado = sorted(n for n in nombres if n and normalizar_nombre(n).startswith(prefijo))
+        assert sorted(indice.buscar(texto)) == esperado
+
+
+@pytest.mark.parametrize("texto, nombre", [
+    ("a62", "A-62"),
+    ("ap 6", "AP-6"),
+    ("n-ii", "N-II"),
+    ("A-6", "A-6"),     # escrito tal cual: se prefiere el nombre exacto
+    ("a6", "a6"),
+    ("A 6", None),      # "A-6" y "a6" tienen la misma clave
+    ("a", None),        # sólo prefijo, ninguna clave exacta
+    ("x", None),
+])
+def test_resolver(texto, nombre):
+    assert IndiceNombres(NOMBRES).resolver(texto) == nombre
+
+
+def test_indice_de_la_red_sintetica(red):
+    indice = IndiceNombres(f.via for f in red)
+    vias = {f.via for f in red}
+    assert len(indice) == len(vias)
+    for via in vias:
+        assert indice.resolver(via.lower().replace("-", " ")) == via
+    assert sorted(indice.buscar("v1")) == sorted(v for v in vias if v.startswith("V-1"))
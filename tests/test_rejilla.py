@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Pruebas de nucleo/rejilla.py: búsqueda por anillos de celdas frente a fuerza bruta."""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import random
+
+import pytest
+
+from nucleo.rejilla import (
+    ANILLOS_MAX, RejillaCajas, RejillaSegmentos, distancia2_caja, ruta_mas_cercana
+)
+from nucleo.rutas import RutaCompilada, pk_at_point
+
+
+def _mas_cercana_fuerza_bruta(rutas, x, y, radio=0.0):
+    """Separación mínima de (x, y) a cualquier ruta (dentro de `radio` si es > 0), o None."""
+    seps = [pk_at_point(r, x, y).separacion for r in rutas if r.es_valida()]
+    mejor = min(seps) if seps else None
+    if mejor is None or (radio > 0 and mejor > radio):
+        return None
+    return mejor
+
+
+def _puntos(rutas, n, semilla, ruido):
+    """Puntos a menos de `ruido` de un vértice aleatorio de la red."""
+    rnd = random.Random(semilla)
+    lista = list(rutas)
+    puntos = []
+    for _ in range(n):
+        r = rnd.choice(lista)
+        i = rnd.randrange(len(r.xs))
+        puntos.append((r.xs[i] + rnd.uniform(-ruido, ruido), r.ys[i] + rnd.uniform(-ruido, ruido)))
+    return puntos
+
+
+def _comprobar(rejilla, rutas, puntos, radio):
+    por_fid = {r.fid: r for r in rutas}
+    for x, y in puntos:
+        res = rejilla.mas_cercano(x, y, por_fid.get, radio)
+        esperado = _mas_cercana_fuerza_bruta(rutas, x, y, radio)
+        if esperado is None:
+            assert res is None
+        else:
+            assert res is not None
+            assert res.separacion == pytest.approx(esperado, abs=1e-9)
+            # El resultado es la proyección completa sobre la ruta elegida
+            assert res == pk_at_point(res.ruta, x, y, (res.ruta.proyectar(x, y)[4],))
+
+
+# ============================================================
+# REJILLA DE SEGMENTOS
+# ============================================================
+@pytest.mark.parametrize("radio", [0.0, 50.0, 5.0])
+def test_mas_cercano_cerca_de_la_red(red_compilada, radio):
+    rutas, _ = red_compilada
+    rejilla = RejillaSegmentos(rutas.values())
+    _comprobar(rejilla, list(rutas.values()), _puntos(rutas.values(), 150, 1, 40.0), radio)
+
+
+@pytest.mark.parametrize("radio", [0.0, 500.0])
+def test_mas_cercano_lejos_de_la_red(red_compilada, radio):
+    # Más de ANILLOS_MAX anillos: la consulta pasa a las cajas de las rutas
+    rutas, _ = red_compilada
+    rejilla = RejillaSegmentos(rutas.values())
+    distancia = rejilla.celda * (ANILLOS_MAX + 3)
+    puntos = [(x + distancia, y - distancia) for x, y in _puntos(rutas.values(), 100, 2, 0.0)]
+    puntos += [(-1e6, -1e6), (1e6, 5e3), (5e3, 1e6)]
+    _comprobar(rejilla, list(rutas.values()), puntos, radio)
+
+
+@pytest.mark.parametrize("celda", [1.0, 25.0, 400.0, 5000.0])
+def test_mas_cercano_con_distintos_tamanos_de_celda(red_compilada, celda):
+    rutas, _ = red_compilada
+    rejilla = RejillaSegmentos(rutas.values(), celda=celda)
+    _comprobar(rejilla, list(rutas.values()), _puntos(rutas.values(), 100, 3, 80.0), 0.0)
+
+
+def test_mas_cercano_desde_fuera_de_las_celdas_ocupadas():
+    # Una sola ruta diagonal y puntos alrededor, fuera de las celdas que ocupa
+    ruta = RutaCompilada(1, "A", [([0, 10, 20], [0, 10, 20], [0, 14, 28])])
+    rejilla = RejillaSegmentos([ruta], celda=5.0)
+    puntos = [(-7, 3), (30, -2), (25, 40), (-20, -20), (10.5, 9.5), (40, 40)]
+    _comprobar(rejilla, [ruta], puntos, 0.0)
+    _comprobar(rejilla, [ruta], puntos, 8.0)
+
+
+def test_mas_cercano_en_el_borde_de_una_celda():
+    # Segmentos a ambos lados del borde x = 10 de una celda de 10
+    a = RutaCompilada(1, "A", [([9.9, 9.9], [0, 100], [0, 100])])
+    b = RutaCompilada(2, "B", [([12, 12], [0, 100], [0, 100])])
+    rejilla = RejillaSegmentos([a, b], celda=10.0)
+    assert rejilla.mas_cercano(10.5, 50, {1: a, 2: b}.get).ruta is a
+    assert rejilla.mas_cercano(11.5, 50, {1: a, 2: b}.get).ruta is b
+
+
+def test_rejilla_vacia_y_rutas_degeneradas():
+    punto = RutaCompilada(1, "A", [([5], [5], [0])])
+    rejilla = RejillaSegmentos([punto])
+    assert rejilla.limites is None
+    assert rejilla.mas_cercano(0, 0, {1: punto}.get) is None
+    assert RejillaSegmentos([]).mas_cercano(0, 0, {}.get) is None
+
+
+def test_quitar_y_agregar(red_compilada):
+    rutas, _ = red_compilada
+    rejilla = RejillaSegmentos(rutas.values())
+    puntos = _puntos(rutas.values(), 100, 4, 20.0)
+    quitadas = {r.fid for r in random.Random(4).sample(list(rutas.values()), 20)}
+    for fid in quitadas:
+        rejilla.quitar(fid)
+    restantes = [r for r in rutas.values() if r.fid not in quitadas]
+    _comprobar(rejilla, restantes, puntos, 0.0)
+    for fid in quitadas:
+        rejilla.agregar(rutas[fid])
+    _comprobar(rejilla, list(rutas.values()), puntos, 0.0)
+
+
+def test_multiparte_no_indexa_el_salto_entre_partes():
+    ruta = RutaCompilada(1, "A", [([0, 10], [0, 0], [0, 10]), ([100, 110], [0, 0], [20, 30])])
+    rejilla = RejillaSegmentos([ruta], celda=5.0)
+    segmentos = {int(celda[n + 1]) for celda in rejilla.celdas.values() for n in range(0, len(celda), 2)}
+    assert segmentos == {0, 2}
+    # Sobre el salto entre partes, la proyección va al extremo de una parte
+    res = rejilla.mas_cercano(55, 1, {1: ruta}.get)
+    assert (res.x, res.y) in ((10, 0), (100, 0))
+    assert res.separacion == pytest.approx((45 ** 2 + 1) ** 0.5)
+
+
+# ============================================================
+# REJILLA DE CAJAS
+# ============================================================
+def test_cercanas_coincide_con_fuerza_bruta(red_compilada):
+    rutas, _ = red_compilada
+    cajas = {fid: r.caja() for fid, r in rutas.items()}
+    rejilla = RejillaCajas(cajas.items())
+    rnd = random.Random(5)
+    for _ in range(200):
+        x, y, radio = rnd.uniform(-1000, 21000), rnd.uniform(-1000, 21000), rnd.uniform(0, 3000)
+        esperado = sorted((distancia2_caja(c, x, y), fid) for fid, c in cajas.items()
+                          if distancia2_caja(c, x, y) <= radio * radio)
+        assert rejilla.cercanas(x, y, radio) == esperado
+
+
+def test_cajas_grandes_se_guardan_aparte():
+    cajas = {1: (0, 0, 10, 10), 2: (0, 0, 10000, 10000)}
+    rejilla = RejillaCajas(cajas.items(), celda=10.0)
+    assert rejilla.grandes == [2]
+    assert [fid for _, fid in rejilla.cercanas(5000, 5000, 1)] == [2]
+    rejilla.quitar(2)
+    assert rejilla.grandes == [] and rejilla.cercanas(5000, 5000, 1) == []
+    rejilla.quitar(1)
+    assert rejilla.celdas == {}
+
+
+@pytest.mark.parametrize("dist_max", [0.0, 30.0])
+def test_ruta_mas_cercana(red_compilada, dist_max):
+    rutas, _ = red_compilada
+    rejilla = RejillaCajas((fid, r.caja()) for fid, r in rutas.items())
+    lista = list(rutas.values())
+    puntos = _puntos(lista, 100, 6, 60.0) + [(-5e4, 3e3), (9e4, 9e4)]
+    for x, y in puntos:
+        res = ruta_mas_cercana(rejilla, rutas.get, x, y, dist_max)
+        esperado = _mas_cercana_fuerza_bruta(lista, x, y, dist_max)
+        if esperado is None:
+            assert res is None
+        else:
+            assert res.separacion == pytest.approx(esperado, abs=1e-9)
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""Pruebas de nucleo/rutas.py: interpolación, partes, M no monótona y huecos."""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import math
+import random
+
+import pytest
+
+from nucleo.rutas import (
+    ESTADO_FUERA, ESTADO_HUECO, ESTADO_OK, ESTADO_SOLAPE, M_POR_KM, RutaCompilada,
+    distancia_lineal_m, formato_pk, localizar_m, pk_at_point, pk_desde_valor,
+    segmentacion_dinamica, tramos_por_via
+)
+
+from conftest import compilar
+
+
+def _ruta(fid, via, *partes):
+    return RutaCompilada(fid, via, partes)
+
+
+def _red_con_hueco():
+    """Vía "A" recta sobre el eje X: 0-100 m, hueco hasta 200 y 200-300 m solapada con 250-400."""
+    rutas = {
+        1: _ruta(1, "A", ([0, 50, 100], [0, 0, 0], [0, 50, 100])),
+        2: _ruta(2, "A", ([200, 300], [0, 0], [200, 300])),
+        3: _ruta(3, "A", ([250, 400], [10, 10], [250, 400])),
+    }
+    intervalos = [(r.via, a, b, fid, p) for fid, r in rutas.items() for p, a, b in r.rangos_m()]
+    return rutas, tramos_por_via(intervalos)["A"]
+
+
+# ============================================================
+# FORMATO Y LECTURA DE PK
+# ============================================================
+@pytest.mark.parametrize("pk, texto", [
+    (0.0, "0+000"),
+    (12.345, "12+345"),
+    (123.0, "123+000"),
+    (0.9994, "0+999"),
+    (0.9995, "1+000"),     # 999.5 m pasa al km siguiente
+    (0.99999, "1+000"),
+    (1.9996, "2+000"),
+    (9.9996, "10+000"),
+    (2.0004, "2+000"),
+    (-0.5, "-0+500"),
+    (-0.0004, "0+000"),    # se redondea a cero metros: sin signo
+])
+def test_formato_pk(pk, texto):
+    assert formato_pk(pk) == texto
+
+
+@pytest.mark.parametrize("pk", [float("nan"), None])
+def test_formato_pk_sin_valor(pk):
+    assert formato_pk(pk) == "—"
+
+
+@pytest.mark.parametrize("valor, km", [
+    (12.345, 12.345),
+    (3, 3.0),
+    ("12+345", 12.345),
+    (" 1 + 200 ", 1.2),
+    ("12+345,5", 12.3455),
+    ("12,5", 12.5),
+    ("12.5", 12.5),
+])
+def test_pk_desde_valor(valor, km):
+    assert pk_desde_valor(valor) == pytest.approx(km)
+
+
+@pytest.mark.parametrize("valor", [None, float("nan"), "", "abc", "1+x"])
+def test_pk_desde_valor_invalido(valor):
+    assert pk_desde_valor(valor) is None
+
+
+def test_formato_y_lectura_son_inversos():
+    for metros in range(0, 5000, 7):
+        assert pk_desde_valor(formato_pk(metros / 1000.0)) == pytest.approx(metros / 1000.0)
+
+
+# ============================================================
+# RUTA DE UNA PARTE
+# ============================================================
+def test_pk_en_punto_interpola_m():
+    ruta = _ruta(1, "A", ([0, 100, 200], [0, 0, 0], [1000, 1100, 1300]))
+    res = pk_at_point(ruta, 150, 10)
+    assert res.ruta is ruta
+    assert res.pk == pytest.approx(1.2)
+    assert res.distancia == pytest.approx(150)
+    assert (res.x, res.y) == pytest.approx((150, 0))
+    assert res.separacion == pytest.approx(10)
+
+
+def test_pk_en_punto_fuera_de_los_extremos_se_ajusta_al_extremo():
+    ruta = _ruta(1, "A", ([0, 100], [0, 0], [0, 100]))
+    assert pk_at_point(ruta, -50, 0).pk == pytest.approx(0.0)
+    assert pk_at_point(ruta, 150, 0).pk == pytest.approx(0.1)
+
+
+def test_ruta_sin_segmentos():
+    ruta = _ruta(1, "A", ([5], [5], [0]))
+    assert not ruta.es_valida()
+    assert pk_at_point(ruta, 0, 0) is None
+    assert ruta.segmento_en_distancia(0) is None
+    assert math.isnan(ruta.m_en_distancia(0))
+
+
+def test_punto_en_m_y_m_en_distancia_son_inversos(red_compilada):
+    rutas, _ = red_compilada
+    rnd = random.Random(1)
+    for ruta in rutas.values():
+        for _, _, lo, hi, _, parte in ruta.corridas:
+            if hi - lo < 1:
+                continue
+            m = rnd.uniform(lo, hi)
+            x, y, dist = ruta.punto_en_m(m, parte)
+            assert ruta.m_en_distancia(dist) == pytest.approx(m, abs=1e-6)
+
+
+def test_pk_en_vertices_de_la_red(red_compilada):
+    rutas, _ = red_compilada
+    rnd = random.Random(2)
+    for ruta in rnd.sample(list(rutas.values()), 30):
+        i = rnd.randrange(len(ruta.xs))
+        res = pk_at_point(ruta, ruta.xs[i], ruta.ys[i])
+        assert res.separacion == pytest.approx(0, abs=1e-9)
+        assert res.pk * M_POR_KM == pytest.approx(ruta.ms[i], abs=1e-6)
+
+
+# ============================================================
+# VARIAS PARTES
+# ============================================================
+def _multiparte():
+    # Parte 0: (0,0)-(100,0) con M 0-100; parte 1: (100,50)-(100,150) con M 200-300
+    return _ruta(7, "A", ([0, 100], [0, 0], [0, 100]), ([100, 100], [50, 150], [200, 300]))
+
+
+def test_multiparte_no_suma_el_salto_entre_partes():
+    ruta = _multiparte()
+    assert list(ruta.limites) == [0, 2, 4]
+    assert list(ruta.cum) == [0, 100, 100, 200]
+    assert ruta.longitud == 200
+    assert list(ruta.segmentos()) == [0, 2]
+    assert list(ruta.segmentos(1)) == [2]
+    assert not ruta.es_segmento(1)
+    assert ruta.rangos_m() == [(0, 0, 100), (1, 200, 300)]
+
+
+def test_multiparte_proyecta_sobre_la_parte_cercana():
+    ruta = _multiparte()
+    res = pk_at_point(ruta, 110, 100)
+    assert res.pk == pytest.approx(0.25)
+    assert res.distancia == pytest.approx(150)
+    assert (res.x, res.y) == pytest.approx((100, 100))
+
+
+def test_multiparte_punto_en_m():
+    ruta = _multiparte()
+    assert ruta.punto_en_m(150) is None          # entre las dos partes
+    assert ruta.punto_en_m(250) == pytest.approx((100, 100, 150))
+    assert ruta.punto_en_m(250, 0) is None
+    assert ruta.puntos_en_m([50, 150, 250]) == [pytest.approx((50, 0, 50)), None,
+                                                 pytest.approx((100, 100, 150))]
+
+
+def test_segmento_en_distancia_no_cae_en_el_salto():
+    ruta = _multiparte()
+    assert ruta.segmento_en_distancia(100) in (0, 2)
+    assert ruta.segmento_en_distancia(100, 0) == 0
+    assert ruta.segmento_en_distancia(100, 1) == 2
+    assert ruta.segmento_en_distancia(1e9) == 2
+    assert ruta.segmento_en_distancia(-1) == 0
+
+
+def test_segmento_en_distancia_con_partes_de_un_vertice():
+    ruta = _ruta(1, "A", ([0], [0], [0]), ([0, 10], [0, 0], [0, 10]), ([20], [0], [20]))
+    assert ruta.segmento_en_distancia(0, 0) is None
+    assert ruta.segmento_en_distancia(0, 2) is None
+    assert ruta.segmento_en_distancia(5, 1) == 1
+    assert ruta.segmento_en_distancia(-1) == 1
+    assert ruta.segmento_en_distancia(100) == 1
+    assert ruta.subcadena(0, 0, 0) == []
+
+
+# ============================================================
+# M NO MONÓTONA
+# ============================================================
+def _no_monotona():
+    # M sube hasta 20, retrocede a 15 y vuelve a subir hasta 25
+    return _ruta(1, "A", ([0, 10, 20, 30, 40], [0, 0, 0, 0, 0], [0, 10, 20, 15, 25]))
+
+
+def test_no_monotona_se_divide_en_corridas():
+    ruta = _no_monotona()
+    assert [(c[0], c[1], c[4]) for c in ruta.corridas] == [(0, 2, True), (2, 3, False), (3, 4, True)]
+    assert ruta.rangos_m() == [(0, 0, 25)]
+
+
+def test_no_monotona_punto_en_m():
+    ruta = _no_monotona()
+    # 17 aparece en las tres corridas: se devuelve la primera
+    assert ruta.punto_en_m(17) == pytest.approx((17, 0, 17))
+    assert ruta.punto_en_m(24) == pytest.approx((39, 0, 39))
+    ms = [5, 17, 22, 24]
+    assert ruta.puntos_en_m(ms) == [pytest.approx(ruta.punto_en_m(m)) for m in ms]
+
+
+def test_no_monotona_decreciente():
+    ruta = _ruta(1, "A", ([0, 10, 20], [0, 0, 0], [20, 10, 0]))
+    assert ruta.punto_en_m(15) == pytest.approx((5, 0, 5))
+    assert ruta.puntos_en_m([0, 5, 15, 20]) == [
+        pytest.approx((20, 0, 20)), pytest.approx((15, 0, 15)),
+        pytest.approx((5, 0, 5)), pytest.approx((0, 0, 0))
+    ]
+
+
+def test_m_nula_corta_la_corrida():
+    ruta = _ruta(1, "A", ([0, 10, 20, 30], [0, 0, 0, 0], [0, 10, float("nan"), 30]))
+    assert [(c[0], c[1]) for c in ruta.corridas] == [(0, 1)]
+    assert ruta.punto_en_m(25) is None
+
+
+def test_puntos_en_m_coincide_con_punto_en_m_en_la_red(red_compilada):
+    rutas, _ = red_compilada
+    rnd = random.Random(3)
+    for ruta in rutas.values():
+        (_, lo, hi), = ruta.rangos_m()
+        ms = sorted(rnd.uniform(lo - 50, hi + 50) for _ in range(20))
+        esperado = [ruta.punto_en_m(m) for m in ms]
+        for obtenido, punto in zip(ruta.puntos_en_m(ms), esperado):
+            assert (obtenido is None) == (punto is None)
+            if punto is not None:
+                assert obtenido == pytest.approx(punto)
+
+
+# ============================================================
+# VÍAS: HUECOS, SOLAPES Y DISTANCIAS
+# ============================================================
+def test_localizar_m_estados():
+    rutas, tramos = _red_con_hueco()
+    estado, fid, punto = localizar_m(tramos, rutas.get, 50)
+    assert (estado, fid) == (ESTADO_OK, 1)
+    assert punto == pytest.approx((50, 0, 50))
+    assert localizar_m(tramos, rutas.get, 150) == (ESTADO_HUECO, None, None)
+    assert localizar_m(tramos, rutas.get, 500) == (ESTADO_FUERA, None, None)
+    assert localizar_m(tramos, rutas.get, -1) == (ESTADO_FUERA, None, None)
+    estado, fid, _ = localizar_m(tramos, rutas.get, 275)
+    assert (estado, fid) == (ESTADO_SOLAPE, 2)
+    assert localizar_m(tramos, rutas.get, 350)[:2] == (ESTADO_OK, 3)
+
+
+def test_distancia_lineal_salta_los_huecos():
+    rutas, tramos = _red_con_hueco()
+    assert distancia_lineal_m(tramos, rutas.get, 20, 80) == pytest.approx(60)
+    assert distancia_lineal_m(tramos, rutas.get, 80, 20) == pytest.approx(60)
+    # 50-100 en la feature 1 y 200-220 en la 2; el hueco no suma
+    assert distancia_lineal_m(tramos, rutas.get, 50, 220) == pytest.approx(70)
+
+
+def test_distancia_lineal_en_la_red(red, red_compilada):
+    rutas, vias = red_compilada
+    # Sin retrocesos ni solapes, la distancia entre los extremos de una
+    # feature es su longitud
+    for f in red:
+        ms = f.partes[0][2]
+        if all(b >= a for a, b in zip(ms, ms[1:])) and not vias[f.via].solapes():
+            total = distancia_lineal_m(vias[f.via], rutas.get, ms[0], ms[-1])
+            assert total == pytest.approx(rutas[f.fid].longitud)
+
+
+def test_segmentacion_dinamica_con_hueco():
+    rutas, tramos = _red_con_hueco()
+    (partes, completo), = segmentacion_dinamica(tramos, rutas.get, [(50, 220)])
+    assert not completo
+    assert partes == [
+        [pytest.approx((50, 0, 50)), pytest.approx((100, 0, 100))],
+        [pytest.approx((200, 0, 200)), pytest.approx((220, 0, 220))],
+    ]
+
+
+def test_segmentacion_dinamica_completa_y_en_sentido_contrario():
+    rutas, tramos = _red_con_hueco()
+    directo, inverso, fuera = segmentacion_dinamica(tramos, rutas.get, [(10, 75), (75, 10), (500, 600)])
+    assert directo[1] and inverso[1]
+    assert directo[0] == [[pytest.approx((10, 0, 10)), pytest.approx((50, 0, 50)),
+                           pytest.approx((75, 0, 75))]]
+    assert inverso[0] == [list(reversed(directo[0][0]))]
+    assert fuera == ([], False)
+
+
+def test_segmentacion_dinamica_en_la_red(red_compilada):
+    rutas, vias = red_compilada
+    rnd = random.Random(4)
+    for via, tramos in vias.items():
+        eventos = [tuple(rnd.uniform(tramos.m_min, tramos.m_max) for _ in range(2)) for _ in range(5)]
+        for (lo, hi), (partes, completo) in zip(eventos, segmentacion_dinamica(tramos, rutas.get, eventos)):
+            if completo:
+                assert partes
+            assert all(len(puntos) >= 2 for puntos in partes)
+            # Las piezas siguen la geometría: suman lo mismo que la distancia lineal
+            if not tramos.solapes():
+                longitud = sum(
+                    sum(math.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(p, p[1:])) for p in partes
+                )
+                assert longitud == pytest.approx(distancia_lineal_m(tramos, rutas.get, lo, hi), rel=1e-6)
+
+
+def test_compilar_red_sintetica(red, red_compilada):
+    rutas, vias = red_compilada
+    assert set(rutas) == {f.fid for f in red}
+    assert set(vias) == {f.via for f in red}
+    assert compilar(red[:1])[0][red[0].fid].longitud == pytest.approx(rutas[red[0].fid].longitud)
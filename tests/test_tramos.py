@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Pruebas de TramosVia (nucleo/rutas.py): búsqueda por bisección de tramos M."""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import random
+
+import pytest
+
+from nucleo.rutas import TramosVia, actualizar_tramos, tramos_por_via
+
+
+def _tramos(*intervalos):
+    """TramosVia "A" con intervalos (m_min, m_max); el fid es la posición + 1 y la parte 0."""
+    return TramosVia("A", [(a, b, fid, 0) for fid, (a, b) in enumerate(intervalos, 1)])
+
+
+def _buscar_fuerza_bruta(intervalos, m):
+    return sorted(((a, b), (fid, p)) for a, b, fid, p in intervalos if a <= m <= b)
+
+
+def test_vacio():
+    tramos = TramosVia("A", [])
+    assert len(tramos) == 0
+    assert tramos.m_min is None and tramos.m_max is None
+    assert tramos.buscar(0) == []
+    assert tramos.huecos() == [] and tramos.solapes() == []
+
+
+def test_buscar_con_huecos_y_extremos():
+    tramos = _tramos((0, 100), (200, 300), (100, 150))
+    assert (tramos.m_min, tramos.m_max) == (0, 300)
+    assert tramos.buscar(50) == [(1, 0)]
+    assert tramos.buscar(100) == [(1, 0), (3, 0)]     # extremo compartido
+    assert tramos.buscar(175) == []
+    assert tramos.buscar(-1) == [] and tramos.buscar(301) == []
+    assert tramos.buscar(300) == [(2, 0)]
+
+
+def test_buscar_con_un_tramo_largo_que_cubre_a_otros():
+    # El primer tramo acaba después que los siguientes: la búsqueda hacia
+    # atrás no puede cortarse en el primer tramo que no contiene m
+    tramos = _tramos((0, 1000), (10, 20), (30, 40), (50, 60))
+    assert tramos.buscar(55) == [(1, 0), (4, 0)]
+    assert tramos.buscar(25) == [(1, 0)]
+    assert tramos.m_max == 1000
+
+
+def test_buscar_coincide_con_fuerza_bruta(red_compilada):
+    _, vias = red_compilada
+    rnd = random.Random(5)
+    for tramos in vias.values():
+        intervalos = list(zip(tramos.m_ini, tramos.m_fin, *zip(*tramos.claves)))
+        for _ in range(50):
+            m = rnd.uniform(tramos.m_min - 100, tramos.m_max + 100)
+            esperado = [clave for _, clave in _buscar_fuerza_bruta(intervalos, m)]
+            assert sorted(tramos.buscar(m)) == sorted(esperado)
+
+
+def test_buscar_con_solapes_aleatorios():
+    rnd = random.Random(6)
+    intervalos = []
+    for fid in range(1, 200):
+        a = rnd.uniform(0, 10000)
+        intervalos.append((a, a + rnd.expovariate(1 / 300.0), fid, rnd.randrange(2)))
+    tramos = TramosVia("A", intervalos)
+    for _ in range(500):
+        m = rnd.uniform(-100, 11000)
+        encontrados = tramos.buscar(m)
+        assert sorted(encontrados) == sorted(c for _, c in _buscar_fuerza_bruta(intervalos, m))
+        # En orden de M inicial
+        inicios = [next(a for a, _, f, p in intervalos if (f, p) == c) for c in encontrados]
+        assert inicios == sorted(inicios)
+
+
+def test_intervalos_entre():
+    tramos = _tramos((0, 100), (200, 300), (250, 400), (500, 600))
+    assert tramos.intervalos_entre(50, 260) == [((1, 0), 0, 100), ((2, 0), 200, 300), ((3, 0), 250, 400)]
+    assert tramos.intervalos_entre(120, 180) == []
+    assert tramos.intervalos_entre(400, 500) == [((3, 0), 250, 400), ((4, 0), 500, 600)]
+    assert tramos.intervalos_entre(700, 800) == []
+
+
+def test_intervalos_entre_coincide_con_fuerza_bruta(red_compilada):
+    _, vias = red_compilada
+    rnd = random.Random(8)
+    for tramos in vias.values():
+        for _ in range(20):
+            lo, hi = sorted(rnd.uniform(tramos.m_min - 100, tramos.m_max + 100) for _ in range(2))
+            esperado = [(c, a, b) for a, b, c in zip(tramos.m_ini, tramos.m_fin, tramos.claves)
+                        if b >= lo and a <= hi]
+            assert tramos.intervalos_entre(lo, hi) == esperado
+
+
+def test_huecos_y_solapes():
+    tramos = _tramos((0, 100), (100.0005, 200), (250, 400), (300, 350), (380, 500))
+    # 100 -> 100.0005 queda por debajo de la tolerancia
+    assert tramos.huecos() == [(200, 250)]
+    assert tramos.solapes() == [(300, 350), (380, 400)]
+    assert tramos.hueco_en(225) == (200, 250)
+    assert tramos.hueco_en(200) is None and tramos.hueco_en(250) is None
+    assert tramos.hueco_en(600) is None            # fuera de rango, no es un hueco
+    assert tramos.hueco_en(-5) is None
+
+
+def test_solapado_en_ignora_los_extremos_compartidos():
+    tramos = _tramos((0, 100), (100, 200), (150, 300))
+    assert not tramos.solapado_en(100)
+    assert not tramos.solapado_en(50)
+    assert tramos.solapado_en(175)
+    assert not tramos.solapado_en(200)
+
+
+def test_huecos_de_la_red_sintetica(red, red_compilada):
+    _, vias = red_compilada
+    # La red se genera con huecos entre features seguidas: la vía los detecta todos
+    for via, tramos in vias.items():
+        features = [f for f in red if f.via == via]
+        saltos = sum(1 for a, b in zip(features, features[1:])
+                     if b.partes[0][2][0] - a.partes[0][2][-1] > 1.0)
+        assert len(tramos.huecos()) == saltos
+        for lo, hi in tramos.huecos():
+            assert tramos.hueco_en((lo + hi) / 2) == (lo, hi)
+            assert tramos.buscar((lo + hi) / 2) == []
+
+
+def test_actualizar_tramos_equivale_a_reconstruir():
+    intervalos = [("A", 0, 100, 1, 0), ("A", 100, 200, 2, 0), ("B", 0, 50, 3, 0)]
+    por_via = tramos_por_via(intervalos)
+    # La feature 2 pasa a la vía B y se añade la 4 en A
+    actualizar_tramos(por_via, [("A", 2)], [("B", 50, 80, 2, 0), ("A", 300, 400, 4, 0)])
+    esperado = tramos_por_via([("A", 0, 100, 1, 0), ("A", 300, 400, 4, 0),
+                               ("B", 0, 50, 3, 0), ("B", 50, 80, 2, 0)])
+    assert set(por_via) == set(esperado)
+    for via in esperado:
+        assert list(por_via[via].m_ini) == list(esperado[via].m_ini)
+        assert list(por_via[via].m_fin) == list(esperado[via].m_fin)
+        assert por_via[via].claves == esperado[via].claves
+    # Al quitar su única feature, la vía desaparece
+    actualizar_tramos(por_via, [("B", 3), ("B", 2)], [])
+    assert set(por_via) == {"A"}
+
+
+@pytest.mark.parametrize("m", [0, 99.999, 100, 150])
+def test_buscar_en_un_solo_tramo(m):
+    tramos = _tramos((0, 150))
+    assert tramos.buscar(m) == [(1, 0)]
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Cachés del motor de PK Tools
+
+CacheDisco guarda, por cada capa de carreteras, las cajas de las features
+(para reconstruir el índice espacial sin leer geometrías), los intervalos M
+de cada vía y las rutas compiladas. Los ficheros viven en la carpeta del
+perfil de usuario de QGIS y se identifican por un hash de la fuente de la
+capa (la fuente puede llevar contraseñas y no se guarda tal cual); la clave
+guardada (hash de la fuente, número de features y fecha de modificación de
+los ficheros) decide si el fichero sigue siendo válido. Sólo las capas de
+ficheros tienen caché en disco: en una base de datos no hay una fecha de
+modificación fiable y una edición que no cambie el número de features
+dejaría una caché obsoleta.
+
+CacheRutas guarda en memoria, con un límite de tamaño, las rutas compiladas
+que se piden una a una mientras el índice no está listo, para que los clics
+repetidos sobre el mismo tramo no vuelvan a pedir la feature al proveedor.
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import hashlib
+import json
+import os
+import sqlite3
+from array import array
+from collections import OrderedDict
+
+from qgis.core import QgsApplication, QgsProviderRegistry
+
+# Versión del formato: cambiarla invalida todas las cachés existentes
+FORMATO = 2
+
+# Proveedores cuya fuente no identifica datos persistentes
+PROVEEDORES_SIN_CACHE = {"memory", "virtual"}
+
+# Memoria máxima (MB) de las rutas compiladas bajo demanda, compartida por todas las capas
+MEMORIA_RUTAS_MB = 64
+
+
+def carpeta_cache():
+    """Carpeta de cachés dentro del perfil de usuario de QGIS."""
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), "pk_tools", "cache")
+
+
+def clave_capa(layer, campo):
+    """
+    Clave que identifica el contenido de la capa: hash de la fuente, campo
+    de vía, número de features y fecha de modificación del fichero (y de su
+    -wal, donde SQLite/GeoPackage escribe las ediciones antes de volcarlas).
+    Devuelve None si la capa no admite caché en disco: proveedores en
+    memoria, capas en edición y fuentes que no son un fichero.
+    """
+    if layer.providerType() in PROVEEDORES_SIN_CACHE or layer.isModified():
+        return None
+    fuente = layer.source()
+    try:
+        ruta = QgsProviderRegistry.instance().decodeUri(layer.providerType(), fuente).get("path")
+    except Exception:
+        ruta = None
+    if not ruta or not os.path.isfile(ruta):
+        return None
+    mtimes = [os.path.getmtime(f) for f in (ruta, ruta + "-wal") if os.path.isfile(f)]
+    return {
+        "formato": FORMATO,
+        "fuente": hashlib.sha1(fuente.encode("utf-8")).hexdigest(),
+        "campo": campo,
+        "features": layer.featureCount(),
+        "mtime": mtimes,
+    }
+
+
+def _a_bytes(valores, tipo='d'):
+    return (valores if isinstance(valores, array) else array(tipo, valores)).tobytes()
+
+
+def _de_bytes(blob, tipo='d'):
+    valores = array(tipo)
+    valores.frombytes(blob)
+    return valores
+
+
+# ============================================================
+# FICHERO DE CACHÉ
+# ============================================================
+class CacheDisco:
+    """Fichero SQLite con el índice y las rutas compiladas de una capa."""
+
+    def __init__(self, clave):
+        self.clave = clave
+        nombre = hashlib.sha1(f"{clave['fuente']}|{clave['campo']}".encode("utf-8")).hexdigest()
+        self.path = os.path.join(carpeta_cache(), f"{nombre}.sqlite")
+
+    def _conectar(self, path=None):
+        return sqlite3.connect(path or self.path)
+
+    def es_valida(self):
+        """True si el fichero existe y su clave coincide con el estado actual de la capa."""
+        if not os.path.isfile(self.path):
+            return False
+        try:
+            con = self._conectar()
+            try:
+                row = con.execute("SELECT valor FROM meta WHERE clave = 'clave'").fetchone()
+            finally:
+                con.close()
+            return row is not None and json.loads(row[0]) == self.clave
+        except sqlite3.Error:
+            return False
+
+    # ---------- Escritura ----------
+    def guardar(self, rutas, cajas, intervalos):
+        """
+        Escribe la caché completa en un fichero temporal y lo sustituye de golpe.
+          rutas:      iterable de RutaCompilada
+          cajas:      dict fid -> (xmin, ymin, xmax, ymax)
+          intervalos: iterable de (via, m_min, m_max, fid, parte)
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        con = self._conectar(tmp)
+        try:
+            con.executescript("""
+                CREATE TABLE meta (clave TEXT PRIMARY KEY, valor TEXT);
+                CREATE TABLE rutas (
+                    fid INTEGER PRIMARY KEY, via,
+                    xmin REAL, ymin REAL, xmax REAL, ymax REAL,
+                    limites BLOB, xs BLOB, ys BLOB, ms BLOB, cum BLOB
+                );
+                CREATE TABLE tramos (via, m_min REAL, m_max REAL, fid INTEGER, parte INTEGER);
+            """)
+            con.executemany(
+                "INSERT INTO rutas VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((r.fid, r.via, *cajas[r.fid],
+                  _a_bytes(r.limites, 'l'), _a_bytes(r.xs), _a_bytes(r.ys),
+                  _a_bytes(r.ms), _a_bytes(r.cum))
+                 for r in rutas if r.fid in cajas)
+            )
+            con.executemany("INSERT INTO tramos VALUES (?, ?, ?, ?, ?)", intervalos)
+            con.execute("INSERT INTO meta VALUES ('clave', ?)", (json.dumps(self.clave),))
+            con.commit()
+        finally:
+            con.close()
+        os.replace(tmp, self.path)
+
+    # ---------- Lectura ----------
+    def cargar_cajas(self):
+        """Itera (fid, xmin, ymin, xmax, ymax) de todas las rutas."""
+        con = self._conectar()
+        try:
+            yield from con.execute("SELECT fid, xmin, ymin, xmax, ymax FROM rutas")
+        finally:
+            con.close()
+
+    def cargar_intervalos(self):
+        """Itera (via, m_min, m_max, fid, parte) de todos los tramos."""
+        con = self._conectar()
+        try:
+            yield from con.execute("SELECT via, m_min, m_max, fid, parte FROM tramos")
+        finally:
+            con.close()
+
+    def cargar_rutas(self):
+        """Itera (fid, via, limites, xs, ys, ms, cum) de todas las rutas, como arrays."""
+        con = self._conectar()
+        try:
+            for fid, via, limites, xs, ys, ms, cum in con.execute(
+                "SELECT fid, via, limites, xs, ys, ms, cum FROM rutas"
+            ):
+                yield (fid, via, _de_bytes(limites, 'l'), _de_bytes(xs), _de_bytes(ys),
+                       _de_bytes(ms), _de_bytes(cum))
+        finally:
+            con.close()
+
+
+# ============================================================
+# CACHÉ EN MEMORIA
+# ============================================================
+def tamano_ruta(ruta):
+    """Bytes aproximados que ocupa una RutaCompilada en memoria."""
+    arrays = (ruta.xs, ruta.ys, ruta.ms, ruta.cum, ruta.limites)
+    return 256 + sum(len(a) * a.itemsize for a in arrays) + 64 * len(ruta.corridas)
+
+
+class CacheRutas:
+    """
+    Caché LRU de rutas compiladas por (id de capa, fid), limitada por memoria.
+    Cuenta aciertos y fallos para poder comprobar su eficacia.
+    """
+
+    def __init__(self, memoria_mb=MEMORIA_RUTAS_MB):
+        self.limite = int(memoria_mb * 1024 * 1024)
+        self.ocupado = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self._rutas = OrderedDict()  # (id de capa, fid) -> (RutaCompilada, bytes)
+
+    def obtener(self, clave):
+        """RutaCompilada de `clave`, o None; la marca como usada recientemente."""
+        entrada = self._rutas.get(clave)
+        if entrada is None:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        self._rutas.move_to_end(clave)
+        return entrada[0]
+
+    def contiene(self, clave):
+        """True si `clave` está en la caché (sin contar acierto ni fallo)."""
+        return clave in self._rutas
+
+    def guardar(self, clave, ruta):
+        """Añade una ruta y expulsa las menos usadas hasta volver al límite de memoria."""
+        self.descartar(clave)
+        tamano = tamano_ruta(ruta)
+        if tamano > self.limite:
+            return
+        self._rutas[clave] = (ruta, tamano)
+        self.ocupado += tamano
+        while self.ocupado > self.limite:
+            _, (_, expulsada) = self._rutas.popitem(last=False)
+            self.ocupado -= expulsada
+
+    def descartar(self, clave):
+        entrada = self._rutas.pop(clave, None)
+        if entrada is not None:
+            self.ocupado -= entrada[1]
+
+    def descartar_capa(self, layer_id):
+        """Elimina todas las rutas de una capa (p. ej. al cambiar sus datos)."""
+        for clave in [c for c in self._rutas if c[0] == layer_id]:
+            self.descartar(clave)
+
+    def limpiar(self):
+        self._rutas.clear()
+        self.ocupado = 0
+
+    def estadisticas(self):
+        """Resumen de uso: rutas, memoria ocupada, aciertos, fallos y tasa de aciertos."""
+        consultas = self.aciertos + self.fallos
+        return {
+            "rutas": len(self._rutas),
+            "memoria_mb": self.ocupado / (1024 * 1024),
+            "limite_mb": self.limite / (1024 * 1024),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+        }
+
+
+_CACHE_RUTAS = None
+
+
+def cache_rutas():
+    """Caché de rutas en memoria compartida por todas las capas."""
+    global _CACHE_RUTAS
+    if _CACHE_RUTAS is None:
+        _CACHE_RUTAS = CacheRutas()
+    return _CACHE_RUTAS
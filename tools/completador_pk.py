@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Autocompletado de nombres de vía para Localizar PK
+
+El modelo no copia la lista de nombres: muestra el rango del IndiceNombres
+(nucleo/nombres.py) que corresponde a lo escrito, y al seguir escribiendo
+acota la búsqueda al rango anterior. La comparación ignora mayúsculas,
+tildes y signos de puntuación, de modo que "a6" propone "A-6".
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+from qgis.PyQt.QtCore import QAbstractListModel, QModelIndex, Qt
+from qgis.PyQt.QtWidgets import QCompleter, QLineEdit
+
+from ..nucleo.nombres import normalizar_nombre
+
+
+class ModeloNombresVias(QAbstractListModel):
+    """Modelo de lista con los nombres de un IndiceNombres que empiezan por un texto."""
+
+    def __init__(self, indice, parent=None):
+        super().__init__(parent)
+        self.indice = indice
+        self._prefijo = ""
+        self._rango = (0, len(indice))
+
+    def filtrar(self, texto):
+        """Muestra sólo los nombres que empiezan por `texto` (sin distinguir mayúsculas ni puntuación)."""
+        prefijo = normalizar_nombre(texto)
+        if prefijo == self._prefijo:
+            return
+        # Al añadir caracteres, el nuevo rango está dentro del anterior
+        dentro = self._rango if prefijo.startswith(self._prefijo) else None
+        self.beginResetModel()
+        self._prefijo = prefijo
+        self._rango = self.indice.rango(prefijo, dentro)
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._rango[1] - self._rango[0]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        return self.indice.nombres[self._rango[0] + index.row()]
+
+
+class CompletadorVias(QCompleter):
+    """
+    QCompleter sobre ModeloNombresVias. El filtrado lo hace el modelo en la
+    ranura de textEdited del QLineEdit padre; splitPath no toca el modelo
+    (QCompleter la llama mientras recorre sus filas) y devuelve un prefijo
+    vacío para que el QCompleter muestre todas las filas ya filtradas.
+    """
+
+    def __init__(self, indice, parent=None):
+        super().__init__(parent)
+        self.modelo = ModeloNombresVias(indice, self)
+        self.setModel(self.modelo)
+        self.setCaseSensitivity(Qt.CaseInsensitive)
+        self.setMaxVisibleItems(15)
+        if isinstance(parent, QLineEdit):
+            parent.textEdited.connect(self._texto_editado)
+
+    def _texto_editado(self, texto):
+        self.modelo.filtrar(texto)
+        # Si el filtro anterior no dejaba filas, el QCompleter había cerrado la lista
+        if texto and self.modelo.rowCount() and not self.popup().isVisible():
+            self.complete()
+
+    def splitPath(self, path):
+        return [""]
+
+    def pathFromIndex(self, index):
+        return self.modelo.data(index)
@@ -1,35 +1,26 @@
 # -*- coding: utf-8 -*-
+import math
+
 from qgis.PyQt.QtGui import QIcon, QColor
 from qgis.PyQt.QtWidgets import QAction, QInputDialog, QPushButton, QApplication
 from qgis.PyQt.QtCore import Qt
 from qgis.gui import QgsMapTool, QgsVertexMarker
 from qgis.core import (
     QgsPointXY,
-    QgsGeometry,
-    QgsCoordinateTransform,
     QgsProject,
-    QgsCoordinateReferenceSystem,
     QgsWkbTypes,
     QgsVectorLayer,
-    QgsSpatialIndex,
     Qgis
-)
+)
+
+from .motor_pk import formato_pk, motor_para_capa, pk_at_point, pk_distance, rect_busqueda
+from .transformaciones_pk import transformaciones
 
-##CONFIGURACION
-# Cambia "ID_ROAD" por el nombre de tu campo que identifique las vías,
+##CONFIGURACION
+# Cambia "ID_ROAD" por el nombre de tu campo que identifique las vías,
 # o cambia el campo que identifica las vías de tu capa de carreteras a ID_ROAD
 EXPECTED_FIELD = "ID_ROAD"
 
-def formato_pk(pk_total):
-    """Devuelve PK en formato K+MMM. Km con 2 dígitos mínimos, metros 3 dígitos."""
-    km = int(pk_total)
-    m = int(round((pk_total - km) * 1000))
-    # Ajuste por caso 999.5 m -> carry al km
-    if m == 1000:
-        km += 1
-        m = 0
-    return f"{km:02d}+{m:03d}"
-
 
 class DistanciaPK:
     def __init__(self, iface):
@@ -107,7 +98,13 @@ class DistanciaPK:
 
             # Asignar capa e índice sin cambiar la capa activa (no interrumpe edición)
             self.tool.layer = layer
-            self.tool.index = QgsSpatialIndex(layer.getFeatures())
+            # Índices desde la caché en disco o construidos en segundo plano (QgsTask)
+            self.tool.motor = motor_para_capa(layer, EXPECTED_FIELD)
+            if self.tool.motor.preparar_en_segundo_plano() is not None:
+                self.iface.messageBar().pushMessage(
+                    "Distancia PK", "Indexando la capa en segundo plano; hasta que termine las consultas serán algo más lentas.",
+                    level=Qgis.Info, duration=5
+                )
             self.tool.reset()  # Nueva sesión al activar
 
             self.canvas.setMapTool(self.tool)
@@ -118,7 +115,7 @@ class DistanciaPK:
             return False
 
     def show_distance_message(self, nombre_via, pk1, pk2, dist_pk_km, dist_lineal_km):
-        # Mostrar PKs SOLO en formato 00+000 para limpiar la barra
+        # PKs en formato km+000 (el mismo que el resto de herramientas)
         pk1_str = formato_pk(pk1)
         pk2_str = formato_pk(pk2)
 
@@ -164,7 +161,7 @@ class DistanciaTool(QgsMapTool):
         self.canvas = canvas
         self.callback = callback
         self.layer = None
-        self.index = None
+        self.motor = None   # MotorPK de la capa (índices y rutas compiladas)
         self.reset()
 
     def reset(self):
@@ -177,7 +174,7 @@ class DistanciaTool(QgsMapTool):
         self.markers = []
         self.pk_values = []
         self.line_distances = []
-        self.first_feat = None
+        self.first_res = None   # ResultadoPK del primer clic
         self.click_count = 0
 
     def canvasReleaseEvent(self, event):
@@ -193,74 +190,67 @@ class DistanciaTool(QgsMapTool):
 
     def _process_click(self, click_pt_map):
         try:
-            if not self.layer or not self.index:
+            if not self.layer or not self.motor:
                 self.iface.messageBar().pushWarning("Distancia PK", "No hay capa válida asignada.")
                 return
 
             map_crs = self.canvas.mapSettings().destinationCrs()
             layer_crs = self.layer.crs()
 
-            # clic en CRS de capa
-            layer_pt = click_pt_map
-            if map_crs != layer_crs:
-                xf_to_layer = QgsCoordinateTransform(map_crs, layer_crs, QgsProject.instance())
-                layer_pt = xf_to_layer.transform(click_pt_map)
+            # clic en CRS de capa (transformaciones reutilizadas entre clics)
+            xt = transformaciones()
+            xf_to_layer = xt.transformacion(map_crs, layer_crs)
+            layer_pt = xt.transformar(click_pt_map, map_crs, layer_crs)
+
+            x, y = layer_pt.x(), layer_pt.y()
 
             if self.click_count == 0:
                 # primer punto → localizar línea + proyección
-                fids = self.index.nearestNeighbor(layer_pt, 5)
-                closest_feat, proj_pt_layer = None, None
-                min_d = float('inf')
-                for fid in fids:
-                    feat = self.layer.getFeature(fid)
-                    near = feat.geometry().nearestPoint(QgsGeometry.fromPointXY(QgsPointXY(layer_pt)))
-                    d = layer_pt.distance(near.asPoint())
-                    if d < min_d:
-                        min_d = d
-                        closest_feat = feat
-                        proj_pt_layer = near
-
-                if not closest_feat:
+                # (si el índice aún se está construyendo, se consulta al proveedor)
+                rect = rect_busqueda(self.canvas, click_pt_map, xf_to_layer)
+                best = self.motor.mas_cercana(layer_pt, rect)
+
+                if best is None:
                     self.iface.messageBar().pushInfo("Distancia PK", "No se encontró línea cercana.")
                     return
 
-                self.first_feat = closest_feat
-                pk1, dist1 = self._compute_pk_and_dist(closest_feat.geometry(), proj_pt_layer)
+                self.first_res = best
 
                 # marcador en la PROYECCIÓN, transformado al CRS del mapa
-                proj1_map = proj_pt_layer.asPoint()
-                if map_crs != layer_crs:
-                    xf_to_map = QgsCoordinateTransform(layer_crs, map_crs, QgsProject.instance())
-                    proj1_map = xf_to_map.transform(proj1_map)
+                proj1_map = xt.transformar(QgsPointXY(best.x, best.y), layer_crs, map_crs)
                 self._add_marker(proj1_map)
 
-                self.pk_values.append(pk1)            # km
-                self.line_distances.append(dist1)     # unidades de la capa (m si CRS métrico)
+                self.pk_values.append(best.pk)            # km
+                self.line_distances.append(best.distancia)  # unidades de la capa (m si CRS métrico)
                 self.click_count = 1
 
             else:
-                # segundo punto → misma línea (self.first_feat)
-                geom = self.first_feat.geometry()
-                near_layer = geom.nearestPoint(QgsGeometry.fromPointXY(QgsPointXY(layer_pt)))
-                pk2, dist2 = self._compute_pk_and_dist(geom, near_layer)
+                # segundo punto → cualquier feature de la misma vía (cadena ordenada por M);
+                # sin vía o sin calibración, la ruta del primer clic
+                via = self.first_res.ruta.via
+                cadena = self.motor.cadena_via(via) if via else None
+                res2 = cadena.mas_cercano(x, y) if cadena is not None else None
+                if res2 is None or (res2.ruta.fid != self.first_res.ruta.fid
+                                    and (math.isnan(res2.pk) or math.isnan(self.first_res.pk))):
+                    cadena = None
+                    res2 = pk_at_point(self.first_res.ruta, x, y)
 
                 # marcador en la PROYECCIÓN del segundo punto
-                proj2_map = near_layer.asPoint()
-                if map_crs != layer_crs:
-                    xf_to_map = QgsCoordinateTransform(layer_crs, map_crs, QgsProject.instance())
-                    proj2_map = xf_to_map.transform(proj2_map)
+                proj2_map = xt.transformar(QgsPointXY(res2.x, res2.y), layer_crs, map_crs)
                 self._add_marker(proj2_map)
 
-                self.pk_values.append(pk2)
-                self.line_distances.append(dist2)
+                self.pk_values.append(res2.pk)
+                self.line_distances.append(res2.distancia)
                 self.click_count = 2
 
                 # resultados
-                dist_pk = abs(self.pk_values[1] - self.pk_values[0])                 # km
-                dist_lineal = abs(self.line_distances[1] - self.line_distances[0])   # unidades de capa
-                dist_lineal_km = dist_lineal / 1000.0                                # a km (si capa métrica)
+                if cadena is not None:
+                    dist_pk, dist_lineal = cadena.distancia(self.first_res, res2)  # km, unidades de capa
+                else:
+                    dist_pk, dist_lineal = pk_distance(self.first_res, res2)
+                dist_lineal_km = dist_lineal / 1000.0                       # a km (si capa métrica)
 
-                nombre_via = self.first_feat[EXPECTED_FIELD] or "Vía desconocida"
+                nombre_via = self.first_res.ruta.via or "Vía desconocida"
 
                 self.callback(nombre_via,
                               self.pk_values[0],
@@ -271,35 +261,6 @@ class DistanciaTool(QgsMapTool):
         except Exception as e:
             self.iface.messageBar().pushWarning("Distancia PK", f"Error al calcular: {e}")
 
-    def _compute_pk_and_dist(self, geom_line, proj_pt_layer):
-        # distancia acumulada a lo largo de la línea hasta la proyección (en unidades de capa)
-        dist_click = geom_line.lineLocatePoint(proj_pt_layer)
-
-        # vértices y longitudes acumuladas
-        verts = list(geom_line.vertices())
-        if len(verts) < 2:
-            return 0.0, 0.0
-
-        cum = [0.0]
-        for i in range(1, len(verts)):
-            seg = QgsGeometry.fromPolylineXY([QgsPointXY(verts[i-1]), QgsPointXY(verts[i])])
-            cum.append(cum[-1] + seg.length())
-
-        # interpolar M → PK (en km)
-        idx = next((i for i in range(len(cum)-1)
-                    if cum[i] <= dist_click <= cum[i+1]), len(cum)-2)
-        
-        # CONFIGURACION
-        # AJUSTAR METROS O KILÓMETROS
-        m1 = verts[idx].m() / 1000.0 # Dividir por 1 si la capa está calibrada en KM y por 1000 si es metros
-        m2 = verts[idx+1].m() / 1000.0 # Dividir por 1 si la capa está calibrada en KM y por 1000 si es metros
-        start = cum[idx]
-        seg_len = cum[idx+1] - start
-        t = (dist_click - start) / seg_len if seg_len > 0 else 0.0
-        pk_km = m1 + t * (m2 - m1)
-
-        return pk_km, dist_click  # pk en km, distancia lineal en unidades de la capa
-
     def _add_marker(self, map_pt):
         # Aro + punto verde en la PROYECCIÓN (CRS del mapa)
         ring = QgsVertexMarker(self.canvas)
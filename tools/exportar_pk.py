@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Exportación de puntos PK a disco
+
+Identificar PK y Localizar PK exportan sus puntos a una capa de un
+GeoPackage (u otro formato de OGR) en lugar de a una capa en memoria, de
+modo que no se pierden al cerrar el proyecto. Si la capa ya existe en el
+fichero y el formato lo permite, los puntos se añaden al final; un fichero
+existente sólo se sobrescribe si el usuario lo confirma. Los puntos llegan
+como un iterable y se transforman y escriben por bloques, así que una
+exportación grande no se reúne antes en memoria. En GeoPackage todos los
+bloques se escriben dentro de una QgsTransaction que se confirma al final
+(o se deshace si hay un error). Al terminar, la capa tiene índice espacial
+y un índice sobre VIA.
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import os
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.PyQt.QtWidgets import QFileDialog, QMessageBox
+from qgis.core import (
+    QgsFeature, QgsFeatureSource, QgsField, QgsFields, QgsGeometry, QgsPointXY, QgsProject,
+    QgsSettings, QgsTransaction, QgsVectorDataProvider, QgsVectorFileWriter, QgsVectorLayer,
+    QgsWkbTypes
+)
+
+from .motor_pk import formato_pk
+from .transformaciones_pk import CRS_WGS84, transformaciones
+
+# Features por llamada a addFeatures
+TAMANO_BLOQUE = 5000
+
+# Formatos ofrecidos en el diálogo de guardado (el primero es el predeterminado)
+FILTRO_FORMATOS = "GeoPackage (*.gpkg);;Shapefile (*.shp);;FlatGeobuf (*.fgb)"
+
+# Última ruta de exportación (se propone la misma para seguir añadiendo puntos)
+CLAVE_RUTA = "pk_tools/exportacion/ruta"
+
+
+class ErrorExportacion(Exception):
+    """No se pudo crear o abrir la capa de destino."""
+
+
+class ErrorSobrescritura(ErrorExportacion):
+    """El fichero existe y no se le pueden añadir los puntos: habría que sobrescribirlo."""
+
+
+def campos_puntos():
+    campos = QgsFields()
+    campos.append(QgsField("VIA", QVariant.String))
+    campos.append(QgsField("PK", QVariant.String))
+    return campos
+
+
+def pedir_destino(parent, titulo="Exportar puntos"):
+    """
+    Ruta elegida en un diálogo de guardado, o None. No avisa si el fichero
+    existe, porque normalmente se añade a él; exportar_a_fichero pide
+    confirmación si hubiera que sobrescribirlo.
+    """
+    ajustes = QgsSettings()
+    inicial = ajustes.value(CLAVE_RUTA, os.path.join(os.path.expanduser("~"), "pk_tools.gpkg"))
+    path, _ = QFileDialog.getSaveFileName(
+        parent, titulo, inicial, FILTRO_FORMATOS, options=QFileDialog.DontConfirmOverwrite
+    )
+    if not path:
+        return None
+    if not os.path.splitext(path)[1]:
+        path += ".gpkg"
+    ajustes.setValue(CLAVE_RUTA, path)
+    return path
+
+
+def _uri(path, capa, driver):
+    return f"{path}|layername={capa}" if driver == "GPKG" else path
+
+
+def _capa_destino(uri, capa):
+    """Capa existente a la que se pueden añadir features, o None."""
+    lyr = QgsVectorLayer(uri, capa, "ogr")
+    if lyr.isValid() and lyr.dataProvider().capabilities() & QgsVectorDataProvider.AddFeatures:
+        return lyr
+    return None
+
+
+def _crear_escritor(path, capa, driver, crs, sobre_fichero):
+    """QgsVectorFileWriter de una capa nueva (en un GeoPackage existente, como capa adicional)."""
+    opciones = QgsVectorFileWriter.SaveVectorOptions()
+    opciones.driverName = driver
+    opciones.fileEncoding = "UTF-8"
+    opciones.layerOptions = ["SPATIAL_INDEX=YES"]
+    if driver == "GPKG":
+        opciones.layerName = capa
+    opciones.actionOnExistingFile = (
+        QgsVectorFileWriter.CreateOrOverwriteLayer if sobre_fichero
+        else QgsVectorFileWriter.CreateOrOverwriteFile
+    )
+    escritor = QgsVectorFileWriter.create(
+        path, campos_puntos(), QgsWkbTypes.Point, crs,
+        QgsProject.instance().transformContext(), opciones
+    )
+    if escritor.hasError() != QgsVectorFileWriter.NoError:
+        raise ErrorExportacion(escritor.errorMessage())
+    return escritor
+
+
+def _escribir_bloques(puntos, crs, agregar, tam_bloque):
+    """
+    Transforma y escribe `puntos` por bloques con `agregar(features) -> bool`.
+    Devuelve el número de puntos escritos.
+    """
+    campos = campos_puntos()
+    xt = transformaciones()
+    total = 0
+
+    def _escribir(bloque):
+        xs, ys = xt.transformar_xy([p.lon for p in bloque], [p.lat for p in bloque], CRS_WGS84, crs)
+        feats = []
+        for p, x, y in zip(bloque, xs, ys):
+            f = QgsFeature(campos)
+            f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+            f.setAttributes([p.via, formato_pk(p.pk)])
+            feats.append(f)
+        if not agregar(feats):
+            raise ErrorExportacion("Error al escribir los puntos.")
+
+    bloque = []
+    for p in puntos:
+        bloque.append(p)
+        if len(bloque) >= tam_bloque:
+            _escribir(bloque)
+            total += len(bloque)
+            bloque = []
+    if bloque:
+        _escribir(bloque)
+        total += len(bloque)
+    return total
+
+
+def _agregar_a_capa(lyr, puntos, tam_bloque):
+    """
+    Añade los puntos a una capa existente por su proveedor. Si el formato
+    admite transacciones (GeoPackage), todos los bloques van en una sola.
+    """
+    prov = lyr.dataProvider()
+
+    def agregar(feats):
+        ok, _ = prov.addFeatures(feats)
+        return ok
+
+    if not QgsTransaction.supportsTransaction(lyr):
+        return _escribir_bloques(puntos, lyr.crs(), agregar, tam_bloque)
+
+    transaccion = QgsTransaction.create([lyr])
+    if transaccion is None:
+        return _escribir_bloques(puntos, lyr.crs(), agregar, tam_bloque)
+    ok, error = transaccion.begin()
+    if not ok:
+        raise ErrorExportacion(error)
+    try:
+        total = _escribir_bloques(puntos, lyr.crs(), agregar, tam_bloque)
+    except Exception:
+        transaccion.rollback()
+        raise
+    ok, error = transaccion.commit()
+    if not ok:
+        transaccion.rollback()
+        raise ErrorExportacion(error)
+    return total
+
+
+def exportar_puntos(path, capa, puntos, crs, sobrescribir=False, tam_bloque=TAMANO_BLOQUE):
+    """
+    Escribe `puntos` (iterable de objetos con via, pk en km, lon y lat en
+    WGS84, como EntradaHistorial) en la capa `capa` del fichero `path`.
+    Si la capa existe y admite añadir features, se añaden al final en su
+    CRS; si no, se crea en `crs`. En un GeoPackage existente la capa nueva
+    se añade al fichero; cualquier otro fichero existente sólo se
+    sobrescribe con `sobrescribir`, y si no se lanza ErrorSobrescritura
+    antes de leer ningún punto.
+    Devuelve (uri de la capa, número de puntos escritos).
+    """
+    driver = QgsVectorFileWriter.driverForExtension(os.path.splitext(path)[1]) or "GPKG"
+    uri = _uri(path, capa, driver)
+    existe = os.path.exists(path)
+
+    destino = _capa_destino(uri, capa) if existe else None
+    if destino is None and existe and not (driver == "GPKG" or sobrescribir):
+        raise ErrorSobrescritura(f"No se pueden añadir puntos a {os.path.basename(path)}.")
+
+    if destino is None:
+        escritor = _crear_escritor(path, capa, driver, crs, existe and driver == "GPKG")
+        if driver != "GPKG":
+            # Formatos sin transacciones: el propio escritor recibe los bloques
+            try:
+                total = _escribir_bloques(puntos, crs, escritor.addFeatures, tam_bloque)
+            finally:
+                del escritor
+            _crear_indices(uri, capa)
+            return uri, total
+        # GeoPackage: se crea la capa vacía y se rellena dentro de una transacción
+        del escritor
+        destino = _capa_destino(uri, capa)
+        if destino is None:
+            raise ErrorExportacion(f"No se pudo abrir la capa {capa} de {os.path.basename(path)}.")
+
+    total = _agregar_a_capa(destino, puntos, tam_bloque)
+    destino = None   # liberar el fichero antes de crear los índices
+    _crear_indices(uri, capa)
+    return uri, total
+
+
+def exportar_a_fichero(parent, path, capa, puntos, crs):
+    """
+    exportar_puntos pidiendo confirmación si hubiera que sobrescribir un
+    fichero existente. Devuelve (uri, número de puntos), o None si el usuario
+    no confirma. Lanza ErrorExportacion si la escritura falla.
+    """
+    try:
+        return exportar_puntos(path, capa, puntos, crs)
+    except ErrorSobrescritura as e:
+        respuesta = QMessageBox.question(
+            parent, "Exportar puntos",
+            f"{e}\n¿Sobrescribir el fichero? Se perderá su contenido actual.",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+        )
+        if respuesta != QMessageBox.Yes:
+            return None
+        return exportar_puntos(path, capa, puntos, crs, sobrescribir=True)
+
+
+def _crear_indices(uri, capa):
+    """Índice espacial (si falta) e índice sobre VIA en la capa escrita."""
+    lyr = QgsVectorLayer(uri, capa, "ogr")
+    if not lyr.isValid():
+        return
+    prov = lyr.dataProvider()
+    caps = prov.capabilities()
+    if (caps & QgsVectorDataProvider.CreateSpatialIndex
+            and prov.hasSpatialIndex() != QgsFeatureSource.SpatialIndexPresent):
+        prov.createSpatialIndex()
+    idx_via = lyr.fields().indexOf("VIA")
+    if caps & QgsVectorDataProvider.CreateAttributeIndex and idx_via >= 0:
+        prov.createAttributeIndex(idx_via)
+
+
+def cargar_en_proyecto(uri, nombre):
+    """Añade la capa exportada al proyecto, o la recarga si ya estaba cargada."""
+    prj = QgsProject.instance()
+    for lyr in prj.mapLayers().values():
+        if isinstance(lyr, QgsVectorLayer) and lyr.source() == uri:
+            lyr.reload()
+            lyr.updateExtents()
+            lyr.triggerRepaint()
+            return lyr
+    lyr = QgsVectorLayer(uri, nombre, "ogr")
+    if lyr.isValid():
+        prj.addMapLayer(lyr)
+    return lyr
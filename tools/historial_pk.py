@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Historial persistente de PK Tools
+
+Identificar PK y Localizar PK guardan cada consulta en un mismo fichero
+SQLite de la carpeta del perfil de QGIS, de modo que el historial se
+conserva entre sesiones. Los puntos se guardan en WGS84 para no depender
+del CRS del mapa. La tabla está indexada por fecha y por vía, y las
+consultas devuelven páginas (las más recientes primero), así que añadir
+una entrada o abrir un menú no se hace más lento con miles de consultas.
+
+ModeloHistorial y DialogoHistorial muestran el historial completo en una
+lista con búsqueda que pide las páginas a medida que se desplaza la vista.
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+from qgis.PyQt.QtCore import QAbstractListModel, QModelIndex, Qt
+from qgis.PyQt.QtWidgets import (
+    QDialog, QDialogButtonBox, QLineEdit, QListView, QVBoxLayout
+)
+from qgis.core import QgsApplication
+
+from .motor_pk import formato_pk
+
+# Entradas que se conservan como máximo; las más antiguas se borran al abrir el historial
+MAX_ENTRADAS = 50000
+
+# Herramienta que generó la entrada
+ORIGEN_IDENTIFICAR = "identificar"
+ORIGEN_LOCALIZAR = "localizar"
+
+# Entrada del historial: fecha en segundos desde epoch, pk en km, punto en WGS84
+EntradaHistorial = namedtuple("EntradaHistorial", "id fecha origen via pk lon lat")
+
+_COLUMNAS = "id, fecha, origen, via, pk, lon, lat"
+
+
+def ruta_historial():
+    """Fichero del historial dentro del perfil de usuario de QGIS."""
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), "pk_tools", "historial.sqlite")
+
+
+class HistorialPK:
+    """Historial de consultas de PK en SQLite, paginado por fecha."""
+
+    def __init__(self, path=None):
+        self.path = path or ruta_historial()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.con = sqlite3.connect(self.path)
+        self.con.executescript("""
+            CREATE TABLE IF NOT EXISTS historial (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fecha REAL NOT NULL,
+                origen TEXT NOT NULL,
+                via TEXT,
+                pk REAL,
+                lon REAL,
+                lat REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_historial_fecha ON historial (origen, fecha);
+            CREATE INDEX IF NOT EXISTS idx_historial_via ON historial (via, fecha);
+        """)
+        self._recortar()
+
+    def cerrar(self):
+        self.con.close()
+
+    def _recortar(self):
+        """Borra las entradas más antiguas por encima de MAX_ENTRADAS."""
+        with self.con:
+            self.con.execute(
+                "DELETE FROM historial WHERE id <= "
+                "(SELECT id FROM historial ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (MAX_ENTRADAS,)
+            )
+
+    # ---------- Escritura ----------
+    def agregar(self, origen, via, pk, lon, lat):
+        """Guarda una consulta y devuelve su EntradaHistorial."""
+        fecha = time.time()
+        with self.con:
+            cur = self.con.execute(
+                "INSERT INTO historial (fecha, origen, via, pk, lon, lat) VALUES (?, ?, ?, ?, ?, ?)",
+                (fecha, origen, via, pk, lon, lat)
+            )
+        return EntradaHistorial(cur.lastrowid, fecha, origen, via, pk, lon, lat)
+
+    def borrar(self, origen=None):
+        """Vacía el historial (sólo el de `origen`, si se indica)."""
+        with self.con:
+            if origen is None:
+                self.con.execute("DELETE FROM historial")
+            else:
+                self.con.execute("DELETE FROM historial WHERE origen = ?", (origen,))
+
+    # ---------- Lectura ----------
+    def _filtro(self, origen, via, texto=None):
+        condiciones, params = [], []
+        if origen is not None:
+            condiciones.append("origen = ?")
+            params.append(origen)
+        if via is not None:
+            condiciones.append("via = ?")
+            params.append(via)
+        if texto:
+            condiciones.append("via LIKE ? ESCAPE '\\'")
+            escapado = texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escapado}%")
+        return condiciones, params
+
+    def pagina(self, limite=50, antes=None, origen=None, via=None, texto=None):
+        """
+        Lista de hasta `limite` EntradaHistorial, de la más reciente a la más
+        antigua. Para la página siguiente se pasa como `antes` la última
+        entrada recibida (paginación por clave, sin OFFSET). `texto` filtra
+        las vías que lo contienen (sin distinguir mayúsculas).
+        """
+        condiciones, params = self._filtro(origen, via, texto)
+        if antes is not None:
+            condiciones.append("(fecha < ? OR (fecha = ? AND id < ?))")
+            params.extend((antes.fecha, antes.fecha, antes.id))
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        filas = self.con.execute(
+            f"SELECT {_COLUMNAS} FROM historial {where} ORDER BY fecha DESC, id DESC LIMIT ?",
+            (*params, limite)
+        )
+        return [EntradaHistorial(*fila) for fila in filas]
+
+    def recorrer(self, origen=None, tam_pagina=1000):
+        """Todas las entradas, de la más reciente a la más antigua, leídas página a página."""
+        antes = None
+        while True:
+            pagina = self.pagina(tam_pagina, antes, origen=origen)
+            yield from pagina
+            if len(pagina) < tam_pagina:
+                return
+            antes = pagina[-1]
+
+    def contar(self, origen=None, via=None):
+        condiciones, params = self._filtro(origen, via)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        return self.con.execute(f"SELECT COUNT(*) FROM historial {where}", params).fetchone()[0]
+
+
+_HISTORIAL = None
+
+
+def historial():
+    """Historial compartido por Identificar PK y Localizar PK."""
+    global _HISTORIAL
+    if _HISTORIAL is None:
+        _HISTORIAL = HistorialPK()
+    return _HISTORIAL
+
+
+# ============================================================
+# VISTA DEL HISTORIAL COMPLETO
+# ============================================================
+class ModeloHistorial(QAbstractListModel):
+    """
+    Modelo de lista sobre el historial persistente. No carga nada por
+    adelantado: la vista pide filas con canFetchMore / fetchMore al
+    desplazarse y el modelo las trae de HistorialPK página a página.
+    """
+
+    def __init__(self, origen=None, tam_pagina=100, parent=None):
+        super().__init__(parent)
+        self.origen = origen
+        self.tam_pagina = tam_pagina
+        self._texto = ""
+        self._entradas = []
+        self._completo = False
+
+    def filtrar(self, texto):
+        """Muestra sólo las entradas cuya vía contiene `texto`."""
+        texto = texto.strip()
+        if texto == self._texto:
+            return
+        self.beginResetModel()
+        self._texto = texto
+        self._entradas = []
+        self._completo = False
+        self.endResetModel()
+
+    def entrada(self, index):
+        """EntradaHistorial de una fila, o None."""
+        return self._entradas[index.row()] if index.isValid() else None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._completo
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._completo:
+            return
+        antes = self._entradas[-1] if self._entradas else None
+        pagina = historial().pagina(self.tam_pagina, antes, origen=self.origen, texto=self._texto)
+        self._completo = len(pagina) < self.tam_pagina
+        if pagina:
+            n = len(self._entradas)
+            self.beginInsertRows(QModelIndex(), n, n + len(pagina) - 1)
+            self._entradas.extend(pagina)
+            self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._entradas)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        e = self._entradas[index.row()]
+        if role == Qt.DisplayRole:
+            fecha = time.strftime("%d/%m/%Y %H:%M", time.localtime(e.fecha))
+            return f"{e.via} – {formato_pk(e.pk)}    ({fecha})"
+        if role == Qt.ToolTipRole:
+            return f"{e.lat:.6f},{e.lon:.6f}"
+        return None
+
+
+class DialogoHistorial(QDialog):
+    """Lista del historial completo con búsqueda por vía; devuelve la entrada elegida."""
+
+    def __init__(self, parent, origen=None, titulo="Historial"):
+        super().__init__(parent)
+        self.setWindowTitle(titulo)
+        self.resize(420, 480)
+        self.modelo = ModeloHistorial(origen, parent=self)
+
+        layout = QVBoxLayout(self)
+        self.le_buscar = QLineEdit()
+        self.le_buscar.setPlaceholderText("Buscar vía…")
+        self.le_buscar.setClearButtonEnabled(True)
+        self.le_buscar.textChanged.connect(self.modelo.filtrar)
+        layout.addWidget(self.le_buscar)
+
+        # Filas de altura fija: la vista sólo dibuja las visibles
+        self.vista = QListView()
+        self.vista.setUniformItemSizes(True)
+        self.vista.setModel(self.modelo)
+        self.vista.doubleClicked.connect(self.accept)
+        layout.addWidget(self.vista)
+
+        btns = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        btns.accepted.connect(self.accept)
+        btns.rejected.connect(self.reject)
+        layout.addWidget(btns)
+
+    def entrada_elegida(self):
+        """EntradaHistorial seleccionada, o None."""
+        return self.modelo.entrada(self.vista.currentIndex())
@@ -4,8 +4,10 @@ Plugin QGIS: Identificar PK
 
 Herramienta para identificar un PK (punto kilométrico) en capas lineales
 con geometría M. Muestra un mensaje con información, enlaces a Street View
-y botones de copia rápida. Además permite exportar puntos identificados
-a una capa temporal de puntos.
+y botones de copia rápida, y la vía y el PK bajo el cursor en la barra de
+estado mientras la herramienta está activa. Además permite exportar puntos identificados
+a una capa de puntos de un GeoPackage (ver exportar_pk.py); el historial se guarda entre
+sesiones (ver historial_pk.py).
 """
 
 # -------------------------------
@@ -15,27 +17,30 @@ from qgis.PyQt.QtGui import QIcon, QColor
 from qgis.PyQt.QtWidgets import (
     QAction, QInputDialog, QPushButton, QApplication,
     QMenu, QDialog, QVBoxLayout, QHBoxLayout, QListWidget, QListWidgetItem,
-    QDialogButtonBox, QLabel
+    QDialogButtonBox, QLabel, QCheckBox
 )
-from qgis.PyQt.QtCore import Qt, QMimeData, QPoint, QVariant
+from qgis.PyQt.QtCore import Qt, QMimeData, QPoint, QTimer
 from qgis.gui import QgsMapTool, QgsVertexMarker
 from qgis.core import (
-    QgsPointXY, QgsGeometry, QgsCoordinateTransform, QgsProject,
-    QgsCoordinateReferenceSystem, QgsWkbTypes, QgsVectorLayer,
-    QgsSpatialIndex, QgsField, QgsFeature, Qgis
+    QgsPointXY, QgsProject, QgsWkbTypes, QgsVectorLayer, Qgis
 )
 
-##CONFIGURACION
-# Cambia "ID_ROAD" por el nombre de tu campo que identifique las vías,
+from .exportar_pk import ErrorExportacion, cargar_en_proyecto, exportar_a_fichero, pedir_destino
+from .historial_pk import ORIGEN_IDENTIFICAR, historial
+from .motor_pk import formato_pk, motor_para_capa, rect_busqueda
+from .transformaciones_pk import transformaciones
+
+##CONFIGURACION
+# Cambia "ID_ROAD" por el nombre de tu campo que identifique las vías,
 # o cambia el campo que identifica las vías de tu capa de carreteras a ID_ROAD
 EXPECTED_FIELD = "ID_ROAD"
 
-
-def formato_pk(pk_total):
-    """Convierte un valor decimal de PK en formato km+000."""
-    km = int(pk_total)
-    m = int(round((pk_total - km) * 1000))
-    return f"{km}+{m:03d}"
+# Mostrar en la barra de estado la vía y el PK bajo el cursor mientras la herramienta está activa
+LECTURA_CONTINUA = True
+# Intervalo mínimo (ms) entre dos cálculos de la lectura continua
+HOVER_MS = 50
+# Intervalo mínimo (ms) mientras el índice se construye: cada lectura consulta al proveedor
+HOVER_INDEXANDO_MS = 250
 
 
 # ============================================================
@@ -127,7 +132,13 @@ class IdentificarPK:
                 self.tool = IdentificarPKTool(self.iface, self.canvas, self.show_pk_message)
 
             self.tool.layer = layer
-            self.tool.index = QgsSpatialIndex(layer.getFeatures())
+            # Índices desde la caché en disco o construidos en segundo plano (QgsTask)
+            self.tool.motor = motor_para_capa(layer, EXPECTED_FIELD)
+            if self.tool.motor.preparar_en_segundo_plano() is not None:
+                self.iface.messageBar().pushMessage(
+                    "Identificar PK", "Indexando la capa en segundo plano; hasta que termine las consultas serán algo más lentas.",
+                    level=Qgis.Info, duration=5
+                )
             self.canvas.setMapTool(self.tool)
             return True
 
@@ -216,12 +227,16 @@ class IdentificarPK:
 # DIALOGO DE EXPORTACION
 # ============================================================
 class ExportDialog(QDialog):
-    """Diálogo para seleccionar puntos recientes a exportar."""
+    """
+    Diálogo para seleccionar puntos del historial a exportar. Carga el
+    historial por páginas (las más recientes primero) con "Cargar más".
+    """
 
-    def __init__(self, parent, items_recent_first):
+    def __init__(self, parent, tam_pagina):
         super().__init__(parent)
         self.setWindowTitle("Exportar puntos del historial")
-        self.items = items_recent_first
+        self.tam_pagina = tam_pagina
+        self.items = []   # EntradaHistorial cargadas, de la más reciente a la más antigua
 
         layout = QVBoxLayout(self)
         layout.addWidget(QLabel("Selecciona los puntos a exportar:"))
@@ -229,30 +244,47 @@ class ExportDialog(QDialog):
         # Lista con checkboxes
         self.listw = QListWidget()
         self.listw.setSelectionMode(QListWidget.NoSelection)
-        for i, it in enumerate(self.items):
-            txt = f"{i+1:02d} — PK {it['pk_str']} — {it['via']}"
-            li = QListWidgetItem(txt)
-            li.setFlags(li.flags() | Qt.ItemIsUserCheckable)
-            li.setCheckState(Qt.Unchecked)
-            self.listw.addItem(li)
         layout.addWidget(self.listw)
 
-        # Botones de marcar/desmarcar todo
+        # Botones de marcar/desmarcar todo y de cargar la página siguiente
         btn_row = QHBoxLayout()
         btn_all = QPushButton("Marcar todo")
         btn_none = QPushButton("Desmarcar todo")
+        self.btn_more = QPushButton("Cargar más")
         btn_all.clicked.connect(lambda: self._set_all(Qt.Checked))
         btn_none.clicked.connect(lambda: self._set_all(Qt.Unchecked))
+        self.btn_more.clicked.connect(self.cargar_pagina)
         btn_row.addWidget(btn_all)
         btn_row.addWidget(btn_none)
+        btn_row.addWidget(self.btn_more)
         layout.addLayout(btn_row)
 
+        # Exportar todo el historial, no sólo lo marcado (se lee por páginas al escribir)
+        self.chk_todo = QCheckBox("Exportar todo el historial")
+        self.chk_todo.toggled.connect(lambda checked: self.listw.setEnabled(not checked))
+        layout.addWidget(self.chk_todo)
+
         # Botones OK / Cancelar
         btns = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         btns.accepted.connect(self.accept)
         btns.rejected.connect(self.reject)
         layout.addWidget(btns)
 
+        self.cargar_pagina()
+
+    def cargar_pagina(self):
+        """Añade a la lista la siguiente página del historial. Devuelve cuántas entradas añadió."""
+        antes = self.items[-1] if self.items else None
+        pagina = historial().pagina(self.tam_pagina, antes, origen=ORIGEN_IDENTIFICAR)
+        for i, it in enumerate(pagina, start=len(self.items)):
+            li = QListWidgetItem(f"{i+1:02d} — PK {formato_pk(it.pk)} — {it.via}")
+            li.setFlags(li.flags() | Qt.ItemIsUserCheckable)
+            li.setCheckState(Qt.Unchecked)
+            self.listw.addItem(li)
+        self.items.extend(pagina)
+        self.btn_more.setEnabled(len(pagina) == self.tam_pagina)
+        return len(pagina)
+
     def _set_all(self, state):
         """Marca o desmarca todos los ítems."""
         for i in range(self.listw.count()):
@@ -263,23 +295,36 @@ class ExportDialog(QDialog):
         return [i for i in range(self.listw.count())
                 if self.listw.item(i).checkState() == Qt.Checked]
 
+    def puntos(self):
+        """Iterable de EntradaHistorial a exportar (todo el historial o lo marcado)."""
+        if self.chk_todo.isChecked():
+            return historial().recorrer(ORIGEN_IDENTIFICAR)
+        return [self.items[i] for i in self.selected_indices()]
+
 
 # ============================================================
 # HERRAMIENTA DE MAPA
 # ============================================================
 class IdentificarPKTool(QgsMapTool):
     """Herramienta que captura clics en el mapa e identifica el PK más cercano."""
-    MAX_HISTORY = 30  # número máximo de puntos guardados en el historial
+    MAX_HISTORY = 30  # puntos por página en el diálogo de exportación
 
     def __init__(self, iface, canvas, callback):
         super().__init__(canvas)
         self.iface = iface
         self.canvas = canvas
         self.callback = callback
-        self.index = None
+        self.motor = None   # MotorPK de la capa (índices y rutas compiladas)
         self.layer = None
         self.markers = []
-        self.history = []
+
+        # Lectura continua del PK bajo el cursor
+        self._hover_pos = None
+        self._hover_label = None   # QLabel en la barra de estado
+        self._hover_timer = QTimer()
+        self._hover_timer.setSingleShot(True)
+        self._hover_timer.setInterval(HOVER_MS)
+        self._hover_timer.timeout.connect(self._actualizar_lectura)
 
     # ---------- Manejo de marcadores ----------
     def _add_marker(self, map_pt):
@@ -323,27 +368,78 @@ class IdentificarPKTool(QgsMapTool):
             punto = self.toMapCoordinates(event.pos())
             self.identify_point(punto)
 
+    def canvasMoveEvent(self, event):
+        if not LECTURA_CONTINUA:
+            return
+        # Sólo se guarda la última posición; el temporizador agrupa los movimientos
+        # y calcula el PK como mucho una vez cada HOVER_MS milisegundos
+        self._hover_pos = event.pos()
+        if not self._hover_timer.isActive():
+            listo = self.motor is None or self.motor.listo()
+            self._hover_timer.start(HOVER_MS if listo else HOVER_INDEXANDO_MS)
+
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Escape:
             self.canvas.unsetMapTool(self)
 
+    def deactivate(self):
+        self._hover_timer.stop()
+        self._ocultar_lectura()
+        super().deactivate()
+
+    # ---------- Lectura continua bajo el cursor ----------
+    def _actualizar_lectura(self):
+        """Calcula la vía y el PK en la última posición del cursor y los muestra en la barra de estado."""
+        if self._hover_pos is None or not self.layer or not self.motor:
+            return
+        # Sin índice en memoria la consulta va al proveedor, igual que el clic
+        # (canvasMoveEvent espacia entonces las lecturas HOVER_INDEXANDO_MS)
+        try:
+            best = self._pk_en_punto(self.toMapCoordinates(self._hover_pos))
+        except Exception:
+            best = None
+        if best is None:
+            self._mostrar_lectura("PK: —")
+        else:
+            self._mostrar_lectura(f"{best.ruta.via or 'Vía desconocida'} · PK {formato_pk(best.pk)}")
+
+    def _mostrar_lectura(self, texto):
+        if self._hover_label is None:
+            self._hover_label = QLabel()
+            self._hover_label.setToolTip("Vía y PK bajo el cursor (Identificar PK)")
+            self.iface.statusBarIface().addPermanentWidget(self._hover_label, 0)
+        self._hover_label.setText(texto)
+
+    def _ocultar_lectura(self):
+        if self._hover_label is not None:
+            self.iface.statusBarIface().removeWidget(self._hover_label)
+            self._hover_label.deleteLater()
+            self._hover_label = None
+
     # ---------- Lógica de identificación ----------
-    def _push_history(self, via, pk_value, map_pt):
-        """Guarda el resultado en el historial."""
-        item = {
-            'via': via,
-            'pk_value': pk_value,
-            'pk_str': formato_pk(pk_value),
-            'map_pt': QgsPointXY(map_pt)
-        }
-        self.history.append(item)
-        if len(self.history) > self.MAX_HISTORY:
-            self.history = self.history[-self.MAX_HISTORY:]
+    def _push_history(self, via, pk_value, lon, lat):
+        """Guarda el resultado en el historial persistente (punto en WGS84)."""
+        historial().agregar(ORIGEN_IDENTIFICAR, via, pk_value, lon, lat)
+
+    def _pk_en_punto(self, point):
+        """ResultadoPK de la línea más cercana a un punto del mapa, o None."""
+        map_crs = self.canvas.mapSettings().destinationCrs()
+        layer_crs = self.layer.crs()
+
+        # Transformar punto al CRS de la capa (transformaciones reutilizadas entre clics)
+        xt = transformaciones()
+        xf_to_layer = xt.transformacion(map_crs, layer_crs)
+        point_layer_crs = xt.transformar(point, map_crs, layer_crs)
+
+        # Buscar el segmento más cercano en la rejilla de segmentos de las rutas
+        # (si el índice aún se está construyendo, se consulta al proveedor)
+        rect = rect_busqueda(self.canvas, point, xf_to_layer)
+        return self.motor.mas_cercana(point_layer_crs, rect)
 
     def identify_point(self, point):
         """Identifica el PK en el clic dado."""
         try:
-            if not self.layer or not self.index:
+            if not self.layer or not self.motor:
                 self.iface.messageBar().pushMessage(
                     "Identificar PK", "No hay capa válida asignada.",
                     level=Qgis.Warning
@@ -351,89 +447,37 @@ class IdentificarPKTool(QgsMapTool):
                 return
 
             map_crs = self.canvas.mapSettings().destinationCrs()
-            layer = self.layer
-            layer_crs = layer.crs()
-
-            # Transformar punto al CRS de la capa
-            point_layer_crs = point
-            if layer_crs != map_crs:
-                xf_to_layer = QgsCoordinateTransform(map_crs, layer_crs, QgsProject.instance())
-                point_layer_crs = xf_to_layer.transform(point)
-
-            # Buscar la línea más cercana
-            nearest_ids = self.index.nearestNeighbor(point_layer_crs, 5)
-            closest_feat, closest_dist, proj_pt = None, float('inf'), None
-            for fid in nearest_ids:
-                feat = layer.getFeature(fid)
-                geom = feat.geometry()
-                near = geom.nearestPoint(QgsGeometry.fromPointXY(QgsPointXY(point_layer_crs)))
-                d = point_layer_crs.distance(near.asPoint())
-                if d < closest_dist:
-                    closest_dist = d
-                    closest_feat = feat
-                    proj_pt = near
-
-            if not closest_feat or proj_pt is None:
+            layer_crs = self.layer.crs()
+            xt = transformaciones()
+
+            best = self._pk_en_punto(point)
+            if best is None:
                 self.iface.messageBar().pushMessage(
                     "Identificar PK", "No se encontró línea cercana.",
                     level=Qgis.Info
                 )
                 return
 
-            # Calcular PK interpolado según valores M
-            geom_line = closest_feat.geometry()
-            dist_click = geom_line.lineLocatePoint(proj_pt)
-            verts = list(geom_line.vertices())
-            if len(verts) < 2:
-                self.iface.messageBar().pushMessage(
-                    "Identificar PK", "Geometría no válida.",
-                    level=Qgis.Warning
-                )
-                return
-
-            cum = [0.0]
-            for i in range(1, len(verts)):
-                p0, p1 = verts[i-1], verts[i]
-                cum.append(cum[-1] + QgsGeometry.fromPointXY(QgsPointXY(p0))
-                           .distance(QgsGeometry.fromPointXY(QgsPointXY(p1))))
-
-            idx = next((i for i in range(len(cum)-1)
-                        if cum[i] <= dist_click <= cum[i+1]), len(cum)-2)
-            
-            # CONFIGURACION
-            # AJUSTAR METROS O KILÓMETROS
-            m1 = verts[idx].m() / 1000.0     # Dividir por 1 si la capa está calibrada en KM y por 1000 si es metros
-            m2 = verts[idx+1].m() / 1000.0   # Dividir por 1 si la capa está calibrada en KM y por 1000 si es metros
-            start_seg = cum[idx]
-            seg_len = cum[idx+1] - start_seg
-            t = (dist_click - start_seg) / seg_len if seg_len > 0 else 0.0
-            pk_final = m1 + t * (m2 - m1)
+            # PK interpolado según valores M (ver motor_pk.M_POR_KM)
+            pk_final = best.pk
 
             # Actualizar marcador
             self.clear_markers()
-            proj_pt_map = proj_pt.asPoint()
-            if layer_crs != map_crs:
-                xf_to_map = QgsCoordinateTransform(layer_crs, map_crs, QgsProject.instance())
-                proj_pt_map = xf_to_map.transform(proj_pt_map)
+            proj_pt_map = xt.transformar(QgsPointXY(best.x, best.y), layer_crs, map_crs)
             self._add_marker(proj_pt_map)
 
             # Coordenadas WGS84 para Street View
-            to_wgs84 = QgsCoordinateTransform(
-                map_crs,
-                QgsCoordinateReferenceSystem("EPSG:4326"),
-                QgsProject.instance()
-            )
-            proj_pt_wgs = to_wgs84.transform(proj_pt_map)
+            proj_pt_wgs = xt.a_wgs84(proj_pt_map, map_crs)
             lat, lon = proj_pt_wgs.y(), proj_pt_wgs.x()
             url_sv = (
                 f"https://www.google.com/maps/@?api=1&map_action=pano"
                 f"&viewpoint={lat},{lon}&heading=0&pitch=10&fov=250"
             )
 
-            nombre_via = closest_feat[EXPECTED_FIELD] or "Vía desconocida"
+            nombre_via = best.ruta.via or "Vía desconocida"
 
             # Guardar en historial y mostrar mensaje
-            self._push_history(nombre_via, pk_final, proj_pt_map)
+            self._push_history(nombre_via, pk_final, lon, lat)
             self.callback(nombre_via, pk_final, url_sv, lat, lon)
 
         except Exception:
@@ -452,70 +496,39 @@ class IdentificarPKTool(QgsMapTool):
             self._export_points_dialog()
 
     def _export_points_dialog(self):
-        """Muestra el diálogo de exportación y guarda los puntos en una capa temporal."""
-        if not self.history:
+        """Muestra el diálogo de exportación y guarda los puntos en una capa de un fichero."""
+        dlg = ExportDialog(self.iface.mainWindow(), self.MAX_HISTORY)
+        if not dlg.items:
             self.iface.messageBar().pushMessage(
                 "Identificar PK", "No hay puntos recientes para exportar.",
                 level=Qgis.Info
             )
             return
 
-        base = self.history[-self.MAX_HISTORY:]
-        items_display = list(reversed(base))
-
-        dlg = ExportDialog(self.iface.mainWindow(), items_display)
         if dlg.exec_() == QDialog.Accepted:
-            idxs = dlg.selected_indices()
-            if not idxs:
+            if not dlg.chk_todo.isChecked() and not dlg.selected_indices():
                 self.iface.messageBar().pushMessage(
                     "Identificar PK", "No se seleccionaron puntos.",
                     level=Qgis.Info
                 )
                 return
-            sel_items = [items_display[i] for i in idxs]
-            lyr = self._ensure_output_layer()
-            if not lyr:
+            path = pedir_destino(self.iface.mainWindow())
+            if not path:
+                return
+
+            # Escritura por bloques en el fichero (se añade a la capa si ya existe), en el CRS del mapa
+            try:
+                resultado = exportar_a_fichero(
+                    self.iface.mainWindow(), path, "identificacion_pks", dlg.puntos(),
+                    self.canvas.mapSettings().destinationCrs()
+                )
+            except ErrorExportacion as e:
                 self.iface.messageBar().pushMessage(
-                    "Identificar PK", "No se pudo crear la capa de salida.",
+                    "Identificar PK", f"No se pudo crear la capa de salida: {e}",
                     level=Qgis.Warning
                 )
                 return
-
-            # Crear features y añadirlos
-            prov = lyr.dataProvider()
-            feats = []
-            for it in sel_items:
-                f = QgsFeature(lyr.fields())
-                f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(it['map_pt'])))
-                f['VIA'] = it['via']
-                f['PK'] = it['pk_str']
-                feats.append(f)
-
-            prov.addFeatures(feats)
-            lyr.updateExtents()
-            lyr.triggerRepaint()
-            lyr.dataProvider().forceReload()
-            # Mensaje de éxito eliminado: exportación silenciosa
-
-    def _ensure_output_layer(self):
-        """Crea o recupera la capa temporal de salida."""
-        name = "Identificacion PKs"
-        prj = QgsProject.instance()
-        for lyr in prj.mapLayers().values():
-            if (isinstance(lyr, QgsVectorLayer)
-                and lyr.name() == name
-                and lyr.geometryType() == QgsWkbTypes.PointGeometry):
-                if {f.name() for f in lyr.fields()} >= {"VIA", "PK"}:
-                    return lyr
-
-        map_crs = self.canvas.mapSettings().destinationCrs()
-        authid = map_crs.authid() or "EPSG:4326"
-        vl = QgsVectorLayer(f"Point?crs={authid}", name, "memory")
-        prov = vl.dataProvider()
-        prov.addAttributes([
-            QgsField("VIA", QVariant.String),
-            QgsField("PK", QVariant.String)
-        ])
-        vl.updateFields()
-        prj.addMapLayer(vl)
-        return vl
\ No newline at end of file
+            if resultado is None:
+                return
+            cargar_en_proyecto(resultado[0], "Identificacion PKs")
+            # Mensaje de éxito eliminado: exportación silenciosa
\ No newline at end of file
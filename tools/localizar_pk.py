@@ -2,34 +2,37 @@
 from qgis.PyQt.QtGui import QIcon, QColor
 from qgis.PyQt.QtWidgets import (
     QAction, QInputDialog, QDialog, QVBoxLayout, QHBoxLayout, QLabel,
-    QLineEdit, QCompleter, QPushButton, QMenu, QApplication,
-    QListWidget, QListWidgetItem, QDialogButtonBox
+    QLineEdit, QPushButton, QMenu, QApplication,
+    QListWidget, QListWidgetItem, QDialogButtonBox, QCheckBox
 )
-from PyQt5.QtCore import QMimeData, QVariant
+from PyQt5.QtCore import QMimeData
 from qgis.gui import QgsVertexMarker
 from qgis.core import (
-    QgsPointXY, QgsCoordinateTransform, QgsProject, QgsCoordinateReferenceSystem,
-    QgsWkbTypes, QgsVectorLayer, QgsFields, QgsField, QgsFeature, QgsGeometry,
-    Qgis
+    QgsPointXY, QgsProject, QgsWkbTypes, QgsVectorLayer, QgsFields, Qgis
 )
-
-##CONFIGURACION
-# Cambia "ID_ROAD" por el nombre de tu campo que identifique las vías,
+
+from .completador_pk import CompletadorVias
+from .exportar_pk import ErrorExportacion, cargar_en_proyecto, exportar_a_fichero, pedir_destino
+from .historial_pk import ORIGEN_LOCALIZAR, DialogoHistorial, historial
+from .motor_pk import M_POR_KM, formato_pk, motor_para_capa, point_at_pk
+from .transformaciones_pk import CRS_WGS84, transformaciones
+
+##CONFIGURACION
+# Cambia "ID_ROAD" por el nombre de tu campo que identifique las vías,
 # o cambia el campo que identifica las vías de tu capa de carreteras a ID_ROAD
 EXPECTED_FIELD = "ID_ROAD"
 
-def formato_pk(pk_total):
-    km = int(pk_total)
-    m = int(round((pk_total - km) * 1000))
-    return f"{km}+{m:03d}"
+# Entradas del historial que se muestran en el menú y por página en el diálogo de exportación
+HISTORIAL_MENU = 20
+HISTORIAL_PAGINA = 100
 
 class LocalizarPK:
     def __init__(self, iface):
         self.iface = iface
         self.canvas = iface.mapCanvas()
         self.action = None
-        self.history_menu = None
-        self.history = []   # [(via, pk_km, map_pt)]
+        self.history_menu = None   # últimas entradas del historial persistente (historial_pk.py)
+        self._menu_pendiente = True   # el menú se reconstruye al abrirse si hubo consultas nuevas
         self.markers = []   # [QgsVertexMarker, QgsVertexMarker]
 
     def create_action(self):
@@ -42,16 +45,11 @@ class LocalizarPK:
         self.action.setToolTip("Localizar punto según PK en vía calibrada")
 
         # Menú desplegable (historial, exportar, etc.)
-        self.history_menu = QMenu(self.iface.mainWindow())
-        self.history_menu.setTitle("Historial")
-        self.action.setMenu(self.history_menu)
+        self._crear_menu_historial()
 
         # Acción principal → abrir el diálogo
         self.action.triggered.connect(self.run)
 
-        # Inicializar menú
-        self._update_history_menu()
-
         return self.action
 
     def initGui(self):
@@ -60,15 +58,10 @@ class LocalizarPK:
         icon = QIcon(icon_path)
         self.action = QAction(icon, "Localizar PK", self.iface.mainWindow())
         self.action.setToolTip("Localizar punto según PK en vía calibrada")
-        self.history_menu = QMenu(self.iface.mainWindow())
-        self.history_menu.setTitle("Historial")
-        self.action.setMenu(self.history_menu)
+        self._crear_menu_historial()
         self.action.triggered.connect(self.open_dialog)
         self.iface.addToolBarIcon(self.action)
 
-        # Inicializar el menú en el orden solicitado
-        self._update_history_menu()
-
     def unload(self):
         self.iface.removeToolBarIcon(self.action)
 
@@ -98,11 +91,11 @@ class LocalizarPK:
 
         self.layer = layer
 
-        road_names = sorted({
-            f[EXPECTED_FIELD]
-            for f in layer.getFeatures()
-            if f[EXPECTED_FIELD]
-        })
+        # Índice de vías compartido: se construye una vez por capa, en segundo plano.
+        # El índice de nombres para autocompletar también se conserva entre aperturas.
+        motor = motor_para_capa(layer, EXPECTED_FIELD)
+        motor.preparar_en_segundo_plano()
+        nombres = motor.indice_nombres()
 
         dlg = QDialog(self.iface.mainWindow())
         dlg.setWindowTitle("Localizar PK")
@@ -112,8 +105,7 @@ class LocalizarPK:
         h1 = QHBoxLayout()
         h1.addWidget(QLabel("Carretera:"))
         self.le_road = QLineEdit()
-        completer = QCompleter(road_names)
-        self.le_road.setCompleter(completer)
+        self.le_road.setCompleter(CompletadorVias(nombres, self.le_road))
         h1.addWidget(self.le_road)
         vbox.addLayout(h1)
 
@@ -142,7 +134,9 @@ class LocalizarPK:
         if dlg.exec_() != QDialog.Accepted:
             return
 
+        # Lo escrito sin guion ni mayúsculas ("a6") se resuelve al nombre real ("A-6")
         via = self.le_road.text().strip()
+        via = nombres.resolver(via) or via
         try:
             km = float(self.le_km.text())
             m = int(self.le_m.text())
@@ -154,49 +148,53 @@ class LocalizarPK:
         self.locate(via, pk_total_km)
 
     def locate(self, via, pk_km):
-        # 1) Buscar la feature
-        field = EXPECTED_FIELD
-        feat = next((f for f in self.layer.getFeatures() if f[field] == via), None)
-        if not feat:
+        # 1) Buscar la vía en el índice (ID_ROAD -> intervalos M de sus features y partes)
+        motor = motor_para_capa(self.layer, EXPECTED_FIELD)
+        tramos = motor.tramos_via(via)
+        if not tramos:
             self.iface.messageBar().pushInfo("Localizar PK", f"No se encontró vía '{via}'.")
             return
 
-        # 2) Interpolar por M
-        geom = feat.geometry()
-        verts = list(geom.vertices())
-        m_vals = [pt.m() for pt in verts]
-        
-        # CONFIGURACION
-        # AJUSTAR METROS O KILÓMETROS
-        target_m = pk_km * 1000.0 # Multiplicar por 1000 si la capa está calibrada en m y por 1 si es KM
-        
-        if target_m < m_vals[0] or target_m > m_vals[-1]:
-            self.iface.messageBar().pushInfo("Localizar PK", f"PK {formato_pk(pk_km)} fuera de rango de la vía.")
+        # 2) Localizar por bisección el tramo que contiene el PK (unidades según motor_pk.M_POR_KM)
+        target_m = pk_km * M_POR_KM
+        candidatos = tramos.buscar(target_m)
+        if not candidatos:
+            hueco = tramos.hueco_en(target_m)
+            if hueco:
+                self.iface.messageBar().pushInfo(
+                    "Localizar PK",
+                    f"PK {formato_pk(pk_km)} en un hueco de calibración de la vía "
+                    f"({formato_pk(hueco[0] / M_POR_KM)} – {formato_pk(hueco[1] / M_POR_KM)})."
+                )
+            else:
+                self.iface.messageBar().pushInfo("Localizar PK", f"PK {formato_pk(pk_km)} fuera de rango de la vía.")
             return
+        if len(candidatos) > 1 and tramos.solapado_en(target_m):
+            self.iface.messageBar().pushWarning(
+                "Localizar PK",
+                f"Calibración solapada en {via}: el PK {formato_pk(pk_km)} aparece en "
+                f"{len(candidatos)} tramos. Se usa el primero."
+            )
 
-        idx = next(i for i in range(len(m_vals) - 1) if m_vals[i] <= target_m <= m_vals[i + 1])
-        m1, m2 = m_vals[idx], m_vals[idx + 1]
-        p0, p1 = verts[idx], verts[idx + 1]
-        t = (target_m - m1) / (m2 - m1) if m2 != m1 else 0
-        x = p0.x() + t * (p1.x() - p0.x())
-        y = p0.y() + t * (p1.y() - p0.y())
-        point_layer = QgsPointXY(x, y)
+        # 3) Interpolar por M sobre la parte de la ruta compilada
+        fid, parte = candidatos[0]
+        xy = point_at_pk(motor.ruta(fid), pk_km, parte)
+        if xy is None:
+            self.iface.messageBar().pushInfo("Localizar PK", f"PK {formato_pk(pk_km)} fuera de rango de la vía.")
+            return
+        point_layer = QgsPointXY(*xy)
 
-        # 3) Transformar al CRS del mapa
+        # 4) Transformar al CRS del mapa
         map_crs = self.canvas.mapSettings().destinationCrs()
-        layer_crs = self.layer.crs()
-        map_pt = point_layer
-        if layer_crs != map_crs:
-            xf = QgsCoordinateTransform(layer_crs, map_crs, QgsProject.instance())
-            map_pt = xf.transform(point_layer)
+        xt = transformaciones()
+        map_pt = xt.transformar(point_layer, self.layer.crs(), map_crs)
 
-        # 4) Dibujar marcador (limpiando anteriores)
+        # 5) Dibujar marcador (limpiando anteriores)
         self._limpiar_marcadores()
         self._add_marker(map_pt, QColor(0, 0, 255))
 
-        # 5) Preparar URL Street View y texto
-        crs_wgs84 = QgsCoordinateTransform(map_crs, QgsCoordinateReferenceSystem("EPSG:4326"), QgsProject.instance())
-        pt_wgs = crs_wgs84.transform(map_pt)
+        # 6) Preparar URL Street View y texto
+        pt_wgs = xt.a_wgs84(map_pt, map_crs)
         lat, lon = pt_wgs.y(), pt_wgs.x()
         url_sv = f"https://www.google.com/maps/@?api=1&map_action=pano&viewpoint={lat:.6f},{lon:.6f}&heading=0&pitch=10&fov=250"
 
@@ -228,9 +226,9 @@ class LocalizarPK:
 
         self.iface.messageBar().pushWidget(msg, level=Qgis.Info)
 
-        # 6) Historial
-        self.history.insert(0, (via, pk_km, map_pt))
-        self._update_history_menu()
+        # 7) Historial (persistente, en WGS84)
+        historial().agregar(ORIGEN_LOCALIZAR, via, pk_km, lon, lat)
+        self._menu_pendiente = True
 
     def _zoom_al_punto(self, punto):
         self.canvas.setCenter(punto)
@@ -261,41 +259,65 @@ class LocalizarPK:
 
         self.markers = [ring, dot]
 
+    def _crear_menu_historial(self):
+        """Menú desplegable del botón; sus acciones se crean al abrirlo (aboutToShow)."""
+        self.history_menu = QMenu(self.iface.mainWindow())
+        self.history_menu.setTitle("Historial")
+        self.history_menu.aboutToShow.connect(self._update_history_menu)
+        self.history_menu.triggered.connect(self._accion_historial)
+        self.action.setMenu(self.history_menu)
+        self._menu_pendiente = True
+
     def _update_history_menu(self):
+        # Sin consultas nuevas desde la última vez, el menú sigue valiendo
+        if not self._menu_pendiente:
+            return
+        self._menu_pendiente = False
+        # Las acciones pertenecen al menú: clear() las destruye
         self.history_menu.clear()
 
         # 1) Limpiar marcador
-        act_clear = QAction("Limpiar marcador", self.iface.mainWindow())
+        act_clear = self.history_menu.addAction("Limpiar marcador")
         act_clear.triggered.connect(self._limpiar_marcadores)
-        self.history_menu.addAction(act_clear)
 
         # 2) Exportar puntos
-        act_export = QAction("Exportar puntos", self.iface.mainWindow())
+        act_export = self.history_menu.addAction("Exportar puntos")
         act_export.triggered.connect(self._exportar_historial)
-        self.history_menu.addAction(act_export)
 
-        # 3) Separador
-        self.history_menu.addSeparator()
+        # 3) Historial completo con búsqueda
+        act_buscar = self.history_menu.addAction("Buscar en el historial…")
+        act_buscar.triggered.connect(self._buscar_historial)
 
-        # 4) Historial (más recientes primero)
-        for via, pk_km, map_pt in self.history:
-            texto = f"{via} – {formato_pk(pk_km)}"
-            act = QAction(texto, self.iface.mainWindow())
-            act.triggered.connect(lambda checked, v=via, p=pk_km, mp=map_pt: self._from_history(v, p, mp))
-            self.history_menu.addAction(act)
+        # 4) Separador
+        self.history_menu.addSeparator()
 
-    def _from_history(self, via, pk_km, map_pt):
+        # 5) Últimas entradas del historial (más recientes primero); la entrada
+        #    va en data() y un único slot del menú (_accion_historial) la recibe
+        for entrada in historial().pagina(HISTORIAL_MENU, origen=ORIGEN_LOCALIZAR):
+            act = self.history_menu.addAction(f"{entrada.via} – {formato_pk(entrada.pk)}")
+            act.setData(entrada)
+
+    def _accion_historial(self, action):
+        entrada = action.data()
+        if entrada is not None:
+            self._from_history(entrada)
+
+    def _buscar_historial(self):
+        dlg = DialogoHistorial(self.iface.mainWindow(), ORIGEN_LOCALIZAR, "Historial de Localizar PK")
+        if dlg.exec_() == QDialog.Accepted:
+            entrada = dlg.entrada_elegida()
+            if entrada is not None:
+                self._from_history(entrada)
+
+    def _from_history(self, entrada):
         # Redibuja el marcador y muestra el mensaje
+        via, pk_km, lat, lon = entrada.via, entrada.pk, entrada.lat, entrada.lon
+        map_pt = transformaciones().transformar(
+            QgsPointXY(lon, lat), CRS_WGS84, self.canvas.mapSettings().destinationCrs()
+        )
         self._limpiar_marcadores()
         self._add_marker(map_pt, QColor(0, 0, 255))
 
-        crs_wgs84 = QgsCoordinateTransform(
-            self.canvas.mapSettings().destinationCrs(),
-            QgsCoordinateReferenceSystem("EPSG:4326"),
-            QgsProject.instance()
-        )
-        pt_wgs = crs_wgs84.transform(map_pt)
-        lat, lon = pt_wgs.y(), pt_wgs.x()
         url_sv = f"https://www.google.com/maps/@?api=1&map_action=pano&viewpoint={lat:.6f},{lon:.6f}&heading=0&pitch=10&fov=250"
 
         message_text = (
@@ -326,10 +348,7 @@ class LocalizarPK:
         self.iface.messageBar().pushWidget(msg, level=Qgis.Info)
 
     def _exportar_historial(self):
-        if not self.history:
-            self.iface.messageBar().pushWarning("Exportar", "No hay puntos en el historial.")
-            return
-
+        entradas = []   # EntradaHistorial cargadas, más recientes primero
         dlg = QDialog(self.iface.mainWindow())
         dlg.setWindowTitle("Exportar puntos del historial")
         vbox = QVBoxLayout()
@@ -340,26 +359,42 @@ class LocalizarPK:
         list_widget = QListWidget()
         list_widget.setSelectionMode(QListWidget.MultiSelection)
 
-        # Desmarcados por defecto, más recientes primero (self.history ya lo está)
-        for i, (via, pk_km, _) in enumerate(self.history):
-            texto = f"{via} – {formato_pk(pk_km)} ({pk_km:.3f} km)"
-            item = QListWidgetItem(texto)
-            item.setSelected(False)
-            item.setData(1000, i)  # índice en self.history
-            list_widget.addItem(item)
-
         vbox.addWidget(list_widget)
 
-        # Botones: Marcar/Desmarcar todos
+        # Botones: Marcar/Desmarcar todos y Cargar más
         hbtn = QHBoxLayout()
         btn_sel_all = QPushButton("Marcar todos")
         btn_unsel_all = QPushButton("Desmarcar todos")
+        btn_mas = QPushButton("Cargar más")
         btn_sel_all.clicked.connect(lambda: [list_widget.item(i).setSelected(True) for i in range(list_widget.count())])
         btn_unsel_all.clicked.connect(lambda: [list_widget.item(i).setSelected(False) for i in range(list_widget.count())])
         hbtn.addWidget(btn_sel_all)
         hbtn.addWidget(btn_unsel_all)
+        hbtn.addWidget(btn_mas)
         vbox.addLayout(hbtn)
 
+        # El historial se carga por páginas, desmarcado y más recientes primero
+        def _cargar_pagina():
+            antes = entradas[-1] if entradas else None
+            pagina = historial().pagina(HISTORIAL_PAGINA, antes, origen=ORIGEN_LOCALIZAR)
+            for i, entrada in enumerate(pagina, start=len(entradas)):
+                item = QListWidgetItem(f"{entrada.via} – {formato_pk(entrada.pk)} ({entrada.pk:.3f} km)")
+                item.setSelected(False)
+                item.setData(1000, i)  # índice en entradas
+                list_widget.addItem(item)
+            entradas.extend(pagina)
+            btn_mas.setEnabled(len(pagina) == HISTORIAL_PAGINA)
+        btn_mas.clicked.connect(_cargar_pagina)
+        _cargar_pagina()
+        if not entradas:
+            self.iface.messageBar().pushWarning("Exportar", "No hay puntos en el historial.")
+            return
+
+        # Exportar todo el historial, no sólo lo marcado (se lee por páginas al escribir)
+        chk_todo = QCheckBox("Exportar todo el historial")
+        chk_todo.toggled.connect(lambda checked: list_widget.setEnabled(not checked))
+        vbox.addWidget(chk_todo)
+
         # Aceptar / Cancelar
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         buttons.accepted.connect(dlg.accept)
@@ -370,36 +405,27 @@ class LocalizarPK:
         if dlg.exec_() != QDialog.Accepted:
             return
 
-        seleccionados = [item.data(1000) for item in list_widget.selectedItems()]
-        if not seleccionados:
-            return
-
-        # Crear capa temporal (EPSG:4326)
-        vl = QgsVectorLayer("Point?crs=EPSG:4326", "Localización de PKs", "memory")
-        pr = vl.dataProvider()
-        pr.addAttributes([
-            QgsField("VIA", QVariant.String),
-            QgsField("PK", QVariant.String)
-        ])
-        vl.updateFields()
-
-        # Transformación a WGS84 desde CRS del mapa
-        xf = QgsCoordinateTransform(
-            self.canvas.mapSettings().destinationCrs(),
-            QgsCoordinateReferenceSystem("EPSG:4326"),
-            QgsProject.instance()
-        )
+        if chk_todo.isChecked():
+            puntos = historial().recorrer(ORIGEN_LOCALIZAR)
+        else:
+            seleccionados = [item.data(1000) for item in list_widget.selectedItems()]
+            if not seleccionados:
+                return
+            puntos = [entradas[idx] for idx in sorted(seleccionados)]
 
-        for idx in seleccionados:
-            via, pk_km, map_pt = self.history[idx]
-            pt = xf.transform(map_pt)
-            feat = QgsFeature()
-            feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(pt)))
-            feat.setAttributes([via, formato_pk(pk_km)])
-            pr.addFeature(feat)
+        path = pedir_destino(self.iface.mainWindow())
+        if not path:
+            return
 
-        vl.updateExtents()
-        QgsProject.instance().addMapLayer(vl)
+        # Escritura por bloques en el fichero (EPSG:4326; se añade a la capa si ya existe)
+        try:
+            resultado = exportar_a_fichero(self.iface.mainWindow(), path, "localizacion_pks", puntos, CRS_WGS84)
+        except ErrorExportacion as e:
+            self.iface.messageBar().pushWarning("Exportar", f"No se pudo crear la capa de salida: {e}")
+            return
+        if resultado is None:
+            return
+        cargar_en_proyecto(resultado[0], "Localización de PKs")
     def run(self):
         """Método de entrada para integrarlo en el plugin unificado."""
         self.open_dialog()
\ No newline at end of file
@@ -0,0 +1,604 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de referenciación lineal de PK Tools
+
+Une las rutas compiladas del núcleo (nucleo/rutas.py, sin dependencias de
+QGIS) con las capas de QGIS: las compila desde las geometrías, construye el
+índice espacial y los intervalos M por vía y los guarda en caché por capa.
+Identificar, Localizar y Distancia PK consultan estos arrays en lugar de
+recorrer los vértices de la geometría en cada clic.
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+from collections import namedtuple
+
+from qgis.core import (
+    QgsApplication, QgsExpression, QgsFeature, QgsFeatureRequest, QgsGeometry, QgsLineString,
+    QgsRectangle, QgsSpatialIndex, QgsTask, QgsVectorLayerFeatureSource
+)
+from qgis.PyQt.QtCore import QTimer
+
+from ..nucleo.rutas import (  # noqa: F401 (reexportados para herramientas y algoritmos)
+    M_POR_KM, TOLERANCIA_M, ResultadoPK, RutaCompilada, TramosVia, actualizar_tramos,
+    distancia_lineal_m, formato_pk, localizar_m, pk_at_point, pk_desde_valor,
+    pk_distance, point_at_pk, segmentacion_dinamica, tramos_por_via
+)
+from ..nucleo.cadenas import CadenaVia
+from ..nucleo.nombres import IndiceNombres
+from ..nucleo.rejilla import RejillaSegmentos, distancia2_caja
+from .cache_pk import CacheDisco, cache_rutas, clave_capa
+
+# Radio (en píxeles de pantalla) de la búsqueda de líneas alrededor de un clic:
+# más lejos de cualquier línea, el clic no identifica ninguna carretera
+RADIO_BUSQUEDA_PX = 12
+
+
+def rect_busqueda(canvas, punto_mapa, xf_a_capa=None, pixeles=RADIO_BUSQUEDA_PX):
+    """Rectángulo de `pixeles` de radio alrededor de un punto del mapa, en el CRS de la capa."""
+    r = canvas.mapUnitsPerPixel() * pixeles
+    rect = QgsRectangle(punto_mapa.x() - r, punto_mapa.y() - r,
+                        punto_mapa.x() + r, punto_mapa.y() + r)
+    return xf_a_capa.transformBoundingBox(rect) if xf_a_capa is not None else rect
+
+
+def radio_de_rect(rect):
+    """Radio de búsqueda (unidades de la capa) equivalente a un rect_busqueda."""
+    return max(rect.width(), rect.height()) / 2.0
+
+
+# ============================================================
+# PETICIONES AL PROVEEDOR
+# ============================================================
+# Con más vías que esto, el filtro IN deja de compensar frente a leer la capa entera
+MAX_VIAS_EN_FILTRO = 500
+
+
+def expresion_vias(campo, vias):
+    """Expresión que filtra las features cuyo `campo` está en `vias`."""
+    vias = list(vias)
+    if len(vias) == 1:
+        return QgsExpression.createFieldEqualityExpression(campo, vias[0])
+    if not vias:
+        return "FALSE"
+    valores = ", ".join(QgsExpression.quotedValue(v) for v in vias)
+    return f"{QgsExpression.quotedColumnRef(campo)} IN ({valores})"
+
+
+def peticion_rutas(campo, campos, vias=None, geometria=True):
+    """
+    QgsFeatureRequest que sólo lee el campo de vía (y la geometría si
+    `geometria`) y, si se indican `vias`, filtra por ID_ROAD en el proveedor,
+    que puede usar sus propios índices en lugar de recorrer la tabla.
+    """
+    req = QgsFeatureRequest().setSubsetOfAttributes([campo], campos)
+    if not geometria:
+        req.setFlags(QgsFeatureRequest.NoGeometry)
+    if vias is not None and len(vias) <= MAX_VIAS_EN_FILTRO:
+        req.setFilterExpression(expresion_vias(campo, vias))
+    return req
+
+
+# ============================================================
+# COMPILACIÓN DESDE QGIS
+# ============================================================
+def compilar_geometria(fid, via, geom):
+    """Compila una QgsGeometry lineal (simple o multiparte) en una RutaCompilada."""
+    partes = []
+    if geom is not None and not geom.isEmpty():
+        for parte in geom.constParts():
+            if not isinstance(parte, QgsLineString):
+                parte = parte.curveToLine()
+            xs = parte.xVector()
+            ys = parte.yVector()
+            ms = parte.mVector() if parte.isMeasure() else [float('nan')] * len(xs)
+            partes.append((xs, ys, ms))
+    return RutaCompilada(fid, via, partes)
+
+
+def compilar_feature(feat, campo):
+    """Compila una QgsFeature usando `campo` como identificador de vía."""
+    return compilar_geometria(feat.id(), feat[campo], feat.geometry())
+
+
+def compilar_rutas(features, campo, vias=None, feedback=None):
+    """
+    Compila las features (opcionalmente sólo las de las vías de `vias`) y
+    devuelve (dict fid -> RutaCompilada, dict ID_ROAD -> TramosVia).
+    Pensado para algoritmos por lotes, que no comparten el MotorPK de la capa.
+    """
+    rutas, intervalos = {}, []
+    for f in features:
+        if feedback is not None and feedback.isCanceled():
+            break
+        via = f[campo]
+        if not via or (vias is not None and via not in vias):
+            continue
+        ruta = compilar_feature(f, campo)
+        rutas[ruta.fid] = ruta
+        intervalos.extend((via, a, b, ruta.fid, parte) for parte, a, b in ruta.rangos_m())
+    return rutas, tramos_por_via(intervalos)
+
+
+# ============================================================
+# CONSTRUCCIÓN DE ÍNDICES
+# ============================================================
+# Resultado de cargar o construir los índices de una capa:
+#   indice    -> QgsSpatialIndex sobre las cajas de las features
+#   vias      -> dict ID_ROAD -> TramosVia
+#   rutas     -> dict fid -> RutaCompilada
+#   segmentos -> RejillaSegmentos sobre los segmentos de todas las rutas
+DatosIndice = namedtuple("DatosIndice", "indice vias rutas segmentos")
+
+
+def cargar_indices(disco, cancelado=None):
+    """
+    Reconstruye los índices a partir de la caché en disco, sin leer la capa.
+    Las rutas se leen todas: la rejilla de segmentos las necesita.
+    """
+    indice = QgsSpatialIndex()
+    for fid, xmin, ymin, xmax, ymax in disco.cargar_cajas():
+        indice.addFeature(fid, QgsRectangle(xmin, ymin, xmax, ymax))
+    rutas = {}
+    for n, (fid, *arrays) in enumerate(disco.cargar_rutas()):
+        if cancelado and n % 500 == 0 and cancelado():
+            return None
+        rutas[fid] = RutaCompilada.desde_arrays(fid, *arrays)
+    vias = tramos_por_via(disco.cargar_intervalos())
+    return DatosIndice(indice, vias, rutas, RejillaSegmentos(rutas.values()))
+
+
+def construir_indices(features, campo, disco=None, total=0, progreso=None, cancelado=None):
+    """
+    Compila todas las features en una pasada, construye los índices y, si se
+    indica `disco`, guarda la caché. `progreso(porcentaje)` y `cancelado()`
+    permiten usarla desde una QgsTask. Devuelve None si se cancela.
+    """
+    indice = QgsSpatialIndex()
+    rutas, cajas, intervalos = {}, {}, []
+    for n, f in enumerate(features):
+        if cancelado and n % 500 == 0:
+            if cancelado():
+                return None
+            if progreso and total:
+                progreso(100.0 * n / total)
+        ruta = compilar_feature(f, campo)
+        rutas[ruta.fid] = ruta
+        caja = ruta.caja()
+        if caja is None:
+            continue
+        cajas[ruta.fid] = caja
+        indice.addFeature(ruta.fid, QgsRectangle(*caja))
+        if ruta.via:
+            intervalos.extend((ruta.via, a, b, ruta.fid, parte) for parte, a, b in ruta.rangos_m())
+    if disco is not None:
+        try:
+            disco.guardar(rutas.values(), cajas, intervalos)
+        except Exception:
+            pass  # sin caché en disco se sigue funcionando en memoria
+    if cancelado and cancelado():
+        return None
+    return DatosIndice(indice, tramos_por_via(intervalos), rutas, RejillaSegmentos(rutas.values()))
+
+
+def _datos_desde_disco_o_capa(fuente, campos, campo, disco, **kwargs):
+    """
+    Carga los índices de la caché si es válida; si no, los construye leyendo
+    `fuente` (una capa o una QgsVectorLayerFeatureSource con campos `campos`).
+    """
+    if disco and disco.es_valida():
+        try:
+            return cargar_indices(disco, kwargs.get("cancelado"))
+        except Exception:
+            pass  # caché corrupta: se reconstruye
+    return construir_indices(fuente.getFeatures(peticion_rutas(campo, campos)), campo, disco, **kwargs)
+
+
+class TareaIndicePK(QgsTask):
+    """Carga o construye en segundo plano los índices de un MotorPK."""
+
+    def __init__(self, motor):
+        super().__init__(f"PK Tools: indexando {motor.layer.name()}", QgsTask.CanCancel)
+        self.motor = motor
+        self.generacion = motor._generacion
+        self.total = motor.layer.featureCount()
+        # La fuente se crea en el hilo principal; el hilo de la tarea sólo lee de ella
+        self.fuente = QgsVectorLayerFeatureSource(motor.layer)
+        self.campos = motor.layer.fields()
+        clave = clave_capa(motor.layer, motor.campo)
+        self.disco = CacheDisco(clave) if clave else None
+        self.datos = None
+
+    def run(self):
+        try:
+            self.datos = _datos_desde_disco_o_capa(
+                self.fuente, self.campos, self.motor.campo, self.disco, total=self.total,
+                progreso=self.setProgress, cancelado=self.isCanceled
+            )
+            return self.datos is not None
+        except Exception:
+            return False
+
+    def finished(self, result):
+        if self.motor._tarea is self:
+            self.motor._tarea = None
+        # Si la capa ha cambiado mientras se indexaba, el resultado ya no sirve
+        if result and self.datos is not None and self.generacion == self.motor._generacion:
+            self.motor._instalar(self.datos)
+
+
+class TareaGuardarPK(QgsTask):
+    """Reescribe en segundo plano la caché en disco de un MotorPK tras guardar la edición de la capa."""
+
+    def __init__(self, motor, disco):
+        super().__init__(f"PK Tools: guardando caché de {motor.layer.name()}", QgsTask.CanCancel)
+        self.disco = disco
+        # Las rutas se sustituyen (no se modifican) al editar: basta con una copia de la lista
+        self.rutas = list(motor._rutas.values())
+
+    def run(self):
+        cajas, intervalos = {}, []
+        for ruta in self.rutas:
+            caja = ruta.caja()
+            if caja is None:
+                continue
+            cajas[ruta.fid] = caja
+            if ruta.via:
+                intervalos.extend((ruta.via, a, b, ruta.fid, parte) for parte, a, b in ruta.rangos_m())
+        if self.isCanceled():
+            return False
+        try:
+            self.disco.guardar(self.rutas, cajas, intervalos)
+            return True
+        except Exception:
+            return False
+
+
+# ============================================================
+# CACHÉ POR CAPA
+# ============================================================
+class MotorPK:
+    """
+    Índices y rutas compiladas de una capa, compartidos por las tres herramientas.
+
+    El índice espacial y el índice de vías se cargan de la caché en disco si
+    sigue siendo válida; si no, se construyen en una sola pasada por la capa
+    y se guardan para la próxima activación o sesión de QGIS. Las
+    herramientas lanzan esa preparación en segundo plano y, mientras tanto,
+    responden consultando directamente al proveedor de datos.
+
+    Las ediciones de la capa (features añadidas o borradas, geometrías y
+    valores de ID_ROAD cambiados) se aplican sólo a las entradas afectadas de
+    los índices, agrupadas por vuelta del bucle de eventos, sin reconstruirlos.
+    """
+
+    def __init__(self, layer, campo):
+        self.layer = layer
+        self.campo = campo
+        self._rutas = {}      # fid -> RutaCompilada de todas las features, con el índice listo
+        self._vias = None     # ID_ROAD -> TramosVia
+        self._indice = None   # QgsSpatialIndex sobre las cajas de las features
+        self._segmentos = None  # RejillaSegmentos sobre los segmentos de las rutas
+        self._tarea = None    # TareaIndicePK en curso
+        self._generacion = 0  # se incrementa al invalidar
+        self._cambios = set()     # fids editados pendientes de aplicar
+        self._pendientes = set()  # fids editados mientras se construye el índice
+        self._editados = set()    # fids tocados en la sesión de edición, para deshacerla
+        self._tarea_guardar = None  # TareaGuardarPK en curso
+        self._nombres = None      # IndiceNombres de las vías, para el autocompletado
+        self._cadenas = {}        # ID_ROAD -> CadenaVia, creadas al medir sobre la vía
+
+    # ---------- Rutas ----------
+    def ruta(self, fid, feat=None):
+        """
+        Devuelve la ruta compilada de `fid`: del índice si está listo y, si
+        no, de la caché LRU en memoria o de la capa, por ese orden.
+        """
+        ruta = self._rutas.get(fid)
+        if ruta is not None:
+            return ruta
+        cache = cache_rutas()
+        clave = (self.layer.id(), fid)
+        ruta = cache.obtener(clave)
+        if ruta is None:
+            if feat is None:
+                req = self._peticion().setFilterFid(fid)
+                feat = next(self.layer.getFeatures(req), None)
+            ruta = compilar_feature(feat, self.campo) if feat is not None else RutaCompilada(fid, None, [])
+            cache.guardar(clave, ruta)
+        return ruta
+
+    def _peticion(self, vias=None, geometria=True):
+        """Petición a la capa con sólo el campo de vía (ver peticion_rutas)."""
+        return peticion_rutas(self.campo, self.layer.fields(), vias, geometria)
+
+    def _rutas_de(self, req):
+        """
+        Rutas de las features que devuelve `req`. Primero se piden sólo los
+        fids (sin geometría ni atributos) y después las geometrías de las que
+        no están ya en memoria.
+        """
+        req.setFlags(QgsFeatureRequest.NoGeometry).setNoAttributes()
+        fids = [f.id() for f in self.layer.getFeatures(req)]
+        cache = cache_rutas()
+        layer_id = self.layer.id()
+        faltan = [fid for fid in fids if fid not in self._rutas and not cache.contiene((layer_id, fid))]
+        if faltan:
+            for f in self.layer.getFeatures(self._peticion().setFilterFids(faltan)):
+                cache.guardar((layer_id, f.id()), compilar_feature(f, self.campo))
+        return [self.ruta(fid) for fid in fids]
+
+    # ---------- Consultas con respaldo ----------
+    def candidatos(self, rect):
+        """
+        Rutas de las features cuya caja corta `rect` (CRS de la capa): del
+        índice espacial si está listo o pidiéndolas al proveedor si no.
+        """
+        if self.listo():
+            return [self.ruta(fid) for fid in self._indice.intersects(rect)]
+        return self._rutas_de(QgsFeatureRequest().setFilterRect(rect))
+
+    def mas_cercana(self, punto, rect):
+        """
+        ResultadoPK de la ruta más cercana a `punto` (CRS de la capa) dentro
+        del radio de búsqueda `rect` (ver rect_busqueda), o None.
+        Con el índice listo sólo se miden los segmentos de las celdas próximas
+        al punto, y un clic lejos de toda línea se descarta sin leer ninguna
+        geometría. Mientras se construye, se proyecta sobre las features que
+        devuelve el proveedor dentro de `rect`, de la caja más cercana a la
+        más lejana, hasta que ninguna caja restante puede mejorar el resultado.
+        """
+        x, y = punto.x(), punto.y()
+        radio = radio_de_rect(rect)
+        if self.listo():
+            return self._segmentos.mas_cercano(x, y, self.ruta, radio)
+        cercanas = sorted(
+            ((distancia2_caja(ruta.caja(), x, y), ruta) for ruta in self.candidatos(rect) if ruta.es_valida()),
+            key=lambda par: par[0]
+        )
+        best = None
+        limite2 = radio * radio
+        for d2, ruta in cercanas:
+            if d2 > limite2:
+                break
+            res = pk_at_point(ruta, x, y)
+            if res and res.separacion <= radio and (best is None or res.separacion < best.separacion):
+                best = res
+                limite2 = res.separacion * res.separacion
+        return best
+
+    def tramos_via(self, via):
+        """TramosVia de `via`, del índice si está listo o filtrando la capa por ID_ROAD si no."""
+        if self.listo():
+            return self._vias.get(via)
+        intervalos = [
+            (a, b, ruta.fid, parte)
+            for ruta in self._rutas_de(self._peticion([via], geometria=False))
+            for parte, a, b in ruta.rangos_m()
+        ]
+        return TramosVia(via, intervalos) if intervalos else None
+
+    def cadena_via(self, via):
+        """
+        CadenaVia de `via` (sus features ordenadas por M), o None si la vía no
+        tiene calibración. Con el índice listo se guarda para los clics siguientes.
+        """
+        cadena = self._cadenas.get(via)
+        if cadena is None:
+            tramos = self.tramos_via(via)
+            if tramos is None:
+                return None
+            cadena = CadenaVia(tramos, self.ruta)
+            if self.listo():
+                self._cadenas[via] = cadena
+        return cadena
+
+    def nombres_vias(self):
+        """Lista ordenada de identificadores de vía de la capa."""
+        if self.listo():
+            return sorted(self._vias)
+        idx = self.layer.fields().indexOf(self.campo)
+        return sorted(v for v in self.layer.uniqueValues(idx) if v)
+
+    def indice_nombres(self):
+        """
+        IndiceNombres de las vías de la capa, construido una sola vez y
+        reutilizado en cada apertura de Localizar PK (se rehace si la edición
+        de la capa añade o quita vías).
+        """
+        if self._nombres is None:
+            self._nombres = IndiceNombres(self.nombres_vias())
+        return self._nombres
+
+    # ---------- Índices ----------
+    def listo(self):
+        """True si el índice espacial y el de vías están disponibles."""
+        return self._indice is not None
+
+    def indice_espacial(self):
+        """QgsSpatialIndex de la capa (lo prepara de forma síncrona si hace falta)."""
+        self.preparar()
+        return self._indice
+
+    def indice_vias(self):
+        """Índice ID_ROAD -> TramosVia (lo prepara de forma síncrona si hace falta)."""
+        self.preparar()
+        return self._vias
+
+    def preparar(self):
+        """Carga o construye los índices en el hilo actual si aún no existen."""
+        if self.listo():
+            return
+        clave = clave_capa(self.layer, self.campo)
+        disco = CacheDisco(clave) if clave else None
+        self._instalar(_datos_desde_disco_o_capa(self.layer, self.layer.fields(), self.campo, disco))
+
+    def preparar_en_segundo_plano(self):
+        """
+        Lanza (si no está ya en marcha) una QgsTask cancelable que carga o
+        construye los índices. Devuelve la tarea, o None si ya están listos.
+        """
+        if self.listo():
+            return None
+        if self._tarea is None:
+            self._tarea = TareaIndicePK(self)
+            QgsApplication.taskManager().addTask(self._tarea)
+        return self._tarea
+
+    def _instalar(self, datos):
+        """Adopta unos índices recién cargados o construidos."""
+        self._rutas = datos.rutas
+        cache_rutas().descartar_capa(self.layer.id())  # ya están todas en el índice
+        self._vias = datos.vias
+        self._segmentos = datos.segmentos
+        self._indice = datos.indice
+        # Ediciones hechas mientras se construía el índice
+        if self._pendientes:
+            pendientes, self._pendientes = self._pendientes, set()
+            self._aplicar(pendientes)
+
+    def invalidar(self):
+        """Descarta rutas e índices (la capa ha cambiado); se reconstruyen al volver a pedirlos."""
+        self._generacion += 1
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+        self._rutas = {}
+        cache_rutas().descartar_capa(self.layer.id())
+        self._vias = None
+        self._indice = None
+        self._segmentos = None
+        self._cambios.clear()
+        self._pendientes.clear()
+        self._editados.clear()
+        self._nombres = None
+        self._cadenas.clear()
+
+    # ---------- Edición de la capa ----------
+    def conectar_capa(self):
+        """Conecta las señales de edición de la capa con la actualización incremental."""
+        layer = self.layer
+        layer.featureAdded.connect(self._marcar)
+        layer.featureDeleted.connect(self._marcar)
+        layer.geometryChanged.connect(lambda fid, _geom: self._marcar(fid))
+        layer.attributeValueChanged.connect(self._atributo_cambiado)
+        layer.committedFeaturesAdded.connect(self._features_confirmadas)
+        layer.afterCommitChanges.connect(self._edicion_guardada)
+        layer.afterRollBack.connect(self._edicion_descartada)
+        # Cambios que no se pueden aplicar por features: reconstrucción completa
+        layer.dataSourceChanged.connect(self.invalidar)
+        layer.subsetStringChanged.connect(self.invalidar)
+
+    def _atributo_cambiado(self, fid, idx, _valor):
+        if self.layer.fields().at(idx).name() == self.campo:
+            self._marcar(fid)
+
+    def _features_confirmadas(self, _layer_id, features):
+        # Al guardar, el proveedor puede asignar fids definitivos a las features nuevas
+        for f in features:
+            self._marcar(f.id())
+
+    def _marcar(self, fid):
+        """Apunta un fid editado; los cambios se aplican juntos al volver al bucle de eventos."""
+        if not self._cambios:
+            QTimer.singleShot(0, self._aplicar_cambios)
+        self._cambios.add(fid)
+        self._editados.add(fid)
+
+    def _aplicar_cambios(self):
+        fids, self._cambios = self._cambios, set()
+        if fids:
+            self._aplicar(fids)
+
+    def _aplicar(self, fids):
+        """Actualiza las rutas, el índice espacial, la rejilla y el índice de vías de `fids`."""
+        cache = cache_rutas()
+        layer_id = self.layer.id()
+        for fid in fids:
+            cache.descartar((layer_id, fid))
+        if not self.listo():
+            if self._tarea is not None:
+                self._pendientes.update(fids)
+            return
+
+        req = self._peticion().setFilterFids(list(fids))
+        nuevas = {f.id(): compilar_feature(f, self.campo) for f in self.layer.getFeatures(req)}
+
+        quitados, intervalos = [], []
+        for fid in fids:
+            vieja = self._rutas.pop(fid, None)
+            if vieja is not None:
+                caja = vieja.caja()
+                if caja is not None:
+                    f = QgsFeature(fid)
+                    f.setGeometry(QgsGeometry.fromRect(QgsRectangle(*caja)))
+                    self._indice.deleteFeature(f)
+                self._segmentos.quitar(fid)
+                if vieja.via:
+                    quitados.append((vieja.via, fid))
+            ruta = nuevas.get(fid)
+            if ruta is None:
+                continue  # feature borrada
+            self._rutas[fid] = ruta
+            caja = ruta.caja()
+            if caja is None:
+                continue
+            self._indice.addFeature(fid, QgsRectangle(*caja))
+            self._segmentos.agregar(ruta)
+            if ruta.via:
+                intervalos.extend((ruta.via, a, b, fid, parte) for parte, a, b in ruta.rangos_m())
+        afectadas = {via for via, _ in quitados} | {it[0] for it in intervalos}
+        antes = {via for via in afectadas if via in self._vias}
+        actualizar_tramos(self._vias, quitados, intervalos)
+        for via in afectadas:
+            self._cadenas.pop(via, None)
+        if antes != {via for via in afectadas if via in self._vias}:
+            self._nombres = None  # han aparecido o desaparecido vías
+
+    def _edicion_guardada(self):
+        """Tras guardar la edición: descarta fids temporales y reescribe la caché en disco."""
+        self._editados.clear()
+        if not self.listo():
+            return
+        # Aplicar ya los cambios pendientes para que la caché guardada los incluya
+        fids = self._cambios | {fid for fid in self._rutas if fid < 0}
+        self._cambios = set()
+        if fids:
+            self._aplicar(fids)
+        clave = clave_capa(self.layer, self.campo)
+        if clave and self._tarea_guardar is None:
+            self._tarea_guardar = TareaGuardarPK(self, CacheDisco(clave))
+            self._tarea_guardar.taskCompleted.connect(self._fin_guardar)
+            self._tarea_guardar.taskTerminated.connect(self._fin_guardar)
+            QgsApplication.taskManager().addTask(self._tarea_guardar)
+
+    def _edicion_descartada(self):
+        """
+        Tras descartar la edición: vuelve a leer de la capa todas las features
+        tocadas durante la sesión, de modo que recuperan su geometría y vía
+        originales y las añadidas (fids temporales) desaparecen de los índices.
+        """
+        fids = self._cambios | self._editados | {fid for fid in self._rutas if fid < 0}
+        self._cambios = set()
+        self._editados.clear()
+        if fids:
+            self._aplicar(fids)
+
+    def _fin_guardar(self):
+        self._tarea_guardar = None
+
+
+_MOTORES = {}  # (layer id, campo) -> MotorPK
+
+
+def motor_para_capa(layer, campo):
+    """Devuelve el MotorPK compartido de la capa, creándolo si no existe."""
+    key = (layer.id(), campo)
+    motor = _MOTORES.get(key)
+    if motor is None:
+        motor = MotorPK(layer, campo)
+        _MOTORES[key] = motor
+        motor.conectar_capa()
+        layer.willBeDeleted.connect(lambda k=key: _MOTORES.pop(k, None))
+    return motor
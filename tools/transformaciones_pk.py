@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Transformaciones de coordenadas compartidas por las herramientas de PK Tools
+
+Cada clic necesitaba hasta tres QgsCoordinateTransform (mapa -> capa,
+capa -> mapa y mapa -> WGS84). Este servicio las crea una sola vez por
+pareja de CRS y las reutiliza hasta que cambian el CRS o el contexto de
+transformación del proyecto. También ofrece la transformación en bloque de
+arrays de coordenadas para los procesos por lotes.
+"""
+
+# -------------------------------
+# IMPORTS
+# -------------------------------
+from qgis.core import (
+    QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsLineString, QgsPointXY, QgsProject
+)
+
+CRS_WGS84 = QgsCoordinateReferenceSystem("EPSG:4326")
+
+
+def _clave_crs(crs):
+    """Clave barata de un CRS: su authid, o el WKT sólo para CRS personalizados sin código."""
+    return crs.authid() or crs.toWkt()
+
+
+def transformar_xy(xf, xs, ys):
+    """
+    Transforma en bloque listas de coordenadas con `xf` y devuelve (xs, ys).
+    Una QgsLineString se transforma con una única llamada nativa sobre todos
+    sus vértices, en lugar de una llamada de Python por punto.
+    """
+    if xf is None or not xs:
+        return list(xs), list(ys)
+    if len(xs) == 1:
+        pt = xf.transform(QgsPointXY(xs[0], ys[0]))
+        return [pt.x()], [pt.y()]
+    linea = QgsLineString(list(xs), list(ys))
+    linea.transform(xf)
+    return linea.xVector(), linea.yVector()
+
+
+class ServicioTransformaciones:
+    """
+    Caché de QgsCoordinateTransform por (CRS origen, CRS destino). Las
+    transformaciones se crean con el contexto de transformación vigente y la
+    caché se vacía en cuanto el contexto del proyecto deja de ser ese.
+    """
+
+    def __init__(self, proyecto=None):
+        self.proyecto = proyecto or QgsProject.instance()
+        self._cache = {}
+        self._contexto = self.proyecto.transformContext()
+        self.proyecto.crsChanged.connect(self.invalidar)
+        self.proyecto.transformContextChanged.connect(self.invalidar)
+        self.proyecto.cleared.connect(self.invalidar)
+
+    def invalidar(self):
+        self._cache.clear()
+        self._contexto = self.proyecto.transformContext()
+
+    def transformacion(self, origen, destino):
+        """QgsCoordinateTransform de `origen` a `destino`, o None si los CRS coinciden."""
+        if origen == destino:
+            return None
+        contexto = self.proyecto.transformContext()
+        if contexto != self._contexto:
+            self.invalidar()
+        clave = (_clave_crs(origen), _clave_crs(destino))
+        xf = self._cache.get(clave)
+        if xf is None:
+            xf = QgsCoordinateTransform(origen, destino, self._contexto)
+            self._cache[clave] = xf
+        return xf
+
+    def transformar(self, punto, origen, destino):
+        """Transforma un QgsPointXY; lo devuelve tal cual si los CRS coinciden."""
+        xf = self.transformacion(origen, destino)
+        return QgsPointXY(punto) if xf is None else xf.transform(punto)
+
+    def a_wgs84(self, punto, origen):
+        """Punto en EPSG:4326 (lon, lat), p. ej. para enlaces a Street View."""
+        return self.transformar(punto, origen, CRS_WGS84)
+
+    def transformar_xy(self, xs, ys, origen, destino):
+        """Transformación en bloque de listas de coordenadas (ver transformar_xy)."""
+        return transformar_xy(self.transformacion(origen, destino), xs, ys)
+
+
+_SERVICIO = None
+
+
+def transformaciones():
+    """Servicio de transformaciones compartido por todas las herramientas."""
+    global _SERVICIO
+    if _SERVICIO is None:
+        _SERVICIO = ServicioTransformaciones()
+    return _SERVICIO